@@ -1,12 +1,18 @@
 """
 Aplicación Flask con SQLite para anotación colaborativa con JWT Auth
 """
-from flask import Flask, render_template, send_from_directory, session, redirect, request
+from flask import Flask, Response, render_template, send_file, send_from_directory, session, redirect, request
 import os
 import logging
 from config import Config
-from routes.sqlite_api_routes_jwt import api_bp  # Cambiado a JWT
+from routes.sqlite_api_routes_jwt import api_bp, db_service  # Cambiado a JWT
 from models.database import DatabaseManager
+from services.image_service import image_service
+from services.image_pack_service import image_pack_service
+from services.image_store import image_store
+from services.image_variant_service import image_variant_service, VARIANT_FORMATS
+from services.database_service import close_request_sessions
+from services.json_provider import init_json_provider
 
 # Configurar logger para este módulo
 logger = logging.getLogger(__name__)
@@ -14,6 +20,8 @@ logger = logging.getLogger(__name__)
 def create_app():
     """Factory para crear la aplicación Flask con SQLite y JWT"""
     app = Flask(__name__)
+    # jsonify con orjson (o json estándar si no está instalado)
+    init_json_provider(app)
     
     # Cargar configuración
     config = Config.from_env()
@@ -58,10 +66,17 @@ def create_app():
     db_manager = DatabaseManager(config.DATABASE_URL)
     db_manager.create_tables()
     db_manager.init_admin_user()
+    # Agregados materializados aún sin poblar (BD existente o reconstrucción previa fallida)
+    db_service.ensure_materialized_stats()
     logger.info("Base de datos inicializada correctamente")
     
+    # ETags de imágenes precalculados (images.content_hash); el resto se calcula en el primer uso
+    image_service.load_hash_index(db_service.get_image_hashes())
+    
     # Registrar blueprints
     app.register_blueprint(api_bp)
+    # Una sesión de base de datos por petición, cerrada al terminar
+    app.teardown_appcontext(close_request_sessions)
     logger.debug("Blueprint de API registrado")
     
     # Importar decoradores de autenticación
@@ -106,19 +121,69 @@ def create_app():
             return send_from_directory(os.path.join(app.root_path, 'static', 'icons'), 'favicon.svg', mimetype='image/svg+xml')
         except Exception:
             # Fallback: 204 No Content to avoid log noise if file missing
-            from flask import Response
             return Response(status=204)
 
+    def send_cached_image(etag, send):
+        """Respuesta de imagen inmutable: 304 sin leer la imagen si el cliente ya tiene la versión"""
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        else:
+            response = send()
+        # send_file sin max_age marca no-cache: obligaría a revalidar en cada carga
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = config.IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = config.IMAGE_CACHE_IMMUTABLE
+        return response
+    
     @app.route('/images/<filename>')
     def serve_image(filename):
-        """Servir imágenes"""
+        """Servir imágenes (ETag por contenido, caché inmutable y 304 condicional) desde el
+        almacén configurado en IMAGE_STORE.
+        Con ?w=<ancho> y/o ?fmt=webp|jpeg|png se sirve una variante reducida/convertida."""
         logger.debug(f"Sirviendo imagen: {filename}")
         try:
-            return send_from_directory(config.IMAGES_FOLDER, filename)
+            width = request.args.get('w', type=int)
+            fmt = request.args.get('fmt')
+            if (width is not None and width <= 0) or (fmt is not None and fmt not in VARIANT_FORMATS):
+                return f"Invalid variant (w > 0, fmt in {', '.join(VARIANT_FORMATS)})", 400
+            
+            if width is not None or fmt is not None:
+                info = image_service.get_file_info(filename)
+                if info is None:
+                    return "Image not found", 404
+                width = image_variant_service.normalize_width(width) if width is not None else None
+                variant = image_variant_service.get_variant(info, width, fmt)
+                if variant is not None:
+                    return send_cached_image(variant.etag, lambda: send_file(
+                        variant.path, mimetype=variant.mimetype, conditional=True, etag=variant.etag,
+                        max_age=config.IMAGE_CACHE_MAX_AGE))
+            
+            image = image_store.lookup(filename)
+            if image is None:
+                return "Image not found", 404
+            return send_cached_image(image.etag, lambda: image_store.send(image))
         except Exception as e:
             logger.error(f"Error sirviendo imagen {filename}: {e}")
             return "Image not found", 404
     
+    @app.route('/images/packs/<pack_id>')
+    def serve_image_pack(pack_id):
+        """Servir un paquete de imágenes (inmutable; admite Range para descargas parciales)"""
+        pack = image_pack_service.get_pack(pack_id)
+        if pack is None:
+            return "Pack not found", 404
+        # conditional=True: 304 con If-None-Match y 206 con Range
+        response = send_file(
+            pack.path, mimetype='application/octet-stream', conditional=True,
+            etag=pack.pack_id, max_age=config.IMAGE_CACHE_MAX_AGE
+        )
+        response.cache_control.immutable = True
+        # Werkzeug solo lo anuncia al responder un Range; el cliente lo necesita de antemano
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    
     # Información de inicio
     logger.info("=== Aplicación SQLite con JWT iniciada ===")
     logger.info(f"Servidor: http://localhost:{config.PORT}")
@@ -23,6 +23,7 @@ class Config:
     JWT_SECRET_KEY: str = None
     JWT_ACCESS_TOKEN_EXPIRES: int = 60  # minutos (1 hora)
     JWT_REFRESH_TOKEN_EXPIRES: int = 30  # días
+    JWT_VERIFY_CACHE_SIZE: int = 10000  # tokens de acceso ya verificados por proceso (0 = sin caché)
     
     # Flask session secret
     FLASK_ENV: str = "development"  # development, production
@@ -37,6 +38,64 @@ class Config:
 
     # DB Configuración
     DATABASE_URL: str = "sqlite:///labeling_app.db"
+    # Pool de conexiones por proceso (PostgreSQL); total = workers * (POOL_SIZE + MAX_OVERFLOW)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: int = 30  # segundos esperando una conexión libre
+    DB_POOL_RECYCLE: int = 1800  # segundos antes de renovar una conexión
+    DB_POOL_PRE_PING: bool = True
+    # statement_timeout de PostgreSQL para todas las conexiones del proceso (0 = sin límite).
+    # Opcional: también alcanza a las reconstrucciones al arrancar y a los scripts de utils/,
+    # que recorren tablas completas; córralos con DB_STATEMENT_TIMEOUT_MS=0
+    DB_STATEMENT_TIMEOUT_MS: int = 0
+    # Ajustes de SQLite aplicados a cada conexión
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+
+    # Caché por proceso de la identidad de usuarios (/me, /refresh)
+    USER_CACHE_TTL_SECONDS: int = 60  # 0 = sin caché
+    USER_CACHE_SIZE: int = 10000
+
+    # Caché HTTP de /images/<filename>: ETag = hash del contenido; los recortes no cambian
+    IMAGE_CACHE_MAX_AGE: int = 31536000  # segundos (1 año)
+    IMAGE_CACHE_IMMUTABLE: bool = True
+
+    # Paquetes de imágenes (un archivo con varios recortes, ver services/image_pack_service.py)
+    IMAGE_PACK_FOLDER: str = "cache/image_packs"
+    IMAGE_PACK_MAX_IMAGES: int = 200
+    IMAGE_PACK_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # Variantes de imágenes (miniaturas / WebP) generadas bajo demanda; requiere Pillow
+    IMAGE_VARIANT_FOLDER: str = "cache/image_variants"
+    IMAGE_VARIANT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    IMAGE_VARIANT_QUALITY: int = 80
+
+    # Almacén de imágenes de /images: filesystem, mmap (archivo único, ver utils/build_image_store.py)
+    # o accel (X-Accel-Redirect: el proxy inverso envía el archivo)
+    IMAGE_STORE: str = "filesystem"
+    IMAGE_STORE_PATH: str = "cache/images.store"
+    IMAGE_ACCEL_PREFIX: str = "/protected-images"
+
+    # Importación masiva de imágenes (utils/ingest_images.py y /admin/images/ingest)
+    IMAGE_INGEST_ROOT: str = "data"  # el endpoint solo lee directorios dentro de esta carpeta
+    IMAGE_INGEST_WORKERS: int = 0  # procesos para hashear (0 = núcleos disponibles)
+    IMAGE_INGEST_BATCH_SIZE: int = 2000
+
+    # Cola de tareas: segundos que una tarea entregada queda reservada
+    TASK_LEASE_SECONDS: int = 300
+
+    # Despacho de notificaciones en segundo plano
+    NOTIFICATION_QUEUE_SIZE: int = 1000  # mensajes en espera; si se llena se descartan los nuevos
+    NOTIFICATION_BATCH_WINDOW_SECONDS: float = 2.0  # ventana para agrupar mensajes del mismo chat
+    NOTIFICATION_MAX_RETRIES: int = 5
+    NOTIFICATION_RETRY_BACKOFF_SECONDS: float = 2.0  # espera base, se duplica en cada reintento
+
+    # Estado compartido entre workers (rate limits, anti-spam de notificaciones)
+    STATE_BACKEND: str = "database"  # database (tabla state_entries), redis o memory (solo por proceso)
+    STATE_REDIS_URL: str = "redis://localhost:6379/0"
+    STATE_MEMORY_MAX_KEYS: int = 100000  # tope del backend en memoria (se descartan las menos usadas)
 
     @classmethod
     def from_env(cls):
@@ -58,7 +117,42 @@ class Config:
             LOG_FILE=os.getenv('LOG_FILE', cls.LOG_FILE),
             LOG_MAX_BYTES=int(os.getenv('LOG_MAX_BYTES', cls.LOG_MAX_BYTES)),
             LOG_BACKUP_COUNT=int(os.getenv('LOG_BACKUP_COUNT', cls.LOG_BACKUP_COUNT)),
-            DATABASE_URL=os.getenv('DATABASE_URL', cls.DATABASE_URL)
+            DATABASE_URL=os.getenv('DATABASE_URL', cls.DATABASE_URL),
+            DB_POOL_SIZE=int(os.getenv('DB_POOL_SIZE', cls.DB_POOL_SIZE)),
+            DB_MAX_OVERFLOW=int(os.getenv('DB_MAX_OVERFLOW', cls.DB_MAX_OVERFLOW)),
+            DB_POOL_TIMEOUT=int(os.getenv('DB_POOL_TIMEOUT', cls.DB_POOL_TIMEOUT)),
+            DB_POOL_RECYCLE=int(os.getenv('DB_POOL_RECYCLE', cls.DB_POOL_RECYCLE)),
+            DB_POOL_PRE_PING=os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true',
+            DB_STATEMENT_TIMEOUT_MS=int(os.getenv('DB_STATEMENT_TIMEOUT_MS', cls.DB_STATEMENT_TIMEOUT_MS)),
+            SQLITE_JOURNAL_MODE=os.getenv('SQLITE_JOURNAL_MODE', cls.SQLITE_JOURNAL_MODE).upper(),
+            SQLITE_SYNCHRONOUS=os.getenv('SQLITE_SYNCHRONOUS', cls.SQLITE_SYNCHRONOUS).upper(),
+            SQLITE_MMAP_SIZE=int(os.getenv('SQLITE_MMAP_SIZE', cls.SQLITE_MMAP_SIZE)),
+            SQLITE_BUSY_TIMEOUT_MS=int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', cls.SQLITE_BUSY_TIMEOUT_MS)),
+            IMAGE_CACHE_MAX_AGE=int(os.getenv('IMAGE_CACHE_MAX_AGE', cls.IMAGE_CACHE_MAX_AGE)),
+            IMAGE_CACHE_IMMUTABLE=os.getenv('IMAGE_CACHE_IMMUTABLE', 'True').lower() == 'true',
+            IMAGE_PACK_FOLDER=os.getenv('IMAGE_PACK_FOLDER', cls.IMAGE_PACK_FOLDER),
+            IMAGE_PACK_MAX_IMAGES=int(os.getenv('IMAGE_PACK_MAX_IMAGES', cls.IMAGE_PACK_MAX_IMAGES)),
+            IMAGE_PACK_CACHE_MAX_BYTES=int(os.getenv('IMAGE_PACK_CACHE_MAX_BYTES', cls.IMAGE_PACK_CACHE_MAX_BYTES)),
+            IMAGE_VARIANT_FOLDER=os.getenv('IMAGE_VARIANT_FOLDER', cls.IMAGE_VARIANT_FOLDER),
+            IMAGE_VARIANT_CACHE_MAX_BYTES=int(os.getenv('IMAGE_VARIANT_CACHE_MAX_BYTES', cls.IMAGE_VARIANT_CACHE_MAX_BYTES)),
+            IMAGE_VARIANT_QUALITY=int(os.getenv('IMAGE_VARIANT_QUALITY', cls.IMAGE_VARIANT_QUALITY)),
+            IMAGE_STORE=os.getenv('IMAGE_STORE', cls.IMAGE_STORE).lower(),
+            IMAGE_STORE_PATH=os.getenv('IMAGE_STORE_PATH', cls.IMAGE_STORE_PATH),
+            IMAGE_ACCEL_PREFIX=os.getenv('IMAGE_ACCEL_PREFIX', cls.IMAGE_ACCEL_PREFIX),
+            IMAGE_INGEST_ROOT=os.getenv('IMAGE_INGEST_ROOT', cls.IMAGE_INGEST_ROOT),
+            IMAGE_INGEST_WORKERS=int(os.getenv('IMAGE_INGEST_WORKERS', cls.IMAGE_INGEST_WORKERS)),
+            IMAGE_INGEST_BATCH_SIZE=int(os.getenv('IMAGE_INGEST_BATCH_SIZE', cls.IMAGE_INGEST_BATCH_SIZE)),
+            TASK_LEASE_SECONDS=int(os.getenv('TASK_LEASE_SECONDS', cls.TASK_LEASE_SECONDS)),
+            NOTIFICATION_QUEUE_SIZE=int(os.getenv('NOTIFICATION_QUEUE_SIZE', cls.NOTIFICATION_QUEUE_SIZE)),
+            NOTIFICATION_BATCH_WINDOW_SECONDS=float(os.getenv('NOTIFICATION_BATCH_WINDOW_SECONDS', cls.NOTIFICATION_BATCH_WINDOW_SECONDS)),
+            NOTIFICATION_MAX_RETRIES=int(os.getenv('NOTIFICATION_MAX_RETRIES', cls.NOTIFICATION_MAX_RETRIES)),
+            NOTIFICATION_RETRY_BACKOFF_SECONDS=float(os.getenv('NOTIFICATION_RETRY_BACKOFF_SECONDS', cls.NOTIFICATION_RETRY_BACKOFF_SECONDS)),
+            USER_CACHE_TTL_SECONDS=int(os.getenv('USER_CACHE_TTL_SECONDS', cls.USER_CACHE_TTL_SECONDS)),
+            USER_CACHE_SIZE=int(os.getenv('USER_CACHE_SIZE', cls.USER_CACHE_SIZE)),
+            JWT_VERIFY_CACHE_SIZE=int(os.getenv('JWT_VERIFY_CACHE_SIZE', cls.JWT_VERIFY_CACHE_SIZE)),
+            STATE_BACKEND=os.getenv('STATE_BACKEND', cls.STATE_BACKEND).lower(),
+            STATE_REDIS_URL=os.getenv('STATE_REDIS_URL', cls.STATE_REDIS_URL),
+            STATE_MEMORY_MAX_KEYS=int(os.getenv('STATE_MEMORY_MAX_KEYS', cls.STATE_MEMORY_MAX_KEYS))
         )
     
     def setup_logging(self):
@@ -6,12 +6,37 @@ import os
 bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8080')}"
 backlog = 2048
 
-# Workers - configuración más conservadora
-workers = int(os.getenv('WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 16)))  # Máximo 8 workers
-worker_class = "sync"
-worker_connections = 1000
-timeout = 120
-keepalive = 2
+# Perfil de workers (WORKER_CLASS):
+#   sync    - un request por proceso; una exportación o llamada lenta ocupa el worker entero
+#   gthread - THREADS hilos por proceso; las esperas de I/O solo bloquean su hilo
+#   gevent  - WORKER_CONNECTIONS greenlets por proceso para miles de conexiones concurrentes
+#             (requiere gevent; con PostgreSQL instalar también psycogreen)
+# Con gthread/gevent conviene subir DB_POOL_SIZE/DB_MAX_OVERFLOW: las peticiones concurrentes
+# de un mismo proceso comparten su pool de conexiones.
+worker_class = os.getenv('WORKER_CLASS', 'sync').lower()
+if worker_class not in ('sync', 'gthread', 'gevent'):
+    raise ValueError(f"WORKER_CLASS inválido: {worker_class} (use sync, gthread o gevent)")
+
+if worker_class == 'gevent':
+    # Parchear antes de que preload_app importe la aplicación (sockets, ssl, threading)
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        # psycopg2 es una extensión en C: sin este callback sus consultas bloquean el proceso entero
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        if os.getenv('DATABASE_URL', '').startswith('postgres'):
+            print("⚠️  psycogreen no instalado: las consultas a PostgreSQL bloquearán el worker gevent")
+
+# Workers: con hilos o greenlets la concurrencia la da cada proceso, basta uno por CPU
+default_workers = multiprocessing.cpu_count() * 2 + 1 if worker_class == 'sync' else multiprocessing.cpu_count()
+workers = int(os.getenv('WORKERS', min(default_workers, 16)))
+threads = int(os.getenv('THREADS', 8 if worker_class == 'gthread' else 1))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# Con workers asíncronos las conexiones keep-alive no ocupan un proceso
+keepalive = int(os.getenv('KEEPALIVE', 2 if worker_class == 'sync' else 5))
 
 # Restart workers after this many requests, with up to this much jitter
 max_requests = 1000
@@ -40,8 +65,25 @@ pidfile = None
 user = None
 group = None
 
+# Pools de conexiones y fork: con preload_app el maestro ya abrió conexiones al crear la app
+def when_ready(server):
+    """Cierra las conexiones del maestro antes de crear los workers"""
+    from models.database import dispose_engines
+    dispose_engines()
+
+def post_fork(server, worker):
+    """Cada worker descarta el pool heredado (sin cerrar sockets ajenos) y abre el suyo"""
+    from models.database import dispose_engines
+    dispose_engines(close=False)
+
 # SSL (descomentado para usar HTTPS)
 # keyfile = "/path/to/keyfile"
 # certfile = "/path/to/certfile"
 
-print(f"Gunicorn configurado: {workers} workers en {bind}")
+if worker_class == 'gthread':
+    concurrency = f"{threads} hilos"
+elif worker_class == 'gevent':
+    concurrency = f"{worker_connections} conexiones"
+else:
+    concurrency = "1 request"
+print(f"Gunicorn configurado: {workers} workers {worker_class} ({concurrency} por worker) en {bind}")
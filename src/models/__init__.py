@@ -1,6 +1,8 @@
 """
 Modelos de base de datos para la aplicación de anotación
 """
-from .database import User, Image, Annotation, DatabaseManager, Base
+from .database import User, Image, Annotation, UserAnnotationCounter, AnnotationAgreement, UserAgreementStats, StateEntry, DatabaseManager, Base, get_engine, dispose_engines
+from .dto import UserRow, TaskRow, PendingTaskRow, UserAnnotationRow, QualityControlRow
 
-__all__ = ['User', 'Image', 'Annotation', 'DatabaseManager', 'Base']
\ No newline at end of file
+__all__ = ['User', 'Image', 'Annotation', 'UserAnnotationCounter', 'AnnotationAgreement', 'UserAgreementStats', 'StateEntry', 'DatabaseManager', 'Base', 'get_engine', 'dispose_engines',
+           'UserRow', 'TaskRow', 'PendingTaskRow', 'UserAnnotationRow', 'QualityControlRow']
\ No newline at end of file
@@ -2,11 +2,20 @@
 Modelos de base de datos SQLite para la aplicación de anotación colaborativa
 """
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy import (create_engine, event, func, inspect, text, select, update, insert, literal, null, Column,
+                        Integer, BigInteger, String, Text, DateTime, Float, Boolean, ForeignKey, Index)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, relationship
 from werkzeug.security import generate_password_hash, check_password_hash
+import logging
 import os
+import random
+import threading
+from config import Config
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -59,10 +68,23 @@ class Image(Base):
     id = Column(Integer, primary_key=True)
     image_path = Column(String(255), nullable=False)
     initial_ocr_text = Column(Text, nullable=False)
+    # Clave aleatoria precalculada para muestreo sin ORDER BY random()
+    random_key = Column(Float, nullable=True, default=random.random)
+    # SHA-256 del archivo (ETag de /images y detección de duplicados); NULL si aún no se calculó
+    content_hash = Column(String(64), nullable=True)
+    # Anotaciones completadas (corrected/approved/discarded) de la imagen, materializado
+    completed_annotations = Column(Integer, nullable=False, default=0)
     
     # Relaciones
     annotations = relationship('Annotation', back_populates='image')
     
+    __table_args__ = (
+        Index('idx_image_random_key', 'random_key'),
+        Index('idx_image_content_hash', 'content_hash'),
+        Index('idx_image_path', 'image_path'),
+        Index('idx_image_completed_annotations', 'completed_annotations'),
+    )
+    
     def to_dict(self):
         """Convierte la imagen a diccionario"""
         return {
@@ -83,8 +105,12 @@ class Annotation(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     corrected_text = Column(Text, nullable=True)
     status = Column(String(20), nullable=False, default='pending')  # 'pending', 'corrected', 'approved', 'discarded'
-    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.now(timezone.utc))
-
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Lease de la tarea: momento en que /task/next la entregó (NULL = libre)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    # Posición en el feed de cambios, asignada al confirmar (ver stamp_annotation_changes);
+    # toda escritura la vuelve NULL y el commit le asigna el siguiente valor en orden de commit
+    change_seq = Column(BigInteger, nullable=True, onupdate=null())
 
     # Relaciones
     image = relationship('Image', back_populates='annotations')
@@ -98,6 +124,14 @@ class Annotation(Base):
         Index('idx_annotation_user_status', 'user_id', 'status'),
         Index('idx_annotation_status_image', 'status', 'image_id'),
         Index('idx_annotation_updated_at', 'updated_at'),
+        # Cola de tareas: orden determinista por id dentro de (usuario, estado)
+        Index('idx_annotation_user_status_id', 'user_id', 'status', 'id'),
+        # Listado paginado de anotaciones de un usuario por fecha
+        Index('idx_annotation_user_updated_at', 'user_id', 'updated_at', 'id'),
+        # Un usuario no puede tener dos veces la misma imagen asignada
+        Index('uq_annotation_user_image', 'user_id', 'image_id', unique=True),
+        # Feed incremental de cambios (/admin/export/annotations/changes)
+        Index('idx_annotation_change_seq', 'change_seq'),
     )
     
     def update_status(self, status, corrected_text=None):
@@ -106,6 +140,8 @@ class Annotation(Base):
         if corrected_text is not None:
             self.corrected_text = corrected_text
         self.updated_at = datetime.now(timezone.utc)
+        # Cualquier cambio de estado libera el lease de la tarea
+        self.claimed_at = None
     
     def to_dict(self):
         """Convierte la anotación a diccionario"""
@@ -116,7 +152,6 @@ class Annotation(Base):
             'corrected_text': self.corrected_text,
             'status': self.status,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
-
         }
     
     def to_dict_with_relations(self, user_dict=None, image_dict=None):
@@ -128,18 +163,364 @@ class Annotation(Base):
             result['image'] = image_dict
         return result
 
+class UserAnnotationCounter(Base):
+    """Contador materializado de anotaciones por usuario y estado"""
+    __tablename__ = 'user_annotation_counters'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    # Última vez que una anotación del usuario pasó a este estado
+    last_activity = Column(DateTime(timezone=True), nullable=True)
+    
+    def __repr__(self):
+        return f'<UserAnnotationCounter {self.user_id}:{self.status}={self.count}>'
+
+class AnnotationAgreement(Base):
+    """Resultado materializado de comparar la anotación de un usuario con la del admin"""
+    __tablename__ = 'annotation_agreements'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    image_id = Column(Integer, ForeignKey('images.id'), primary_key=True)
+    agrees = Column(Boolean, nullable=False)
+    
+    __table_args__ = (
+        # Las actualizaciones incrementales recalculan por imagen
+        Index('idx_annotation_agreement_image_id', 'image_id'),
+    )
+    
+    def __repr__(self):
+        return f'<AnnotationAgreement {self.user_id}:{self.image_id}={self.agrees}>'
+
+class UserAgreementStats(Base):
+    """Totales materializados de agreement con el admin por usuario"""
+    __tablename__ = 'user_agreement_stats'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    comparisons = Column(Integer, nullable=False, default=0)
+    agreements = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UserAgreementStats {self.user_id}: {self.agreements}/{self.comparisons}>'
+
+class SequenceCounter(Base):
+    """Contador con nombre; su fila se bloquea hasta el commit de quien la incrementa"""
+    __tablename__ = 'sequence_counters'
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SequenceCounter {self.name}={self.value}>'
+
+class AnnotationDeletion(Base):
+    """Lápida de una anotación eliminada, para que el feed de cambios también informe los borrados"""
+    __tablename__ = 'annotation_deletions'
+    
+    id = Column(Integer, primary_key=True)
+    # Sin claves foráneas: el usuario o la imagen pueden eliminarse junto con la anotación
+    annotation_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    image_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Posición en el feed de cambios, compartida con annotations.change_seq
+    change_seq = Column(BigInteger, nullable=True)
+    
+    __table_args__ = (
+        Index('idx_annotation_deletion_change_seq', 'change_seq'),
+    )
+    
+    def __repr__(self):
+        return f'<AnnotationDeletion {self.annotation_id}@{self.change_seq}>'
+
+ANNOTATION_CHANGES_SEQUENCE = 'annotation_changes'
+# Filas de sequence_counters que marcan un agregado materializado ya poblado; se escriben en el
+# mismo commit que su reconstrucción, así que faltan mientras no haya una completa
+USER_COUNTERS_BUILT = 'user_counters_built'
+AGREEMENTS_BUILT = 'agreements_built'
+# Marca en session.info de las transacciones que escribieron anotaciones
+ANNOTATION_CHANGES_KEY = 'annotation_changes'
+
+def mark_annotation_changes(session):
+    """Indica que la transacción escribió anotaciones fuera del ORM (UPDATE/INSERT masivos),
+    para que stamp_annotation_changes les asigne change_seq al confirmar"""
+    session.info[ANNOTATION_CHANGES_KEY] = True
+
+def record_annotation_deletions(session, *criteria) -> int:
+    """Deja una lápida por cada anotación que cumple los criterios; llamar antes de eliminarlas,
+    en la misma transacción. Retorna cuántas lápidas se escribieron"""
+    written = session.execute(
+        insert(AnnotationDeletion).from_select(
+            ['annotation_id', 'user_id', 'image_id', 'deleted_at'],
+            select(Annotation.id, Annotation.user_id, Annotation.image_id,
+                   literal(datetime.now(timezone.utc), DateTime(timezone=True))).where(*criteria)
+        )
+    ).rowcount
+    if written:
+        mark_annotation_changes(session)
+    return written
+
+def track_annotation_flushes(session, flush_context):
+    """after_flush: marca la transacción si el flush insertó o modificó objetos Annotation"""
+    if any(isinstance(obj, Annotation) for obj in session.new) or \
+            any(isinstance(obj, Annotation) and session.is_modified(obj) for obj in session.dirty):
+        mark_annotation_changes(session)
+
+def stamp_annotation_changes(session):
+    """Asigna change_seq a las anotaciones escritas en la transacción, justo antes del commit.
+
+    Solo actúa en las transacciones que escribieron anotaciones (objetos Annotation nuevos o
+    modificados, o marcadas con mark_annotation_changes); el resto de los commits no paga nada.
+    Incrementar la fila del contador la bloquea hasta el commit (en SQLite las escrituras ya
+    están serializadas), así que los números se reparten en orden de commit: una transacción
+    larga nunca confirma cambios por detrás de un cursor que los consumidores ya pasaron.
+    """
+    # Sin objetos pendientes el flush no emite SQL
+    session.flush()
+    if not session.info.pop(ANNOTATION_CHANGES_KEY, False):
+        return
+    pending_annotations = session.scalar(
+        select(func.count()).select_from(Annotation).where(Annotation.change_seq.is_(None))
+    )
+    pending_deletions = session.scalar(
+        select(func.count()).select_from(AnnotationDeletion).where(AnnotationDeletion.change_seq.is_(None))
+    )
+    pending = pending_annotations + pending_deletions
+    if not pending:
+        return
+    last = session.execute(
+        update(SequenceCounter)
+        .where(SequenceCounter.name == ANNOTATION_CHANGES_SEQUENCE)
+        .values(value=SequenceCounter.value + pending)
+        .returning(SequenceCounter.value)
+    ).scalar_one_or_none()
+    if last is None:
+        # Sin fila del contador (p. ej. borrada a mano): se recrea a partir del mayor change_seq
+        last = max(
+            session.scalar(select(func.max(Annotation.change_seq))) or 0,
+            session.scalar(select(func.max(AnnotationDeletion.change_seq))) or 0
+        ) + pending
+        session.add(SequenceCounter(name=ANNOTATION_CHANGES_SEQUENCE, value=last))
+        session.flush()
+        logger.warning(f"Contador {ANNOTATION_CHANGES_SEQUENCE} recreado en {last}")
+    # Un solo UPDATE por tabla numera el bloque reservado en orden de id, sin traer las filas a Python;
+    # las lápidas van después de las escrituras de la misma transacción
+    base = last - pending
+    for table, count, offset in (('annotations', pending_annotations, 0),
+                                 ('annotation_deletions', pending_deletions, pending_annotations)):
+        if not count:
+            continue
+        session.execute(text(
+            f"UPDATE {table} SET change_seq = :base + ranked.position FROM ("
+            f"SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS position FROM {table} "
+            f"WHERE change_seq IS NULL"
+            f") AS ranked WHERE ranked.id = {table}.id"
+        ), {'base': base + offset})
+
+def _clear_annotation_changes(session):
+    session.info.pop(ANNOTATION_CHANGES_KEY, None)
+
+class StateEntry(Base):
+    """Estado efímero compartido entre workers (rate limits, anti-spam) con expiración"""
+    __tablename__ = 'state_entries'
+    
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+    # Epoch en segundos; las filas vencidas se ignoran y se purgan periódicamente
+    expires_at = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_state_entry_expires_at', 'expires_at'),
+    )
+    
+    def __repr__(self):
+        return f'<StateEntry {self.key}>'
+
+# Engines compartidos por proceso, uno por URL: todos los DatabaseManager/DatabaseService
+# de un worker usan el mismo pool en lugar de abrir uno cada uno
+_engines = {}
+_engines_lock = threading.Lock()
+
+SQLITE_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SQLITE_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+def get_engine(database_url: str, config: Config = None):
+    """Obtiene (o crea) el engine compartido para una URL, configurado desde Config"""
+    with _engines_lock:
+        engine = _engines.get(database_url)
+        if engine is None:
+            engine = _create_engine(database_url, config or Config.from_env())
+            _engines[database_url] = engine
+        return engine
+
+def dispose_engines(close: bool = True):
+    """Descarta los pools de todos los engines.
+
+    Tras un fork (gunicorn con preload_app) el hijo debe llamar con close=False:
+    abandona las conexiones heredadas sin cerrarlas, ya que siguen siendo del padre.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose(close=close)
+
+def _create_engine(database_url: str, config: Config):
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite':
+        engine = create_engine(database_url, echo=False)
+        _configure_sqlite(engine, config)
+    else:
+        connect_args = {}
+        # statement_timeout por conexión (libpq: psycopg2/psycopg)
+        if config.DB_STATEMENT_TIMEOUT_MS and url.get_driver_name() in ('psycopg2', 'psycopg'):
+            connect_args['options'] = f"-c statement_timeout={config.DB_STATEMENT_TIMEOUT_MS}"
+        engine = create_engine(
+            database_url,
+            echo=False,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_pre_ping=config.DB_POOL_PRE_PING,
+            connect_args=connect_args
+        )
+    logger.info(f"Engine creado para {url.render_as_string(hide_password=True)} (pool: {engine.pool.status()})")
+    return engine
+
+def _configure_sqlite(engine, config: Config):
+    """Aplica los PRAGMA de rendimiento de SQLite a cada conexión nueva"""
+    journal_mode = config.SQLITE_JOURNAL_MODE
+    synchronous = config.SQLITE_SYNCHRONOUS
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE inválido: {journal_mode}")
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {synchronous}")
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL permite lectores concurrentes con un escritor; NORMAL es seguro con WAL
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+            cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        finally:
+            cursor.close()
+
 class DatabaseManager:
     """Manejador de la base de datos"""
     
     def __init__(self, database_url=None):
         if database_url is None:
             database_url = os.getenv("DATABASE_URL", "sqlite:///labeling_app.db")
-        self.engine = create_engine(database_url, echo=False)
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.engine = get_engine(database_url)
+        # expire_on_commit=False: los objetos cargados siguen legibles tras commit/close
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=self.engine)
+        event.listen(self.SessionLocal, 'after_flush', track_annotation_flushes)
+        event.listen(self.SessionLocal, 'before_commit', stamp_annotation_changes)
+        event.listen(self.SessionLocal, 'after_rollback', _clear_annotation_changes)
         
     def create_tables(self):
         """Crea todas las tablas"""
         Base.metadata.create_all(bind=self.engine)
+        self.upgrade_schema()
+
+    def upgrade_schema(self):
+        """Agrega columnas e índices nuevos a tablas existentes (create_all no altera tablas ya creadas)"""
+        inspector = inspect(self.engine)
+        preparer = self.engine.dialect.identifier_preparer
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.quote(table.name)} "
+                        f"ADD COLUMN {preparer.quote(column.name)} {column_type}"
+                    ))
+                    logger.info(f"Columna agregada: {table.name}.{column.name}")
+                    self._backfill_column(conn, table.name, column.name)
+
+        with self.engine.begin() as conn:
+            # Imágenes insertadas sin pasar por el ORM (SQL directo, herramientas externas)
+            filled = self._fill_random_keys(conn)
+            if filled:
+                logger.info(f"Claves aleatorias asignadas a {filled} imágenes que no tenían")
+            # El contador del feed de cambios parte del mayor change_seq existente, incluidas las lápidas
+            conn.execute(text(
+                "INSERT INTO sequence_counters (name, value) "
+                "SELECT :name, (SELECT MAX(seq) FROM ("
+                "SELECT COALESCE(MAX(change_seq), 0) AS seq FROM annotations "
+                "UNION ALL SELECT COALESCE(MAX(change_seq), 0) FROM annotation_deletions"
+                ") AS sequences) "
+                "WHERE NOT EXISTS (SELECT 1 FROM sequence_counters WHERE name = :name)"
+            ), {'name': ANNOTATION_CHANGES_SEQUENCE})
+
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                if index.name == 'uq_annotation_user_image':
+                    duplicates = self.count_duplicate_annotations()
+                    if duplicates:
+                        # Nunca se borran anotaciones al arrancar: la limpieza es un paso explícito
+                        logger.error(
+                            f"Hay {duplicates} anotaciones repetidas por (usuario, imagen): no se crea "
+                            f"{index.name}. Corra utils/dedupe_annotations.py para respaldarlas y eliminarlas"
+                        )
+                        continue
+                try:
+                    index.create(bind=self.engine, checkfirst=True)
+                except Exception as e:
+                    if index.unique:
+                        # Sin el índice único, los INSERT ... ON CONFLICT dejan de deduplicar en silencio
+                        raise RuntimeError(f"No se pudo crear el índice único {index.name}: {e}") from e
+                    logger.warning(f"No se pudo crear el índice {index.name}: {e}")
+    
+    def count_duplicate_annotations(self) -> int:
+        """Anotaciones sobrantes por (user_id, image_id): las que habría que eliminar para crear
+        el índice único uq_annotation_user_image"""
+        with self.engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT COALESCE(SUM(copies - 1), 0) FROM ("
+                "SELECT COUNT(*) AS copies FROM annotations GROUP BY user_id, image_id HAVING COUNT(*) > 1"
+                ") duplicated"
+            )).scalar()
+        
+    def _backfill_column(self, conn, table_name, column_name):
+        """Inicializa los valores de columnas recién agregadas que los necesitan"""
+        if (table_name, column_name) == ('images', 'random_key'):
+            self._fill_random_keys(conn)
+            logger.info("Claves aleatorias de imágenes inicializadas")
+        elif (table_name, column_name) == ('annotations', 'change_seq'):
+            # Las anotaciones existentes entran al feed en orden (updated_at, id)
+            conn.execute(text(
+                "UPDATE annotations SET change_seq = ranked.position FROM ("
+                "SELECT id, ROW_NUMBER() OVER (ORDER BY updated_at, id) AS position FROM annotations"
+                ") AS ranked WHERE ranked.id = annotations.id"
+            ))
+            logger.info("Secuencia de cambios de anotaciones inicializada")
+        elif (table_name, column_name) == ('images', 'completed_annotations'):
+            conn.execute(text(
+                "UPDATE images SET completed_annotations = ("
+                "SELECT COUNT(*) FROM annotations WHERE annotations.image_id = images.id "
+                "AND annotations.status IN ('corrected', 'approved', 'discarded'))"
+            ))
+            logger.info("Contadores de anotaciones completadas por imagen inicializados")
+        
+    def _fill_random_keys(self, conn) -> int:
+        """Asigna random_key a las imágenes que no la tienen; retorna cuántas se completaron"""
+        if self.engine.dialect.name == 'sqlite':
+            random_expr = "(abs(random()) % 1000000000) / 1000000000.0"
+        else:
+            random_expr = "random()"
+        return conn.execute(text(f"UPDATE images SET random_key = {random_expr} WHERE random_key IS NULL")).rowcount
         
     def get_session(self):
         """Obtiene una sesión de base de datos"""
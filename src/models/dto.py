@@ -0,0 +1,111 @@
+"""
+DTOs de solo lectura para las consultas de lectura frecuente.
+
+Las consultas seleccionan solo las columnas necesarias y cada fila se envuelve en una
+tupla con nombre (sin __dict__, identity map ni estado de relaciones); to_dict()
+produce directamente el JSON de la API.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+# Longitud máxima de los textos en los listados de anotaciones del admin
+PREVIEW_TEXT_LENGTH = 100
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+def _truncate(value: Optional[str], length: int = PREVIEW_TEXT_LENGTH) -> Optional[str]:
+    return value[:length] + '...' if value and len(value) > length else value
+
+class UserRow(NamedTuple):
+    """Identidad de un usuario (sin hash de contraseña), apta para cachear entre peticiones"""
+    id: int
+    username: str
+    role: str
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'username': self.username, 'role': self.role}
+
+class TaskRow(NamedTuple):
+    """Tarea de un usuario: anotación con los datos de su imagen"""
+    annotation_id: int
+    image_id: int
+    image_path: str
+    initial_ocr_text: str
+    status: str
+    corrected_text: Optional[str]
+    updated_at: Optional[datetime]
+
+    def to_dict(self) -> dict:
+        return {
+            'annotation_id': self.annotation_id,
+            'image_id': self.image_id,
+            'image_path': self.image_path,
+            'initial_ocr_text': self.initial_ocr_text,
+            'status': self.status,
+            'corrected_text': self.corrected_text,
+            'updated_at': _iso(self.updated_at)
+        }
+
+class PendingTaskRow(NamedTuple):
+    """Entrada de la vista previa de tareas pendientes"""
+    annotation_id: int
+    image_id: int
+
+    def to_dict(self) -> dict:
+        return {'annotation_id': self.annotation_id, 'image_id': self.image_id}
+
+class UserAnnotationRow(NamedTuple):
+    """Anotación de un usuario en el panel de administración (textos recortados)"""
+    annotation_id: int
+    image_id: int
+    image_path: str
+    initial_ocr_text: str
+    corrected_text: Optional[str]
+    status: str
+    updated_at: Optional[datetime]
+
+    def to_dict(self) -> dict:
+        return {
+            'annotation_id': self.annotation_id,
+            'image_id': self.image_id,
+            'image_path': self.image_path,
+            'initial_ocr_text': _truncate(self.initial_ocr_text),
+            'corrected_text': _truncate(self.corrected_text),
+            'status': self.status,
+            'updated_at': _iso(self.updated_at)
+        }
+
+class QualityControlRow(NamedTuple):
+    """Discrepancia entre la anotación de un usuario y la del admin en la misma imagen"""
+    annotation_id: int
+    image_id: int
+    image_path: str
+    initial_ocr_text: str
+    user_id: int
+    username: str
+    user_text: Optional[str]
+    user_status: str
+    user_updated_at: Optional[datetime]
+    admin_annotation_id: int
+    admin_text: Optional[str]
+    admin_status: str
+    admin_updated_at: Optional[datetime]
+
+    def to_dict(self) -> dict:
+        return {
+            'annotation_id': self.annotation_id,
+            'image_id': self.image_id,
+            'image_path': self.image_path,
+            'initial_ocr_text': self.initial_ocr_text,
+            'user_id': self.user_id,
+            'username': self.username,
+            # Texto vacío o None se muestra como "NULL", igual que en la exportación
+            'user_annotation_text': self.user_text or "NULL",
+            'user_status': self.user_status,
+            'user_updated_at': _iso(self.user_updated_at),
+            'admin_annotation_id': self.admin_annotation_id,
+            'admin_annotation_text': self.admin_text or "NULL",
+            'admin_status': self.admin_status,
+            'admin_updated_at': _iso(self.admin_updated_at)
+        }
@@ -49,7 +49,7 @@ def logout():
 @login_required
 def get_current_user():
     """Obtiene información del usuario actual"""
-    user = db_service.get_user_by_id(session['user_id'])
+    user = db_service.get_cached_user(session['user_id'])
     if user:
         stats = db_service.get_user_stats(user.id)
         return jsonify({
@@ -68,13 +68,12 @@ def get_next_task():
     task_data = db_service.get_next_pending_task(user_id)
     
     if task_data:
-        annotation, image = task_data
         return jsonify({
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status
+            'annotation_id': task_data.annotation_id,
+            'image_id': task_data.image_id,
+            'image_path': task_data.image_path,
+            'initial_ocr_text': task_data.initial_ocr_text,
+            'status': task_data.status
         })
     else:
         return jsonify({'message': 'No pending tasks available'}), 204
@@ -89,15 +88,7 @@ def get_task_history():
     history = db_service.get_user_task_history(user_id, limit)
     
     return jsonify({
-        'history': [{
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status,
-            'corrected_text': annotation.corrected_text,
-            'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None
-        } for annotation, image in history]
+        'history': [task.to_dict() for task in history]
     })
 
 @sqlite_api_bp.route('/task/pending-preview', methods=['GET'])
@@ -110,10 +101,7 @@ def get_pending_preview():
     pending_tasks = db_service.get_pending_tasks_preview(user_id, limit)
     
     return jsonify({
-        'pending': [{
-            'annotation_id': annotation.id,
-            'image_id': image.id
-        } for annotation, image in pending_tasks]
+        'pending': [task.to_dict() for task in pending_tasks]
     })
 
 @sqlite_api_bp.route('/task/load/<int:annotation_id>', methods=['GET'])
@@ -125,14 +113,13 @@ def load_specific_task(annotation_id):
     task_data = db_service.get_specific_task(annotation_id, user_id)
     
     if task_data:
-        annotation, image = task_data
         return jsonify({
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status,
-            'corrected_text': annotation.corrected_text
+            'annotation_id': task_data.annotation_id,
+            'image_id': task_data.image_id,
+            'image_path': task_data.image_path,
+            'initial_ocr_text': task_data.initial_ocr_text,
+            'status': task_data.status,
+            'corrected_text': task_data.corrected_text
         })
     else:
         return jsonify({'error': 'Task not found or access denied'}), 404
@@ -203,11 +190,12 @@ def create_assignments():
     if not isinstance(user_ids, list) or not isinstance(image_ids, list):
         return jsonify({'error': 'user_ids and image_ids must be arrays'}), 400
     
-    assignments_created = db_service.assign_tasks(user_ids, image_ids)
+    result = db_service.assign_tasks(user_ids, image_ids)
     
     return jsonify({
         'success': True,
-        'assignments_created': assignments_created
+        'assignments_created': result['created'],
+        'assignments_skipped': result['skipped']
     })
 
 @sqlite_api_bp.route('/admin/assignments/auto', methods=['POST'])
@@ -3,9 +3,16 @@ Rutas API para la aplicación de anotación colaborativa con SQLite con JWT Auth
 """
 import os
 import logging
-from datetime import datetime
-from flask import Blueprint, request, jsonify
+from datetime import datetime, timezone
+from flask import Blueprint, Response, request, jsonify, url_for
 from services.database_service import DatabaseService
+from services.image_service import image_service
+from services.image_pack_service import image_pack_service
+from services.image_ingest_service import ImageIngestService
+from services.export_service import export_service, export_record, EXPORT_FORMATS
+from services.json_provider import dumps_bytes
+from services.pagination import (encode_cursor, decode_cursor, cursor_int,
+                                 clamp_page_size, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX)
 from services.jwt_service import jwt_required, admin_required, jwt_service
 from services.security_utils import rate_limit, validate_json_input, SecurityUtils
 from services.notification_service import notification_service
@@ -17,6 +24,18 @@ logger = logging.getLogger(__name__)
 
 URL_API_PREFIX = '/api/v2'
 
+# Máximo de tareas que se pueden reservar en un solo /task/batch
+TASK_BATCH_MAX = 50
+
+# Máximo de items aceptados por PUT /annotations/bulk
+BULK_UPDATE_MAX = 500
+
+# Páginas de /admin/export/annotations/changes
+CHANGES_PAGE_DEFAULT = 1000
+CHANGES_PAGE_MAX = 10000
+
+VALID_STATUSES = ['pending', 'corrected', 'approved', 'discarded']
+
 # Blueprint para las rutas de la aplicación SQLite
 api_bp = Blueprint('api', __name__, url_prefix=URL_API_PREFIX)
 
@@ -26,6 +45,9 @@ db_service = DatabaseService()
 # Instancia de utilidades de seguridad
 security = SecurityUtils()
 
+# Importación masiva de imágenes
+image_ingest_service = ImageIngestService(db_service)
+
 # Middleware para logging de códigos de estado HTTP
 @api_bp.after_request
 def log_response_status(response):
@@ -118,8 +140,8 @@ def refresh_token():
         
         logger.debug(f"Refresh token válido para usuario ID: {payload['user_id']}")
         
-        # Obtener usuario actualizado
-        user = db_service.get_user_by_id(payload['user_id'])
+        # Obtener usuario actualizado (caché del proceso: invalidado al cambiar rol o eliminar)
+        user = db_service.get_cached_user(payload['user_id'])
         if not user:
             logger.warning(f"Usuario no encontrado para refresh token: {payload['user_id']}")
             return jsonify({'error': 'User not found'}), 404
@@ -151,7 +173,7 @@ def get_current_user():
     
     logger.debug(f"Solicitando información de usuario: {username}")
     
-    user = db_service.get_user_by_id(user_id)
+    user = db_service.get_cached_user(user_id)
     if user:
         stats = db_service.get_user_stats(user.id)
         logger.debug(f"Información de usuario obtenida exitosamente: {username}")
@@ -176,33 +198,126 @@ def get_next_task():
     task_data = db_service.get_next_pending_task(user_id)
     
     if task_data:
-        annotation, image = task_data
-        logger.info(f"Tarea asignada a {username}: anotación {annotation.id}, imagen {image.id}")
+        logger.info(f"Tarea asignada a {username}: anotación {task_data.annotation_id}, imagen {task_data.image_id}")
         
         # Marcar que el usuario tiene tareas disponibles (resetea estado de notificación)
         notification_service.mark_user_has_tasks(user_id, username)
         
         return jsonify({
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status
+            'annotation_id': task_data.annotation_id,
+            'image_id': task_data.image_id,
+            'image_path': task_data.image_path,
+            'initial_ocr_text': task_data.initial_ocr_text,
+            'status': task_data.status
         })
     else:
         logger.info(f"No hay tareas pendientes para usuario: {username}")
-        
-        # Intentar enviar notificación al admin (con protección anti-spam)
-        try:
-            notification_sent = notification_service.send_no_tasks_notification(user_id, username)
-            if notification_sent:
-                logger.info(f"Notificación de 'sin tareas' enviada al admin para usuario: {username}")
-            else:
-                logger.debug(f"Notificación de 'sin tareas' no enviada (anti-spam o error) para usuario: {username}")
-        except Exception as e:
-            logger.error(f"Error enviando notificación de 'sin tareas' para usuario {username}: {e}")
-        
+        _notify_no_tasks(user_id, username)
+        return jsonify({'message': 'No pending tasks available'}), 204
+
+@api_bp.route('/task/batch', methods=['GET'])
+@jwt_required
+def get_task_batch():
+    """Reserva las próximas N tareas pendientes con metadatos de imagen para precarga.
+    Con pack=true las imágenes del lote se entregan además en un único paquete."""
+    user_id = request.current_user['user_id']
+    username = request.current_user['username']
+    try:
+        n = min(max(int(request.args.get('n', 10)), 1), TASK_BATCH_MAX)
+    except ValueError:
+        return jsonify({'error': 'n must be an integer'}), 400
+    with_pack = request.args.get('pack', 'false').lower() == 'true'
+    
+    logger.debug(f"Solicitando lote de {n} tareas para usuario: {username}")
+    
+    tasks = db_service.claim_pending_tasks(user_id, n)
+    
+    if not tasks:
+        logger.info(f"No hay tareas pendientes para usuario: {username}")
+        _notify_no_tasks(user_id, username)
         return jsonify({'message': 'No pending tasks available'}), 204
+    
+    logger.info(f"Lote de {len(tasks)} tareas asignado a {username}")
+    notification_service.mark_user_has_tasks(user_id, username)
+    
+    batch = []
+    for task in tasks:
+        filename = image_service.filename_for(task.image_path)
+        file_info = image_service.get_file_info(filename)
+        batch.append({
+            'annotation_id': task.annotation_id,
+            'image_id': task.image_id,
+            'image_path': task.image_path,
+            'initial_ocr_text': task.initial_ocr_text,
+            'status': task.status,
+            'image_url': url_for('serve_image', filename=filename),
+            'image_size': file_info.size if file_info else None,
+            'image_etag': file_info.etag if file_info else None
+        })
+    
+    response = {
+        'tasks': batch,
+        'count': len(batch),
+        'lease_seconds': db_service.task_lease_seconds
+    }
+    if with_pack:
+        pack = image_pack_service.build_pack(image_service.filename_for(task.image_path) for task in tasks)
+        response['pack'] = _pack_manifest(pack) if pack else None
+        if pack:
+            # Ubicación de cada imagen dentro del paquete
+            for item in batch:
+                entry = pack.entry_for(image_service.filename_for(item['image_path']))
+                item['pack_offset'] = entry.offset if entry else None
+                item['pack_length'] = entry.length if entry else None
+    
+    return jsonify(response)
+
+def _pack_manifest(pack) -> dict:
+    """Descripción de un paquete de imágenes para el cliente"""
+    return {
+        'pack_id': pack.pack_id,
+        'url': url_for('serve_image_pack', pack_id=pack.pack_id),
+        'size': pack.size,
+        'etag': pack.pack_id,
+        'entries': [entry.to_dict() for entry in pack.entries]
+    }
+
+@api_bp.route('/images/pack', methods=['GET'])
+@jwt_required
+def get_image_pack():
+    """Paquete con las imágenes de un rango de ids (from_id..to_id, inclusive)"""
+    try:
+        from_id = int(request.args['from_id'])
+        to_id = int(request.args['to_id'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'from_id and to_id must be integers'}), 400
+    if to_id < from_id:
+        return jsonify({'error': 'to_id must be greater than or equal to from_id'}), 400
+    
+    images = db_service.get_image_paths_in_range(from_id, to_id, image_pack_service.max_images)
+    pack = image_pack_service.build_pack(image_service.filename_for(image_path) for _, image_path in images)
+    if pack is None:
+        return jsonify({'error': 'No images found in range'}), 404
+    
+    filenames = {image_service.filename_for(image_path): image_id for image_id, image_path in images}
+    manifest = _pack_manifest(pack)
+    for entry in manifest['entries']:
+        entry['image_id'] = filenames.get(entry['filename'])
+    # El rango puede exceder el máximo por paquete: el cliente continúa desde el último id
+    manifest['last_image_id'] = images[-1][0] if images else None
+    return jsonify(manifest)
+
+def _notify_no_tasks(user_id: int, username: str):
+    """Avisa al admin que el usuario se quedó sin tareas (con protección anti-spam).
+    Solo encola el mensaje: el envío a Telegram ocurre en segundo plano."""
+    try:
+        notification_queued = notification_service.send_no_tasks_notification(user_id, username)
+        if notification_queued:
+            logger.info(f"Notificación de 'sin tareas' encolada para el admin por usuario: {username}")
+        else:
+            logger.debug(f"Notificación de 'sin tareas' no encolada (anti-spam o error) para usuario: {username}")
+    except Exception as e:
+        logger.error(f"Error enviando notificación de 'sin tareas' para usuario {username}: {e}")
 
 @api_bp.route('/task/history', methods=['GET'])
 @jwt_required
@@ -219,15 +334,7 @@ def get_task_history():
     logger.debug(f"Historial obtenido para {username}: {len(history)} tareas")
     
     return jsonify({
-        'history': [{
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status,
-            'corrected_text': annotation.corrected_text,
-            'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None
-        } for annotation, image in history]
+        'history': [task.to_dict() for task in history]
     })
 
 @api_bp.route('/task/pending-preview', methods=['GET'])
@@ -245,10 +352,7 @@ def get_pending_preview():
     logger.debug(f"Vista previa obtenida para {username}: {len(pending_tasks)} tareas pendientes")
     
     return jsonify({
-        'pending': [{
-            'annotation_id': annotation.id,
-            'image_id': image.id
-        } for annotation, image in pending_tasks]
+        'pending': [task.to_dict() for task in pending_tasks]
     })
 
 @api_bp.route('/task/load/<int:annotation_id>', methods=['GET'])
@@ -263,15 +367,14 @@ def load_specific_task(annotation_id):
     task_data = db_service.get_specific_task(annotation_id, user_id)
     
     if task_data:
-        annotation, image = task_data
         logger.info(f"Tarea específica cargada para {username}: anotación {annotation_id}")
         return jsonify({
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status,
-            'corrected_text': annotation.corrected_text
+            'annotation_id': task_data.annotation_id,
+            'image_id': task_data.image_id,
+            'image_path': task_data.image_path,
+            'initial_ocr_text': task_data.initial_ocr_text,
+            'status': task_data.status,
+            'corrected_text': task_data.corrected_text
         })
     else:
         logger.warning(f"Tarea específica no encontrada: {annotation_id} para usuario {username}")
@@ -322,6 +425,62 @@ def update_annotation(annotation_id):
         logger.error(f"Error interno actualizando anotación {annotation_id}: {e}")
         return jsonify({'error': 'Failed to update annotation'}), 500
 
+@api_bp.route('/annotations/bulk', methods=['PUT'])
+@jwt_required
+@validate_json_input(required_fields=['items'])
+def bulk_update_annotations():
+    """Actualiza varias anotaciones del usuario actual en una sola transacción"""
+    data = request.get_json()
+    user_id = request.current_user['user_id']
+    username = request.current_user['username']
+    
+    items = data['items']
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > BULK_UPDATE_MAX:
+        return jsonify({'error': f'Too many items (max {BULK_UPDATE_MAX})'}), 400
+    
+    logger.info(f"Actualización masiva de {len(items)} anotaciones para {username}")
+    
+    # Validar cada item; los inválidos se reportan sin abortar el resto
+    results = [None] * len(items)
+    valid_items = []
+    valid_positions = []
+    for position, item in enumerate(items):
+        annotation_id = item.get('annotation_id') if isinstance(item, dict) else None
+        try:
+            if not isinstance(annotation_id, int) or isinstance(annotation_id, bool):
+                raise ValueError('annotation_id must be an integer')
+            status = item.get('status')
+            if status not in VALID_STATUSES:
+                raise ValueError(f'Invalid status. Must be one of: {VALID_STATUSES}')
+            corrected_text = item.get('corrected_text')
+            if corrected_text:
+                corrected_text = security.validate_input(corrected_text, max_length=2000)
+        except ValueError as e:
+            results[position] = {'annotation_id': annotation_id, 'success': False, 'error': str(e)}
+            continue
+        valid_items.append({'annotation_id': annotation_id, 'status': status, 'corrected_text': corrected_text})
+        valid_positions.append(position)
+    
+    try:
+        if valid_items:
+            for position, result in zip(valid_positions, db_service.bulk_update_annotations(user_id, valid_items)):
+                results[position] = result
+    except Exception as e:
+        logger.error(f"Error interno en actualización masiva para {username}: {e}")
+        return jsonify({'error': 'Failed to update annotations'}), 500
+    
+    updated = sum(1 for result in results if result['success'])
+    logger.info(f"Actualización masiva para {username}: {updated}/{len(items)} anotaciones actualizadas")
+    
+    return jsonify({
+        'success': updated == len(items),
+        'updated': updated,
+        'failed': len(items) - updated,
+        'results': results
+    })
+
 @api_bp.route('/admin/annotations/<int:annotation_id>', methods=['PUT'])
 @admin_required
 @validate_json_input(required_fields=['status'], optional_fields=['corrected_text'])
@@ -375,17 +534,8 @@ def get_annotation(annotation_id):
     annotation_data = db_service.get_annotation_with_image(annotation_id, user_id)
     
     if annotation_data:
-        annotation, image = annotation_data
         logger.debug(f"Anotación {annotation_id} obtenida exitosamente para {username}")
-        return jsonify({
-            'annotation_id': annotation.id,
-            'image_id': image.id,
-            'image_path': image.image_path,
-            'initial_ocr_text': image.initial_ocr_text,
-            'status': annotation.status,
-            'corrected_text': annotation.corrected_text,
-            'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None
-        })
+        return jsonify(annotation_data.to_dict())
     else:
         logger.warning(f"Anotación {annotation_id} no encontrada para usuario {username}")
         return jsonify({'error': 'Annotation not found'}), 404
@@ -411,13 +561,15 @@ def create_assignments():
             return jsonify({'error': 'User IDs and Image IDs cannot be empty'}), 400
         
         # Crear asignaciones
-        assignments = db_service.assign_tasks(user_ids, image_ids)
+        result = db_service.assign_tasks(user_ids, image_ids)
+        assignments = result['created']
         
-        logger.info(f"Admin {admin_username} creó {assignments} asignaciones exitosamente")
+        logger.info(f"Admin {admin_username} creó {assignments} asignaciones exitosamente ({result['skipped']} omitidas)")
         
         return jsonify({
             'success': True,
             'assignments_created': assignments,
+            'assignments_skipped': result['skipped'],
             'message': f'Created {assignments} assignments'
         })
         
@@ -488,33 +640,51 @@ def get_image_annotations(image_id):
 @api_bp.route('/admin/images', methods=['GET'])
 @admin_required
 def get_all_images():
-    """Obtiene todas las imágenes con información de anotaciones"""
+    """Obtiene una página de imágenes con información de anotaciones
+    
+    Query params: cursor, limit (máx. 1000), sort (id | -id)
+    """
     admin_username = request.current_user['username']
     
-    logger.debug(f"Admin {admin_username} solicitando todas las imágenes")
+    logger.debug(f"Admin {admin_username} solicitando imágenes")
     
-    images = db_service.get_all_images_with_annotations()
+    try:
+        cursor, limit = _page_args()
+        page = db_service.get_all_images_with_annotations(
+            cursor=cursor, limit=limit, sort=request.args.get('sort', 'id')
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Paginación inválida: {e}'}), 400
     
-    logger.debug(f"Admin {admin_username} obtuvo {len(images)} imágenes")
+    logger.debug(f"Admin {admin_username} obtuvo {len(page['items'])} imágenes")
     
     return jsonify({
-        'images': images  # Ya viene formateado como lista de diccionarios
+        'images': page['items'],  # Ya viene formateado como lista de diccionarios
+        **_page_metadata(page, limit)
     })
 
 @api_bp.route('/admin/users', methods=['GET'])
 @admin_required
 def get_all_users():
-    """Obtiene todos los usuarios con estadísticas"""
+    """Obtiene una página de usuarios con estadísticas, ordenados por username
+    
+    Query params: cursor, limit (máx. 1000)
+    """
     admin_username = request.current_user['username']
     
     logger.debug(f"Admin {admin_username} solicitando lista de usuarios")
     
-    users = db_service.get_all_users_with_stats()
+    try:
+        cursor, limit = _page_args()
+        page = db_service.get_all_users_with_stats(cursor=cursor, limit=limit)
+    except ValueError as e:
+        return jsonify({'error': f'Paginación inválida: {e}'}), 400
     
-    logger.debug(f"Admin {admin_username} obtuvo {len(users)} usuarios")
+    logger.debug(f"Admin {admin_username} obtuvo {len(page['items'])} usuarios")
     
     return jsonify({
-        'users': users
+        'users': page['items'],
+        **_page_metadata(page, limit)
     })
 
 @api_bp.route('/admin/users', methods=['POST'])
@@ -578,7 +748,9 @@ def create_image():
         
         logger.info(f"Admin {admin_username} creando imagen: {image_path}")
         
-        image = db_service.create_image(image_path, initial_ocr_text)
+        # Hash del contenido para el ETag de /images (None si el archivo aún no está en disco)
+        content_hash = image_service.content_hash(image_service.filename_for(image_path))
+        image = db_service.create_image(image_path, initial_ocr_text, content_hash)
         
         logger.info(f"Admin {admin_username} creó imagen {image.id} exitosamente")
         
@@ -595,6 +767,57 @@ def create_image():
         logger.error(f"Error interno creando imagen para admin {admin_username}: {e}")
         return jsonify({'error': 'Failed to create image'}), 500
 
+@api_bp.route('/admin/images/ingest', methods=['POST'])
+@admin_required
+@validate_json_input(required_fields=['directory'], optional_fields=['ocr_file', 'ocr'])
+def ingest_images():
+    """Lanza en segundo plano la importación masiva de un directorio de imágenes
+    
+    Body: directory y ocr_file (rutas dentro de IMAGE_INGEST_ROOT) u ocr ({imagen: texto})
+    """
+    data = request.get_json()
+    admin_username = request.current_user['username']
+    
+    directory = image_ingest_service.resolve_ingest_path(str(data['directory']))
+    if directory is None or not os.path.isdir(directory):
+        return jsonify({'error': 'directory must be an existing folder inside IMAGE_INGEST_ROOT'}), 400
+    
+    if 'ocr' in data:
+        ocr = data['ocr']
+        if not isinstance(ocr, dict):
+            return jsonify({'error': 'ocr must be an object {image: text}'}), 400
+    elif 'ocr_file' in data:
+        ocr_path = image_ingest_service.resolve_ingest_path(str(data['ocr_file']))
+        if ocr_path is None or not os.path.isfile(ocr_path):
+            return jsonify({'error': 'ocr_file must be an existing file inside IMAGE_INGEST_ROOT'}), 400
+        try:
+            ocr = image_ingest_service.load_ocr_dictionary(ocr_path)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid ocr_file: {e}'}), 400
+    else:
+        return jsonify({'error': 'Provide ocr_file or ocr'}), 400
+    
+    job_id = image_ingest_service.start_job(directory, ocr, admin_username)
+    if job_id is None:
+        return jsonify({'error': 'Another ingestion is already running'}), 409
+    
+    logger.info(f"Admin {admin_username} inició la importación {job_id} de {directory}")
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('api.get_ingest_job', job_id=job_id)
+    }), 202
+
+@api_bp.route('/admin/images/ingest/<job_id>', methods=['GET'])
+@admin_required
+def get_ingest_job(job_id):
+    """Progreso de una importación masiva (status: running | completed | failed)"""
+    job = image_ingest_service.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Ingestion job not found'}), 404
+    return jsonify({'job_id': job_id, **job})
+
 @api_bp.route('/admin/recent-activity', methods=['GET'])
 @admin_required
 def get_recent_activity():
@@ -668,18 +891,28 @@ def get_user_detailed_stats(user_id):
 @api_bp.route('/admin/users/<int:user_id>/annotations', methods=['GET'])
 @admin_required
 def get_user_annotations(user_id):
-    """Obtiene todas las anotaciones de un usuario específico"""
+    """Obtiene una página de anotaciones de un usuario específico
+    
+    Query params: cursor, limit (máx. 1000), sort (-updated_at | updated_at)
+    """
     admin_username = request.current_user['username']
     
     logger.debug(f"Admin {admin_username} solicitando anotaciones para usuario {user_id}")
     
-    annotations = db_service.get_user_annotations_detailed(user_id)
+    try:
+        cursor, limit = _page_args()
+        page = db_service.get_user_annotations_detailed(
+            user_id, cursor=cursor, limit=limit, sort=request.args.get('sort', '-updated_at')
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Paginación inválida: {e}'}), 400
     
-    logger.debug(f"Admin {admin_username} obtuvo {len(annotations)} anotaciones para usuario {user_id}")
+    logger.debug(f"Admin {admin_username} obtuvo {len(page['items'])} anotaciones para usuario {user_id}")
     
     return jsonify({
         'user_id': user_id,
-        'annotations': annotations
+        'annotations': [row.to_dict() for row in page['items']],
+        **_page_metadata(page, limit)
     })
 
 @api_bp.route('/admin/users/<int:user_id>/annotations/<int:annotation_id>', methods=['DELETE'])
@@ -755,6 +988,35 @@ def delete_user(user_id):
         logger.warning(f"Admin {admin_username} falló eliminando usuario {user_id}")
         return jsonify({'error': 'User not found or could not be deleted'}), 404
 
+@api_bp.route('/admin/users/<int:user_id>/role', methods=['PUT'])
+@admin_required
+@validate_json_input(required_fields=['role'])
+def update_user_role(user_id):
+    """Cambia el rol de un usuario"""
+    admin_username = request.current_user['username']
+    role = request.get_json()['role']
+    
+    # Validar rol
+    if role not in ['annotator', 'admin']:
+        return jsonify({'error': 'Role must be either "annotator" or "admin"'}), 400
+    
+    # Prevenir que el admin se quite sus propios permisos
+    if user_id == request.current_user['user_id']:
+        return jsonify({'error': 'Cannot change your own role'}), 400
+    
+    logger.info(f"Admin {admin_username} cambiando rol del usuario {user_id} a {role}")
+    
+    user = db_service.update_user_role(user_id, role)
+    if not user:
+        logger.warning(f"Admin {admin_username} falló cambiando rol del usuario {user_id}")
+        return jsonify({'error': 'User not found or could not be updated'}), 404
+    
+    return jsonify({
+        'success': True,
+        'user': user.to_dict(),
+        'message': f'Role of user {user.username} changed to {role}'
+    })
+
 @api_bp.route('/admin/users/<int:from_user_id>/transfer-annotations', methods=['POST'])
 @admin_required
 @validate_json_input(required_fields=['to_user_id'], optional_fields=['include_pending', 'include_reviewed'])
@@ -795,7 +1057,10 @@ def transfer_user_annotations(from_user_id):
 @api_bp.route('/admin/quality-control', methods=['GET'])
 @admin_required
 def get_quality_control_annotations():
-    """Obtiene anotaciones para control de calidad: misma imagen anotada por admin y usuario con textos diferentes"""
+    """Obtiene anotaciones para control de calidad: misma imagen anotada por admin y usuario con textos diferentes
+    
+    Query params: user_ids, usernames, cursor, limit (máx. 1000), sort (-updated_at | updated_at)
+    """
     admin_username = request.current_user['username']
     
     logger.debug(f"Admin {admin_username} solicitando datos de control de calidad")
@@ -807,18 +1072,26 @@ def get_quality_control_annotations():
     if raw_user_ids:
         try:
             user_ids = [int(x) for x in raw_user_ids.split(',') if x.strip()]
-        except Exception:
-            user_ids = None
+        except ValueError:
+            return jsonify({'error': 'Filtros inválidos: user_ids debe ser una lista de enteros'}), 400
     if raw_usernames:
         usernames = [x.strip() for x in raw_usernames.split(',') if x.strip()]
 
-    quality_data = db_service.get_quality_control_annotations(user_ids=user_ids, usernames=usernames)
+    try:
+        cursor, limit = _page_args()
+        page = db_service.get_quality_control_annotations(
+            user_ids=user_ids, usernames=usernames,
+            cursor=cursor, limit=limit, sort=request.args.get('sort', '-updated_at')
+        )
+    except ValueError as e:
+        return jsonify({'error': f'Paginación inválida: {e}'}), 400
     
-    logger.debug(f"Admin {admin_username} obtuvo {len(quality_data)} discrepancias para control de calidad")
+    logger.debug(f"Admin {admin_username} obtuvo {len(page['items'])} discrepancias para control de calidad")
     
     return jsonify({
-        'quality_control_data': quality_data,
-        'total_discrepancies': len(quality_data)
+        'quality_control_data': [row.to_dict() for row in page['items']],
+        'total_discrepancies': page['total_estimate'],
+        **_page_metadata(page, limit)
     })
 
 @api_bp.route('/admin/quality-control/consolidate', methods=['POST'])
@@ -1036,10 +1309,10 @@ def test_notification():
         )
         
         if success:
-            logger.info(f"Admin {admin_username} envió notificación de prueba exitosamente")
+            logger.info(f"Admin {admin_username} encoló notificación de prueba")
             return jsonify({
                 'success': True,
-                'message': 'Notificación de prueba enviada exitosamente'
+                'message': 'Notificación de prueba encolada para envío'
             })
         else:
             logger.warning(f"Error enviando notificación de prueba para admin {admin_username}")
@@ -1084,43 +1357,183 @@ def get_notification_config():
 @api_bp.route('/admin/export/annotations', methods=['GET'])
 @admin_required
 def export_annotations():
-    """Exporta las anotaciones agrupadas por imagen y usuario
+    """Exporta las anotaciones en streaming, sin cargarlas completas en memoria
+    
+    Query params:
+        format: json (por defecto), jsonl, csv, parquet o arrow (estos dos requieren pyarrow)
+        gzip: true para comprimir la descarga
+        status: estados separados por coma (por defecto corrected,approved,discarded)
+        user_id: IDs de usuario separados por coma
+        since / until: rango ISO 8601 sobre updated_at (since inclusivo, until exclusivo)
     
     Returns:
-        JSON con estructura:
+        format=json mantiene la estructura original:
         {
-            "image_id_1": {
-                "username1": "texto_corregido1",
-                "username2": "texto_corregido2"
+            "data": {
+                "image_id_1": {
+                    "username1": "texto_corregido1",
+                    "username2": "texto_corregido2"
+                },
+                "image_id_2": {...}
             },
-            "image_id_2": {...}
+            "metadata": {...}
         }
+        Los demás formatos entregan una fila por anotación.
     """
     admin_username = request.current_user['username']
     
-    logger.info(f"Admin {admin_username} solicitando exportación de anotaciones")
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Formato inválido. Use: {', '.join(EXPORT_FORMATS)}"}), 400
+    if not export_service.is_available(fmt):
+        return jsonify({'error': f'El formato {fmt} requiere pyarrow instalado en el servidor'}), 400
+    compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
     
     try:
-        # Obtener datos exportados
-        exported_data = db_service.export_annotations_by_image()
-        
-        # Calcular estadísticas de exportación
-        total_images = len(exported_data)
-        total_annotations = sum(len(users) for users in exported_data.values())
+        statuses = _parse_list_arg('status')
+        user_ids = [int(user_id) for user_id in _parse_list_arg('user_id')]
+        updated_since = _parse_datetime_arg('since')
+        updated_until = _parse_datetime_arg('until')
+    except ValueError:
+        return jsonify({'error': 'Filtros inválidos: user_id debe ser entero y since/until fechas ISO 8601'}), 400
+    invalid_statuses = [status for status in statuses if status not in VALID_STATUSES]
+    if invalid_statuses:
+        return jsonify({'error': f"Estados inválidos: {', '.join(invalid_statuses)}"}), 400
+    
+    logger.info(f"Admin {admin_username} exportando anotaciones (format={fmt}, gzip={compress}, "
+                f"status={statuses or 'completadas'}, users={user_ids or 'todos'}, "
+                f"since={updated_since}, until={updated_until})")
+    
+    rows = db_service.iter_annotations_for_export(
+        statuses=statuses, user_ids=user_ids,
+        updated_since=updated_since, updated_until=updated_until
+    )
+    body = export_service.stream(rows, fmt, compress=compress, metadata={
+        'export_date': datetime.now().isoformat(),
+        'exported_by': admin_username
+    })
+    filename = export_service.filename(fmt, compress, prefix=f"annotations_export_{datetime.now():%Y-%m-%d}")
+    return Response(body, content_type=export_service.content_type(fmt, compress), headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+@api_bp.route('/admin/export/annotations/changes', methods=['GET'])
+@admin_required
+def export_annotation_changes():
+    """Exporta solo las anotaciones modificadas o eliminadas desde un cursor (sincronización incremental)
+    
+    Query params:
+        since: cursor opaco devuelto por la llamada anterior (sin él se parte desde el inicio)
+        limit: máximo de cambios por página (por defecto 1000, máximo 10000)
+        status: estados separados por coma (por defecto todos)
+        format: json (por defecto) o jsonl (streaming, cada línea trae su propio cursor)
+    
+    Returns:
+        {"changes": [...], "count": N, "has_more": bool, "next_cursor": "..."}
+        Se pide la página siguiente con since=next_cursor; cuando has_more es false,
+        next_cursor sirve como watermark para la próxima sincronización.
+    
+    El cursor es la posición en el feed de cambios (annotations.change_seq), que se asigna
+    al confirmar cada transacción y en orden de commit: una escritura larga (asignaciones
+    o actualizaciones masivas) aparece entera después del cursor, sin límite de duración.
+    Entrega al menos una vez la última versión de cada anotación. Cada cambio trae
+    "deleted": las anotaciones eliminadas llegan con deleted=true, status y corrected_text
+    nulos y updated_at con la fecha del borrado (sin filtrar por status), y el consumidor
+    debe quitarlas por annotation_id.
+    """
+    admin_username = request.current_user['username']
+    
+    fmt = request.args.get('format', 'json').lower()
+    if fmt not in ('json', 'jsonl'):
+        return jsonify({'error': 'Formato inválido. Use: json, jsonl'}), 400
+    try:
+        limit = clamp_page_size(request.args.get('limit'), CHANGES_PAGE_DEFAULT, CHANGES_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'limit debe ser un entero'}), 400
+    
+    since = request.args.get('since')
+    after = None
+    if since:
+        try:
+            (change_seq,) = decode_cursor(since, 1)
+            after = cursor_int(change_seq)
+        except ValueError:
+            return jsonify({'error': 'Cursor inválido'}), 400
+    
+    statuses = _parse_list_arg('status')
+    invalid_statuses = [status for status in statuses if status not in VALID_STATUSES]
+    if invalid_statuses:
+        return jsonify({'error': f"Estados inválidos: {', '.join(invalid_statuses)}"}), 400
+    
+    logger.debug(f"Admin {admin_username} pidiendo cambios desde {after} (limit={limit}, format={fmt})")
+    
+    if fmt == 'jsonl':
+        rows = db_service.iter_annotation_changes(after=after, statuses=statuses, limit=limit)
         
-        logger.info(f"Admin {admin_username} exportó {total_annotations} anotaciones de {total_images} imágenes")
+        def generate():
+            for row in rows:
+                record = export_record(row)
+                record['annotation_id'] = row.annotation_id
+                record['deleted'] = row.deleted
+                record['cursor'] = encode_cursor(row.change_seq)
+                yield dumps_bytes(record) + b'\n'
         
+        return Response(generate(), content_type='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    
+    try:
+        rows = list(db_service.iter_annotation_changes(after=after, statuses=statuses, limit=limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        changes = []
+        for row in rows:
+            record = export_record(row)
+            record['annotation_id'] = row.annotation_id
+            record['deleted'] = row.deleted
+            changes.append(record)
+        # Sin cambios nuevos el cursor no avanza: se vuelve a consultar con el mismo
+        next_cursor = encode_cursor(rows[-1].change_seq) if rows else since
+        
+        logger.info(f"Admin {admin_username} exportó {len(changes)} cambios (has_more={has_more})")
         return jsonify({
             'success': True,
-            'data': exported_data,
-            'metadata': {
-                'total_images': total_images,
-                'total_annotations': total_annotations,
-                'export_date': datetime.now().isoformat(),
-                'exported_by': admin_username
-            }
+            'changes': changes,
+            'count': len(changes),
+            'has_more': has_more,
+            'next_cursor': next_cursor
         })
-        
     except Exception as e:
-        logger.error(f"Error exportando anotaciones para admin {admin_username}: {e}")
+        logger.error(f"Error exportando cambios de anotaciones para admin {admin_username}: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
+
+def _page_args():
+    """Lee cursor y limit de un listado paginado; ValueError si limit no es entero"""
+    cursor = request.args.get('cursor') or None
+    limit = clamp_page_size(request.args.get('limit'), PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX)
+    return cursor, limit
+
+def _page_metadata(page: dict, limit: int) -> dict:
+    """Campos comunes de paginación en las respuestas de listados"""
+    return {
+        'next_cursor': page['next_cursor'],
+        'has_more': page['has_more'],
+        'total_estimate': page['total_estimate'],
+        'page_size': limit
+    }
+
+def _parse_list_arg(name: str) -> list:
+    """Lee un parámetro de query con valores separados por coma"""
+    value = request.args.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def _parse_datetime_arg(name: str):
+    """Lee un parámetro de query ISO 8601 como datetime UTC (None si no viene)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        # Las fechas sin zona se interpretan en UTC, igual que se guarda updated_at
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
@@ -2,15 +2,46 @@
 Servicio de base de datos para la aplicación de anotación colaborativa
 """
 import logging
-from datetime import datetime, timezone
-from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session
-from models.database import DatabaseManager, User, Image, Annotation
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from sqlalchemy import (select, update, delete, or_, exists, literal, true, insert, func, case, and_, tuple_, text,
+                        union_all, DateTime, String, Text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, aliased
+from flask import g, has_app_context
+from services.pagination import encode_cursor, decode_cursor, cursor_datetime, cursor_int, cursor_str, PAGE_SIZE_DEFAULT
+from models.database import (DatabaseManager, User, Image, Annotation, UserAnnotationCounter, AnnotationAgreement,
+                             UserAgreementStats, AnnotationDeletion, SequenceCounter, mark_annotation_changes,
+                             record_annotation_deletions, USER_COUNTERS_BUILT, AGREEMENTS_BUILT)
+from models.dto import UserRow, TaskRow, PendingTaskRow, UserAnnotationRow, QualityControlRow
 import os
 from config import Config
 # Configurar logger para este módulo
 logger = logging.getLogger(__name__)
 
+# Tamaño máximo de las listas IN (...) por sentencia (SQLite limita los parámetros)
+IN_CHUNK_SIZE = 10000
+
+ANNOTATION_STATUSES = ['pending', 'corrected', 'approved', 'discarded']
+COMPLETED_STATUSES = ['corrected', 'approved', 'discarded']
+
+# Filas por lote al recorrer exportaciones con cursor del lado del servidor
+EXPORT_BATCH_SIZE = 5000
+
+# Columnas de TaskRow, en su orden
+TASK_COLUMNS = (Annotation.id, Annotation.image_id, Image.image_path, Image.initial_ocr_text,
+                Annotation.status, Annotation.corrected_text, Annotation.updated_at)
+
+def close_request_sessions(exception=None):
+    """Teardown de Flask: cierra las sesiones de la petición (revierte lo no confirmado)"""
+    for session in g.pop('db_sessions', {}).values():
+        session.close()
+
 class DatabaseService:
     """Servicio para operaciones de base de datos"""
     
@@ -19,11 +50,37 @@ class DatabaseService:
         if database_url is None:
             database_url = config.DATABASE_URL
         self.db_manager = DatabaseManager(database_url)
-        logger.info(f"DatabaseService inicializado con URL: {database_url}")
+        self.dialect = self.db_manager.engine.dialect.name
+        self.task_lease_seconds = config.TASK_LEASE_SECONDS
+        
+        # Caché por proceso de identidades de usuario: user_id -> (UserRow, expira_en)
+        self.user_cache_ttl = config.USER_CACHE_TTL_SECONDS
+        self.user_cache_size = config.USER_CACHE_SIZE
+        self._user_cache: OrderedDict = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+        logger.info(f"DatabaseService inicializado con URL: {make_url(database_url).render_as_string(hide_password=True)}")
         
     def get_session(self) -> Session:
-        """Obtiene una sesión de base de datos"""
-        return self.db_manager.get_session()
+        """Obtiene una sesión de base de datos.
+
+        Dentro de un contexto de Flask todas las llamadas de la petición comparten una
+        sesión (guardada en g) que se cierra en el teardown con close_request_sessions;
+        fuera de él (scripts, hilos, generadores de streaming) se crea una sesión propia.
+        """
+        if not has_app_context():
+            return self.db_manager.get_session()
+        sessions = g.setdefault('db_sessions', {})
+        session = sessions.get(self.db_manager.engine)
+        if session is None:
+            session = self.db_manager.get_session()
+            session.info['request_scoped'] = True
+            sessions[self.db_manager.engine] = session
+        return session
+
+    def close_session(self, session: Session):
+        """Libera una sesión de get_session; la de la petición se mantiene hasta el teardown"""
+        if not session.info.get('request_scoped'):
+            session.close()
     
     # Métodos de autenticación
     def authenticate_user(self, username: str, password: str) -> Optional[User]:
@@ -33,20 +90,16 @@ class DatabaseService:
             user = session.query(User).filter_by(username=username).first()
             if user and user.check_password(password):
                 logger.info(f"Usuario autenticado exitosamente: {username}")
-                # Crear una nueva instancia desvinculada de la sesión
-                detached_user = User(username=user.username, password='dummy', role=user.role)
-                # Sobrescribir con los valores reales
-                detached_user.id = user.id
-                detached_user.password_hash = user.password_hash
-                return detached_user
+                return user
             else:
                 logger.warning(f"Fallo de autenticación para usuario: {username}")
                 return None
         except Exception as e:
+            session.rollback()
             logger.error(f"Error autenticando usuario {username}: {e}")
             return None
         finally:
-            session.close()
+            self.close_session(session)
     
     def get_user_by_id(self, user_id: int) -> Optional[User]:
         """Obtiene un usuario por ID"""
@@ -55,149 +108,200 @@ class DatabaseService:
             user = session.query(User).filter_by(id=user_id).first()
             if user:
                 logger.debug(f"Usuario encontrado por ID: {user_id}")
-                # Crear una nueva instancia desvinculada de la sesión
-                detached_user = User(username=user.username, password='dummy', role=user.role)
-                # Sobrescribir con los valores reales
-                detached_user.id = user.id
-                detached_user.password_hash = user.password_hash
-                return detached_user
+                return user
             else:
                 logger.warning(f"Usuario no encontrado por ID: {user_id}")
                 return None
         except Exception as e:
+            session.rollback()
             logger.error(f"Error obteniendo usuario por ID {user_id}: {e}")
             return None
         finally:
-            session.close()
+            self.close_session(session)
     
-    # Métodos para tareas (anotaciones)
-    def get_next_pending_task(self, user_id: int) -> Optional[Tuple[Annotation, Image]]:
-        """Obtiene la siguiente tarea pendiente para un usuario"""
+    def get_cached_user(self, user_id: int) -> Optional[UserRow]:
+        """Obtiene la identidad de un usuario pasando por el caché del proceso.
+
+        Las entradas viven USER_CACHE_TTL_SECONDS y se invalidan al crear, eliminar o cambiar
+        el rol de un usuario en este proceso; en otros workers el cambio se ve al vencer el TTL.
+        """
+        if self.user_cache_ttl <= 0:
+            return self._load_user_row(user_id)
+        
+        now = time.monotonic()
+        with self._user_cache_lock:
+            entry = self._user_cache.get(user_id)
+            if entry is not None:
+                if entry[1] > now:
+                    self._user_cache.move_to_end(user_id)
+                    return entry[0]
+                del self._user_cache[user_id]
+        
+        user = self._load_user_row(user_id)
+        # Los usuarios inexistentes no se cachean
+        if user is not None:
+            with self._user_cache_lock:
+                self._user_cache[user_id] = (user, now + self.user_cache_ttl)
+                if len(self._user_cache) > self.user_cache_size:
+                    self._user_cache.popitem(last=False)
+        return user
+    
+    def invalidate_cached_user(self, user_id: int):
+        """Descarta la identidad cacheada de un usuario"""
+        with self._user_cache_lock:
+            self._user_cache.pop(user_id, None)
+    
+    def _load_user_row(self, user_id: int) -> Optional[UserRow]:
         session = self.get_session()
         try:
-            annotation = session.query(Annotation).join(Image).filter(
-                Annotation.user_id == user_id,
-                Annotation.status == 'pending'
+            row = session.execute(
+                select(User.id, User.username, User.role).where(User.id == user_id)
             ).first()
-            
-            if annotation:
-                # Cargar explícitamente la imagen dentro de la sesión
-                image = annotation.image
-                
-                # Crear instancias desvinculadas
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                
-                detached_image = Image()
-                detached_image.id = image.id
-                detached_image.image_path = image.image_path
-                detached_image.initial_ocr_text = image.initial_ocr_text
-                
-                return detached_annotation, detached_image
+            if row is None:
+                logger.warning(f"Usuario no encontrado por ID: {user_id}")
+                return None
+            return UserRow._make(row)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error obteniendo usuario por ID {user_id}: {e}")
             return None
         finally:
-            session.close()
+            self.close_session(session)
+    
+    # Métodos para tareas (anotaciones)
+    def _claim_pending_tasks(self, session: Session, user_id: int, limit: int,
+                             include_claimed: bool = False) -> List[TaskRow]:
+        """Reserva (lease) hasta `limit` tareas pendientes del usuario en orden de id.
 
-    def get_user_task_history(self, user_id: int, limit: int = 10) -> List[Tuple[Annotation, Image]]:
-        """Obtiene el historial de tareas completadas del usuario"""
+        En PostgreSQL es un único UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)
+        RETURNING unido a images mediante CTE, de modo que workers concurrentes nunca
+        reciben la misma fila. En SQLite las escrituras se serializan, así que basta con
+        un UPDATE ... RETURNING atómico seguido de la lectura de las imágenes.
+        Con include_claimed=True se re-entregan tareas propias aún reservadas
+        (p. ej. el mismo usuario recargando la página), las más antiguas primero.
+        """
+        now = datetime.now(timezone.utc)
+        candidates = select(Annotation.id).where(
+            Annotation.user_id == user_id,
+            Annotation.status == 'pending'
+        )
+        if include_claimed:
+            candidates = candidates.order_by(Annotation.claimed_at, Annotation.id)
+        else:
+            lease_cutoff = now - timedelta(seconds=self.task_lease_seconds)
+            candidates = candidates.where(
+                or_(Annotation.claimed_at.is_(None), Annotation.claimed_at < lease_cutoff)
+            ).order_by(Annotation.id)
+        candidates = candidates.limit(limit)
+        if self.dialect == 'postgresql':
+            candidates = candidates.with_for_update(skip_locked=True)
+
+        # Reservar no es un cambio de contenido: change_seq se conserva y no entra al feed de cambios
+        claim = update(Annotation).where(
+            Annotation.id.in_(candidates.scalar_subquery())
+        ).values(claimed_at=now, change_seq=Annotation.change_seq).returning(
+            Annotation.id, Annotation.image_id, Annotation.user_id,
+            Annotation.corrected_text, Annotation.status, Annotation.updated_at
+        ).execution_options(synchronize_session=False)
+
+        if self.dialect == 'postgresql':
+            claimed = claim.cte('claimed')
+            rows = session.execute(
+                select(claimed, Image.image_path, Image.initial_ocr_text)
+                .join(Image, Image.id == claimed.c.image_id)
+                .order_by(claimed.c.id)
+            ).all()
+        else:
+            claimed_rows = session.execute(claim).all()
+            images = {}
+            if claimed_rows:
+                images = {
+                    row.id: row for row in session.execute(
+                        select(Image.id, Image.image_path, Image.initial_ocr_text)
+                        .where(Image.id.in_({row.image_id for row in claimed_rows}))
+                    )
+                }
+            rows = [
+                (*row, images[row.image_id].image_path, images[row.image_id].initial_ocr_text)
+                for row in claimed_rows if row.image_id in images
+            ]
+            rows.sort(key=lambda row: row[0])
+
+        return [
+            TaskRow(annotation_id, image_id, image_path, initial_ocr_text, status, corrected_text, updated_at)
+            for annotation_id, image_id, _, corrected_text, status, updated_at, image_path, initial_ocr_text in rows
+        ]
+
+    def claim_pending_tasks(self, user_id: int, limit: int) -> List[TaskRow]:
+        """Obtiene y reserva las siguientes `limit` tareas pendientes de un usuario en una sola consulta"""
         session = self.get_session()
         try:
-            annotations = session.query(Annotation).join(Image).filter(
-                Annotation.user_id == user_id,
-                Annotation.status.in_(['corrected', 'approved', 'discarded'])
-            ).order_by(Annotation.updated_at.desc()).limit(limit).all()
-            
-            # Crear instancias desvinculadas
-            result = []
-            for annotation in annotations:
-                image = annotation.image
-                
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                
-                detached_image = Image()
-                detached_image.id = image.id
-                detached_image.image_path = image.image_path
-                detached_image.initial_ocr_text = image.initial_ocr_text
-                
-                result.append((detached_annotation, detached_image))
-            
-            return result
+            tasks = self._claim_pending_tasks(session, user_id, limit)
+            if not tasks:
+                # Todas sus tareas pendientes están reservadas: re-entregar las más antiguas
+                tasks = self._claim_pending_tasks(session, user_id, limit, include_claimed=True)
+            session.commit()
+            return tasks
+        except Exception:
+            session.rollback()
+            raise
         finally:
-            session.close()
+            self.close_session(session)
 
-    def get_pending_tasks_preview(self, user_id: int, limit: int = 10) -> List[Tuple[Annotation, Image]]:
-        """Obtiene una vista previa de las próximas tareas pendientes"""
+    def get_next_pending_task(self, user_id: int) -> Optional[TaskRow]:
+        """Obtiene y reserva la siguiente tarea pendiente para un usuario"""
+        tasks = self.claim_pending_tasks(user_id, 1)
+        return tasks[0] if tasks else None
+
+    def get_user_task_history(self, user_id: int, limit: int = 10) -> List[TaskRow]:
+        """Obtiene el historial de tareas completadas del usuario"""
         session = self.get_session()
         try:
-            annotations = session.query(Annotation).join(Image).filter(
-                Annotation.user_id == user_id,
-                Annotation.status == 'pending'
-            ).limit(limit).all()
-            
-            # Crear instancias desvinculadas (solo necesitamos IDs para la preview)
-            result = []
-            for annotation in annotations:
-                image = annotation.image
-                
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.status = annotation.status
-                
-                detached_image = Image()
-                detached_image.id = image.id
-                
-                result.append((detached_annotation, detached_image))
-            
-            return result
+            rows = session.execute(
+                select(*TASK_COLUMNS).join(Image, Annotation.image_id == Image.id).where(
+                    Annotation.user_id == user_id,
+                    Annotation.status.in_(['corrected', 'approved', 'discarded'])
+                ).order_by(Annotation.updated_at.desc()).limit(limit)
+            )
+            return [TaskRow._make(row) for row in rows]
         finally:
-            session.close()
+            self.close_session(session)
 
-    def get_specific_task(self, annotation_id: int, user_id: int) -> Optional[Tuple[Annotation, Image]]:
-        """Obtiene una tarea específica por annotation_id"""
+    def get_pending_tasks_preview(self, user_id: int, limit: int = 10) -> List[PendingTaskRow]:
+        """Obtiene una vista previa de las próximas tareas pendientes"""
         session = self.get_session()
         try:
-            annotation = session.query(Annotation).join(Image).filter(
-                Annotation.id == annotation_id,
-                Annotation.user_id == user_id
-            ).first()
-            
-            if annotation:
-                image = annotation.image
-                
-                # Crear instancias desvinculadas
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                
-                detached_image = Image()
-                detached_image.id = image.id
-                detached_image.image_path = image.image_path
-                detached_image.initial_ocr_text = image.initial_ocr_text
-                
-                return detached_annotation, detached_image
-            return None
+            # Solo se necesitan los IDs: el índice (user_id, status) basta, sin join con images
+            rows = session.execute(
+                select(Annotation.id, Annotation.image_id).where(
+                    Annotation.user_id == user_id,
+                    Annotation.status == 'pending'
+                ).order_by(Annotation.id).limit(limit)
+            )
+            return [PendingTaskRow._make(row) for row in rows]
         finally:
-            session.close()
+            self.close_session(session)
+
+    def get_specific_task(self, annotation_id: int, user_id: int) -> Optional[TaskRow]:
+        """Obtiene una tarea específica por annotation_id"""
+        return self.get_annotation_with_image(annotation_id, user_id)
     
+    def _apply_annotation_update(self, session: Session, annotation: Annotation, status: str,
+                                 corrected_text: str = None):
+        """Aplica un cambio de estado a una anotación en la sesión dada, sin hacer commit"""
+        # Si se aprueba sin texto corregido, usar el texto original de la imagen
+        if status == 'approved' and not corrected_text:
+            image = session.query(Image).filter_by(id=annotation.image_id).first()
+            if image:
+                corrected_text = image.initial_ocr_text
+        
+        old_status = annotation.status
+        annotation.update_status(status, corrected_text)
+        self._record_annotation_changes(session, [(annotation.user_id, annotation.image_id, old_status, status)])
+        self._refresh_agreements(session, [annotation.image_id])
+
     def update_annotation(self, annotation_id: int, user_id: int, status: str, corrected_text: str = None) -> bool:
-        """Actualiza una anotación"""
+        """Actualiza una anotación; False si no existe o no es del usuario"""
         session = self.get_session()
         try:
             annotation = session.query(Annotation).filter_by(
@@ -208,51 +312,92 @@ class DatabaseService:
             if not annotation:
                 return False
             
-            # Si se aprueba sin texto corregido, usar el texto original
-            if status == 'approved' and not corrected_text:
-                # Obtener el texto original de la imagen
-                image = session.query(Image).filter_by(id=annotation.image_id).first()
-                if image:
-                    corrected_text = image.initial_ocr_text
-            
-            annotation.update_status(status, corrected_text)
+            self._apply_annotation_update(session, annotation, status, corrected_text)
             session.commit()
             return True
         except Exception:
             session.rollback()
-            return False
+            logger.exception(f"Error actualizando anotación {annotation_id}")
+            raise
         finally:
-            session.close()
+            self.close_session(session)
+    
+    def bulk_update_annotations(self, user_id: int, items: List[dict]) -> List[dict]:
+        """Actualiza varias anotaciones del usuario en una sola transacción.
+
+        items: dicts con 'annotation_id', 'status' y opcionalmente 'corrected_text'.
+        La propiedad se valida con un único IN (...) que además trae el texto OCR
+        para el fallback de 'approved'; las filas se escriben con un executemany
+        por clave primaria. Retorna un resultado por item, en el mismo orden.
+        """
+        session = self.get_session()
+        try:
+            annotation_ids = {item['annotation_id'] for item in items}
+            owned = {
+                row.id: row for row in session.execute(
+                    select(Annotation.id, Annotation.image_id, Annotation.status, Image.initial_ocr_text)
+                    .join(Image, Image.id == Annotation.image_id)
+                    .where(Annotation.id.in_(annotation_ids), Annotation.user_id == user_id)
+                )
+            } if annotation_ids else {}
+            current_status = {annotation_id: row.status for annotation_id, row in owned.items()}
+            
+            now = datetime.now(timezone.utc)
+            rows = []
+            changes = []
+            results = []
+            for item in items:
+                annotation_id = item['annotation_id']
+                if annotation_id not in owned:
+                    results.append({'annotation_id': annotation_id, 'success': False,
+                                    'error': 'Annotation not found or not authorized'})
+                    continue
+                
+                status = item['status']
+                corrected_text = item.get('corrected_text')
+                # Si se aprueba sin texto corregido, usar el texto original
+                if status == 'approved' and not corrected_text:
+                    corrected_text = owned[annotation_id].initial_ocr_text
+                
+                row = {'id': annotation_id, 'status': status, 'updated_at': now, 'claimed_at': None}
+                if corrected_text is not None:
+                    row['corrected_text'] = corrected_text
+                rows.append(row)
+                changes.append((user_id, owned[annotation_id].image_id, current_status[annotation_id], status))
+                current_status[annotation_id] = status
+                results.append({'annotation_id': annotation_id, 'success': True, 'status': status})
+            
+            if rows:
+                session.execute(update(Annotation), rows)
+                mark_annotation_changes(session)
+                self._record_annotation_changes(session, changes)
+                self._refresh_agreements(session, [owned[row['id']].image_id for row in rows])
+            session.commit()
+            logger.info(f"Actualización masiva del usuario {user_id}: {len(rows)}/{len(items)} anotaciones")
+            return results
+        except Exception:
+            session.rollback()
+            logger.exception(f"Error en actualización masiva del usuario {user_id}")
+            raise
+        finally:
+            self.close_session(session)
     
     def admin_update_annotation(self, annotation_id: int, status: str, corrected_text: str = None) -> bool:
-        """Actualiza una anotación como admin (sin restringir por usuario)."""
+        """Actualiza una anotación como admin (sin restringir por usuario); False si no existe"""
         session = self.get_session()
         try:
             ann = session.query(Annotation).filter(Annotation.id == annotation_id).one_or_none()
             if not ann:
                 return False
-            # Si se aprueba sin texto corregido, usar el texto original de la imagen
-            if status == 'approved' and not corrected_text:
-                image = session.query(Image).filter_by(id=ann.image_id).first()
-                if image:
-                    corrected_text = image.initial_ocr_text
-
-            # Usar método de dominio si existe, para mantener consistencia
-            if hasattr(ann, 'update_status') and callable(getattr(ann, 'update_status')):
-                ann.update_status(status, corrected_text)
-            else:
-                ann.status = status
-                if corrected_text is not None:
-                    ann.corrected_text = corrected_text
-                ann.updated_at = datetime.now(timezone.utc)
+            self._apply_annotation_update(session, ann, status, corrected_text)
             session.commit()
             return True
         except Exception:
             session.rollback()
             logger.exception("Error en admin_update_annotation")
-            return False
+            raise
         finally:
-            session.close()
+            self.close_session(session)
     
     def get_annotation_by_id(self, annotation_id: int, user_id: int = None) -> Optional[Annotation]:
         """Obtiene una anotación por ID, opcionalmente filtrada por usuario"""
@@ -261,66 +406,120 @@ class DatabaseService:
             query = session.query(Annotation).filter_by(id=annotation_id)
             if user_id:
                 query = query.filter_by(user_id=user_id)
-            annotation = query.first()
-            
-            if annotation:
-                # Crear una nueva instancia desvinculada usando los atributos directamente
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                return detached_annotation
-            return None
+            return query.first()
         finally:
-            session.close()
+            self.close_session(session)
     
     # Métodos de administración
-    def assign_tasks(self, user_ids: List[int], image_ids: List[int]) -> int:
-        """Asigna tareas a usuarios (solo para admins)"""
+    def _dialect_insert(self, model):
+        """INSERT del dialecto activo (soporta ON CONFLICT en PostgreSQL y SQLite)"""
+        if self.dialect == 'postgresql':
+            return postgresql.insert(model)
+        if self.dialect == 'sqlite':
+            return sqlite.insert(model)
+        return insert(model)
+
+    def _insert_assignments(self, session: Session, user_ids: List[int], image_ids: List[int]) -> int:
+        """Crea las asignaciones pendientes usuarios × imágenes con un INSERT ... SELECT.
+
+        El producto cruzado se filtra con NOT EXISTS contra las anotaciones existentes y
+        ON CONFLICT DO NOTHING (INSERT OR IGNORE en SQLite) cubre las carreras contra el
+        índice único (user_id, image_id). Los contadores pending se actualizan con una fila
+        por usuario agregada en la base, sin traer los pares creados a Python. Retorna la
+        cantidad de filas creadas.
+        """
+        now = datetime.now(timezone.utc)
+        already_assigned = exists().where(
+            Annotation.user_id == User.id,
+            Annotation.image_id == Image.id
+        )
+        pairs = select(
+            User.id.label('user_id'),
+            Image.id.label('image_id'),
+            literal('pending'),
+            literal(now, DateTime(timezone=True))
+        ).select_from(User).join(Image, true()).where(
+            User.id.in_(user_ids),
+            Image.id.in_(image_ids),
+            ~already_assigned
+        )
+        stmt = self._dialect_insert(Annotation).from_select(
+            ['user_id', 'image_id', 'status', 'updated_at'], pairs
+        )
+        if hasattr(stmt, 'on_conflict_do_nothing'):
+            stmt = stmt.on_conflict_do_nothing()
+        if self.dialect == 'postgresql':
+            created = stmt.returning(Annotation.user_id).cte('created')
+            created_per_user = session.execute(
+                select(created.c.user_id, func.count()).group_by(created.c.user_id)
+            ).all()
+        else:
+            # SQLite serializa las escrituras: lo que cuenta el SELECT es lo que inserta el INSERT
+            candidates = pairs.subquery()
+            created_per_user = session.execute(
+                select(candidates.c.user_id, func.count()).group_by(candidates.c.user_id)
+            ).all()
+            session.execute(stmt)
+        if created_per_user:
+            mark_annotation_changes(session)
+        self._apply_user_counter_deltas(
+            session, Counter({(user_id, 'pending'): count for user_id, count in created_per_user})
+        )
+        return sum(count for _, count in created_per_user)
+
+    def assign_tasks(self, user_ids: List[int], image_ids: List[int]) -> dict:
+        """Asigna tareas a usuarios (solo para admins) con sentencias set-based"""
         session = self.get_session()
         try:
-            assignments_created = 0
-            for user_id in user_ids:
-                for image_id in image_ids:
-                    # Verificar si ya existe la asignación
-                    existing = session.query(Annotation).filter_by(
-                        user_id=user_id,
-                        image_id=image_id
-                    ).first()
-                    
-                    if not existing:
-                        annotation = Annotation()
-                        annotation.user_id = user_id
-                        annotation.image_id = image_id
-                        annotation.status = 'pending'
-                        annotation.updated_at = datetime.now(timezone.utc)
-                        session.add(annotation)
-                        assignments_created += 1
-            
+            user_ids = sorted(set(user_ids))
+            image_ids = sorted(set(image_ids))
+            created = 0
+            for start in range(0, len(image_ids), IN_CHUNK_SIZE):
+                created += self._insert_assignments(session, user_ids, image_ids[start:start + IN_CHUNK_SIZE])
             session.commit()
-            return assignments_created
-        except Exception:
+            
+            # Pares no creados: ya asignados o IDs inexistentes
+            skipped = len(user_ids) * len(image_ids) - created
+            logger.info(f"Asignaciones creadas: {created}, omitidas: {skipped}")
+            return {'created': created, 'skipped': skipped}
+        except Exception as e:
             session.rollback()
-            return 0
+            logger.error(f"Error asignando tareas: {e}")
+            return {'created': 0, 'skipped': 0}
         finally:
-            session.close()
+            self.close_session(session)
+
+    def _sample_image_ids(self, session: Session, filters: list, count: int) -> List[int]:
+        """Muestrea hasta `count` imágenes al azar que cumplen `filters`.
+
+        Recorre el índice de Image.random_key desde un pivote aleatorio (dando la
+        vuelta al inicio si hace falta) en lugar de ordenar toda la tabla con
+        ORDER BY random(). Las imágenes sin random_key (insertadas fuera del ORM
+        después del arranque) entran en la vuelta, para que nunca queden fuera.
+        """
+        pivot = random.random()
+        candidates = select(Image.id).where(*filters)
+        image_ids = session.scalars(
+            candidates.where(Image.random_key >= pivot).order_by(Image.random_key).limit(count)
+        ).all()
+        if len(image_ids) < count:
+            image_ids += session.scalars(
+                candidates.where(or_(Image.random_key < pivot, Image.random_key.is_(None)))
+                .order_by(Image.random_key).limit(count - len(image_ids))
+            ).all()
+        return image_ids
 
     def assign_random_tasks(self, user_id: int, count: int, priority_unannotated: bool = True) -> int:
         """Asigna N tareas random a un usuario - Versión optimizada"""
         session = self.get_session()
         try:
-            from sqlalchemy import func, exists, and_, or_
+            from sqlalchemy import and_
             
             # Verificar que el usuario existe
             user = session.query(User).filter_by(id=user_id).first()
             if not user:
                 raise ValueError(f"Usuario con ID {user_id} no existe")
             
-            assignments_created = 0
-            
             if priority_unannotated:
                 # Usar NOT EXISTS en lugar de NOT IN para mejor rendimiento
                 # Buscar imágenes que NO tienen ninguna anotación (excepto admin pending)
@@ -336,10 +535,7 @@ class DatabaseService:
                         )
                     )
                 )
-                
-                available_images = session.query(Image).filter(
-                    not_annotated_subquery
-                ).order_by(func.random()).limit(count).all()
+                filters = [not_annotated_subquery]
                 
             else:
                 # Buscar imágenes que:
@@ -359,34 +555,16 @@ class DatabaseService:
                         Annotation.user_id == user_id
                     )
                 )
-                
-                available_images = session.query(Image).filter(
-                    admin_annotated_subquery,
-                    user_not_has_subquery
-                ).order_by(func.random()).limit(count).all()
+                filters = [admin_annotated_subquery, user_not_has_subquery]
             
-            # Optimización: hacer un bulk insert en lugar de insertar uno por uno
-            new_annotations = []
-            for image in available_images:
-                # Usar get() en lugar de filter_by().first() es más rápido
-                # pero necesitamos verificar por ambas claves
-                existing = session.query(Annotation.id).filter_by(
-                    user_id=user_id,
-                    image_id=image.id
-                ).scalar()
-                
-                if not existing:
-                    annotation = Annotation()
-                    annotation.user_id = user_id
-                    annotation.image_id = image.id
-                    annotation.status = 'pending'
-                    annotation.updated_at = datetime.now(timezone.utc)
-                    new_annotations.append(annotation)
-                    assignments_created += 1
+            image_ids = self._sample_image_ids(session, filters, count)
             
-            # Bulk insert si hay anotaciones nuevas
-            if new_annotations:
-                session.bulk_save_objects(new_annotations)
+            # Inserción masiva; los pares ya existentes se descartan en la misma sentencia
+            assignments_created = 0
+            for start in range(0, len(image_ids), IN_CHUNK_SIZE):
+                assignments_created += self._insert_assignments(
+                    session, [user_id], image_ids[start:start + IN_CHUNK_SIZE]
+                )
             
             session.commit()
             return assignments_created
@@ -395,68 +573,33 @@ class DatabaseService:
             session.rollback()
             raise e
         finally:
-            session.close()
+            self.close_session(session)
     
     def get_image_annotations(self, image_id: int) -> List[Annotation]:
         """Obtiene todas las anotaciones de una imagen"""
         session = self.get_session()
         try:
-            annotations = session.query(Annotation).filter(
+            return session.query(Annotation).filter(
                 Annotation.image_id == image_id
             ).all()
-            
-            # Crear instancias desvinculadas
-            detached_annotations = []
-            for annotation in annotations:
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                detached_annotations.append(detached_annotation)
-            
-            return detached_annotations
         finally:
-            session.close()
+            self.close_session(session)
     
     def get_all_images(self) -> List[Image]:
         """Obtiene todas las imágenes"""
         session = self.get_session()
         try:
-            images = session.query(Image).all()
-            
-            # Crear instancias desvinculadas
-            detached_images = []
-            for image in images:
-                detached_image = Image()
-                detached_image.id = image.id
-                detached_image.image_path = image.image_path
-                detached_image.initial_ocr_text = image.initial_ocr_text
-                detached_images.append(detached_image)
-            
-            return detached_images
+            return session.query(Image).all()
         finally:
-            session.close()
+            self.close_session(session)
     
     def get_all_users(self) -> List[User]:
         """Obtiene todos los usuarios"""
         session = self.get_session()
         try:
-            users = session.query(User).all()
-            
-            # Crear instancias desvinculadas
-            detached_users = []
-            for user in users:
-                detached_user = User(username=user.username, password='dummy', role=user.role)
-                detached_user.id = user.id
-                detached_user.password_hash = user.password_hash
-                detached_users.append(detached_user)
-            
-            return detached_users
+            return session.query(User).all()
         finally:
-            session.close()
+            self.close_session(session)
     
     def create_user(self, username: str, password: str, role: str = 'annotator') -> Optional[User]:
         """Crea un nuevo usuario"""
@@ -470,64 +613,423 @@ class DatabaseService:
             user = User(username=username, password=password, role=role)
             session.add(user)
             session.commit()
-            
-            # Crear una instancia desvinculada antes de cerrar la sesión
-            detached_user = User(username=user.username, password="", role=user.role)
-            detached_user.id = user.id
-            detached_user.password_hash = user.password_hash
-            
-            return detached_user
+            # SQLite puede reutilizar el id de un usuario eliminado
+            self.invalidate_cached_user(user.id)
+            # expire_on_commit=False: los atributos (incluido el id) siguen disponibles
+            return user
         except Exception:
             session.rollback()
             return None
         finally:
-            session.close()
+            self.close_session(session)
+    
+    def update_user_role(self, user_id: int, role: str) -> Optional[User]:
+        """Cambia el rol de un usuario"""
+        session = self.get_session()
+        try:
+            user = session.query(User).filter_by(id=user_id).first()
+            if not user:
+                return None
+            # Si cambia el admin de referencia del agreement, todas las comparaciones cambian
+            reference_admin = self._reference_admin_id(session)
+            user.role = role
+            session.flush()
+            if self._reference_admin_id(session) != reference_admin:
+                self._rebuild_agreements(session)
+            session.commit()
+            self.invalidate_cached_user(user_id)
+            logger.info(f"Rol del usuario {user_id} cambiado a {role}")
+            return user
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error cambiando rol del usuario {user_id}: {e}")
+            return None
+        finally:
+            self.close_session(session)
     
-    def create_image(self, image_path: str, initial_ocr_text: str) -> Optional[Image]:
+    def create_image(self, image_path: str, initial_ocr_text: str, content_hash: str = None) -> Optional[Image]:
         """Crea una nueva imagen"""
         session = self.get_session()
         try:
-            image = Image(image_path=image_path, initial_ocr_text=initial_ocr_text)
+            image = Image(image_path=image_path, initial_ocr_text=initial_ocr_text, content_hash=content_hash)
             session.add(image)
             session.commit()
-            
-            # Crear una instancia desvinculada antes de cerrar la sesión
-            detached_image = Image(image_path=image.image_path, initial_ocr_text=image.initial_ocr_text)
-            detached_image.id = image.id
-            
-            return detached_image
+            return image
         except Exception:
             session.rollback()
             return None
         finally:
-            session.close()
+            self.close_session(session)
     
+    def find_existing_images(self, image_paths: List[str], content_hashes: List[str]) -> Tuple[set, set]:
+        """De los image_path y content_hash dados, los que ya existen en la BD (para deduplicar importaciones)"""
+        session = self.get_session()
+        try:
+            existing_paths = set(session.execute(
+                select(Image.image_path).where(Image.image_path.in_(image_paths))
+            ).scalars()) if image_paths else set()
+            existing_hashes = set(session.execute(
+                select(Image.content_hash).where(Image.content_hash.in_(content_hashes))
+            ).scalars()) if content_hashes else set()
+            return existing_paths, existing_hashes
+        finally:
+            self.close_session(session)
+    
+    def bulk_create_images(self, rows: List[Tuple[str, str, str]]) -> int:
+        """Inserta (image_path, initial_ocr_text, content_hash) en un único INSERT multi-fila"""
+        if not rows:
+            return 0
+        session = self.get_session()
+        try:
+            session.execute(insert(Image), [
+                {'image_path': image_path, 'initial_ocr_text': ocr_text,
+                 'content_hash': content_hash, 'random_key': random.random()}
+                for image_path, ocr_text, content_hash in rows
+            ])
+            session.commit()
+            return len(rows)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error insertando lote de {len(rows)} imágenes: {e}")
+            raise
+        finally:
+            self.close_session(session)
+    
+    def get_image_hashes(self) -> List[Tuple[str, str]]:
+        """(image_path, content_hash) de las imágenes con hash calculado, para el índice de ETags"""
+        session = self.get_session()
+        try:
+            return session.execute(
+                select(Image.image_path, Image.content_hash).where(Image.content_hash.isnot(None))
+            ).all()
+        finally:
+            self.close_session(session)
+    
+    def get_image_paths_in_range(self, from_id: int, to_id: int, limit: int) -> List[Tuple[int, str]]:
+        """(id, image_path) de las imágenes con id entre from_id y to_id, por id ascendente"""
+        session = self.get_session()
+        try:
+            return session.execute(
+                select(Image.id, Image.image_path)
+                .where(Image.id >= from_id, Image.id <= to_id)
+                .order_by(Image.id).limit(limit)
+            ).all()
+        finally:
+            self.close_session(session)
+    
+    def get_images_for_hashing(self, after_id: int = 0, limit: int = 1000,
+                               include_hashed: bool = False) -> List[Tuple[int, str]]:
+        """Página de (id, image_path) por id ascendente, por defecto solo las que no tienen hash"""
+        session = self.get_session()
+        try:
+            query = select(Image.id, Image.image_path).where(Image.id > after_id)
+            if not include_hashed:
+                query = query.where(Image.content_hash.is_(None))
+            return session.execute(query.order_by(Image.id).limit(limit)).all()
+        finally:
+            self.close_session(session)
+    
+    def set_image_hashes(self, hashes: List[Tuple[int, str]]) -> int:
+        """Guarda content_hash para una lista de (image_id, hash) en una transacción"""
+        if not hashes:
+            return 0
+        session = self.get_session()
+        try:
+            session.execute(
+                update(Image),
+                [{'id': image_id, 'content_hash': content_hash} for image_id, content_hash in hashes]
+            )
+            session.commit()
+            return len(hashes)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error guardando hashes de imágenes: {e}")
+            raise
+        finally:
+            self.close_session(session)
+    
+    # Contadores materializados de estadísticas
+    def _record_annotation_changes(self, session: Session, changes: list, touch_activity: bool = True):
+        """Aplica a user_annotation_counters y a images.completed_annotations los cambios de
+        anotaciones de la transacción en curso.
+
+        changes: tuplas (user_id, image_id, old_status, new_status); None en old_status indica
+        una anotación creada y None en new_status una eliminada. Se agregan en deltas
+        por (usuario, estado) y se escriben con un único upsert.
+        """
+        deltas = Counter()
+        image_deltas = Counter()
+        touched = set()
+        for user_id, image_id, old_status, new_status in changes:
+            if old_status != new_status:
+                if old_status is not None:
+                    deltas[(user_id, old_status)] -= 1
+                if new_status is not None:
+                    deltas[(user_id, new_status)] += 1
+                image_deltas[image_id] += (new_status in COMPLETED_STATUSES) - (old_status in COMPLETED_STATUSES)
+            if touch_activity and new_status in COMPLETED_STATUSES:
+                touched.add((user_id, new_status))
+        self._apply_image_completed_deltas(session, image_deltas)
+        self._apply_user_counter_deltas(session, deltas, touched)
+
+    def _apply_user_counter_deltas(self, session: Session, deltas: Counter, touched: set = frozenset()):
+        """Suma los deltas por (usuario, estado) a user_annotation_counters con un único upsert;
+        touched marca las claves cuya última actividad pasa a ser ahora"""
+        keys = set(deltas) | touched
+        if not keys:
+            return
+        
+        now = datetime.now(timezone.utc)
+        # Orden estable de claves para que upserts concurrentes no se bloqueen mutuamente
+        rows = [
+            {
+                'user_id': user_id,
+                'status': status,
+                'count': deltas.get((user_id, status), 0),
+                'last_activity': now if (user_id, status) in touched else None
+            }
+            for user_id, status in sorted(keys)
+        ]
+        stmt = self._dialect_insert(UserAnnotationCounter).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'status'],
+            set_={
+                'count': UserAnnotationCounter.count + stmt.excluded.count,
+                'last_activity': func.coalesce(stmt.excluded.last_activity, UserAnnotationCounter.last_activity)
+            }
+        )
+        session.execute(stmt)
+
+    def _apply_image_completed_deltas(self, session: Session, image_deltas: Counter):
+        """Suma los deltas a images.completed_annotations (un UPDATE por valor de delta)"""
+        by_delta = {}
+        for image_id, delta in sorted(image_deltas.items()):
+            if delta:
+                by_delta.setdefault(delta, []).append(image_id)
+        for delta, image_ids in by_delta.items():
+            session.execute(
+                update(Image).where(Image.id.in_(image_ids))
+                .values(completed_annotations=Image.completed_annotations + delta)
+                .execution_options(synchronize_session=False)
+            )
+
+    def rebuild_user_counters(self) -> int:
+        """Reconstruye user_annotation_counters e images.completed_annotations desde la tabla de anotaciones"""
+        session = self.get_session()
+        try:
+            session.execute(delete(UserAnnotationCounter))
+            session.execute(update(Image).values(completed_annotations=(
+                select(func.count(Annotation.id)).where(
+                    Annotation.image_id == Image.id,
+                    Annotation.status.in_(COMPLETED_STATUSES)
+                ).scalar_subquery()
+            )).execution_options(synchronize_session=False))
+            session.execute(
+                insert(UserAnnotationCounter).from_select(
+                    ['user_id', 'status', 'count', 'last_activity'],
+                    select(
+                        Annotation.user_id,
+                        Annotation.status,
+                        func.count(Annotation.id),
+                        func.max(Annotation.updated_at)
+                    ).group_by(Annotation.user_id, Annotation.status)
+                )
+            )
+            self._mark_built(session, USER_COUNTERS_BUILT)
+            session.commit()
+            rows = session.query(func.count()).select_from(UserAnnotationCounter).scalar()
+            logger.info(f"Contadores de anotaciones reconstruidos: {rows} filas")
+            return rows
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error reconstruyendo contadores de anotaciones: {e}")
+            raise
+        finally:
+            self.close_session(session)
+
+    def _mark_built(self, session: Session, name: str):
+        """Registra en la transacción en curso que el agregado `name` quedó poblado"""
+        stmt = self._dialect_insert(SequenceCounter).values(name=name, value=1)
+        if hasattr(stmt, 'on_conflict_do_nothing'):
+            stmt = stmt.on_conflict_do_nothing()
+        session.execute(stmt)
+
+    def is_built(self, name: str) -> bool:
+        """Indica si el agregado `name` se pobló alguna vez por completo"""
+        session = self.get_session()
+        try:
+            return session.get(SequenceCounter, name) is not None
+        finally:
+            self.close_session(session)
+
+    def ensure_materialized_stats(self):
+        """Puebla al arrancar los agregados que nunca se reconstruyeron por completo.
+
+        Se decide por la marca persistida y no por la creación de la tabla: si una
+        reconstrucción anterior falló o se interrumpió, se reintenta en el siguiente arranque.
+        Un fallo se registra y no impide arrancar.
+        """
+        if not self.is_built(USER_COUNTERS_BUILT):
+            try:
+                rows = self.rebuild_user_counters()
+                logger.info(f"Contadores de anotaciones inicializados: {rows} filas")
+            except Exception:
+                logger.exception("No se pudieron inicializar los contadores de anotaciones; se reintentará al reiniciar")
+        if not self.is_built(AGREEMENTS_BUILT):
+            try:
+                rows = self.rebuild_agreements()
+                logger.info(f"Agreements con el admin inicializados: {rows} comparaciones")
+            except Exception:
+                logger.exception("No se pudieron inicializar los agreements con el admin; se reintentará al reiniciar")
+
+    def _reference_admin_id(self, session: Session) -> Optional[int]:
+        """ID del admin contra el que se mide el agreement (el primer usuario admin)"""
+        return session.scalar(
+            select(User.id).where(User.role == 'admin').order_by(User.id).limit(1)
+        )
+
+    def _agreement_pairs(self, admin_id: int, image_ids: List[int] = None):
+        """SELECT (user_id, image_id, agrees) de anotaciones completadas comparables con las del admin.
+
+        Los textos vacíos o nulos se comparan como 'NULL', igual que el cálculo original.
+        """
+        user_annotation = aliased(Annotation)
+        admin_annotation = aliased(Annotation)
+        
+        def normalized(text_column):
+            return func.coalesce(func.nullif(text_column, ''), 'NULL')
+        
+        query = select(
+            user_annotation.user_id,
+            user_annotation.image_id,
+            (normalized(user_annotation.corrected_text) == normalized(admin_annotation.corrected_text)).label('agrees')
+        ).join(
+            admin_annotation,
+            and_(
+                admin_annotation.image_id == user_annotation.image_id,
+                admin_annotation.user_id == admin_id,
+                admin_annotation.status.in_(COMPLETED_STATUSES)
+            )
+        ).where(
+            user_annotation.user_id != admin_id,
+            user_annotation.status.in_(COMPLETED_STATUSES)
+        )
+        if image_ids is not None:
+            query = query.where(user_annotation.image_id.in_(image_ids))
+        return query
+
+    def _refresh_agreements(self, session: Session, image_ids):
+        """Recalcula annotation_agreements de las imágenes dadas dentro de la transacción en curso.
+
+        Se borran las comparaciones previas de esas imágenes y se vuelven a insertar
+        desde las anotaciones actuales; la diferencia se aplica a user_agreement_stats
+        con un único upsert, de modo que los totales por usuario quedan en O(1).
+        """
+        image_ids = sorted(set(image_ids))
+        if not image_ids:
+            return
+        # Las comparaciones se hacen en SQL: los cambios ORM pendientes deben estar escritos
+        session.flush()
+        admin_id = self._reference_admin_id(session)
+        
+        comparisons = Counter()
+        agreements = Counter()
+        for start in range(0, len(image_ids), IN_CHUNK_SIZE):
+            chunk = image_ids[start:start + IN_CHUNK_SIZE]
+            removed = session.execute(
+                delete(AnnotationAgreement)
+                .where(AnnotationAgreement.image_id.in_(chunk))
+                .returning(AnnotationAgreement.user_id, AnnotationAgreement.agrees)
+                .execution_options(synchronize_session=False)
+            )
+            for user_id, agrees in removed:
+                comparisons[user_id] -= 1
+                agreements[user_id] -= int(agrees)
+            
+            if admin_id is None:
+                continue
+            added = session.execute(
+                insert(AnnotationAgreement).from_select(
+                    ['user_id', 'image_id', 'agrees'],
+                    self._agreement_pairs(admin_id, chunk)
+                ).returning(AnnotationAgreement.user_id, AnnotationAgreement.agrees)
+            )
+            for user_id, agrees in added:
+                comparisons[user_id] += 1
+                agreements[user_id] += int(agrees)
+        
+        rows = [
+            {'user_id': user_id, 'comparisons': comparisons[user_id], 'agreements': agreements[user_id]}
+            for user_id in sorted(set(comparisons) | set(agreements))
+            if comparisons[user_id] or agreements[user_id]
+        ]
+        if not rows:
+            return
+        stmt = self._dialect_insert(UserAgreementStats).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={
+                'comparisons': UserAgreementStats.comparisons + stmt.excluded.comparisons,
+                'agreements': UserAgreementStats.agreements + stmt.excluded.agreements
+            }
+        )
+        session.execute(stmt)
+
+    def rebuild_agreements(self) -> int:
+        """Reconstruye annotation_agreements y user_agreement_stats desde las anotaciones"""
+        session = self.get_session()
+        try:
+            self._rebuild_agreements(session)
+            session.commit()
+            rows = session.query(func.count()).select_from(AnnotationAgreement).scalar()
+            logger.info(f"Agreements con el admin reconstruidos: {rows} comparaciones")
+            return rows
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error reconstruyendo agreements: {e}")
+            raise
+        finally:
+            self.close_session(session)
+
+    def _rebuild_agreements(self, session: Session):
+        """Recalcula los agreements en la sesión dada, sin hacer commit"""
+        session.execute(delete(AnnotationAgreement))
+        session.execute(delete(UserAgreementStats))
+        admin_id = self._reference_admin_id(session)
+        if admin_id is not None:
+            session.execute(
+                insert(AnnotationAgreement).from_select(
+                    ['user_id', 'image_id', 'agrees'],
+                    self._agreement_pairs(admin_id)
+                )
+            )
+            session.execute(
+                insert(UserAgreementStats).from_select(
+                    ['user_id', 'comparisons', 'agreements'],
+                    select(
+                        AnnotationAgreement.user_id,
+                        func.count(),
+                        func.sum(case((AnnotationAgreement.agrees, 1), else_=0))
+                    ).group_by(AnnotationAgreement.user_id)
+                )
+            )
+        self._mark_built(session, AGREEMENTS_BUILT)
+
     # Métodos de estadísticas
     def get_user_stats(self, user_id: int) -> dict:
-        """Obtiene estadísticas de un usuario - Optimizada con comparación admin"""
+        """Obtiene estadísticas de un usuario desde los contadores materializados"""
         session = self.get_session()
         try:
-            from sqlalchemy import func, case, and_, exists
-            
-            # Una sola consulta con COUNT y CASE para obtener todas las estadísticas básicas
-            result = session.query(
-                func.count(Annotation.id).label('total'),
-                func.sum(case((Annotation.status == 'pending', 1), else_=0)).label('pending'),
-                func.sum(case((Annotation.status == 'corrected', 1), else_=0)).label('corrected'),
-                func.sum(case((Annotation.status == 'approved', 1), else_=0)).label('approved'),
-                func.sum(case((Annotation.status == 'discarded', 1), else_=0)).label('discarded')
-            ).filter(Annotation.user_id == user_id).first()
+            counts = dict(session.query(
+                UserAnnotationCounter.status,
+                UserAnnotationCounter.count
+            ).filter(UserAnnotationCounter.user_id == user_id).all())
             
-            stats = {
-                'total': result.total or 0,
-                'pending': result.pending or 0,
-                'corrected': result.corrected or 0,
-                'approved': result.approved or 0,
-                'discarded': result.discarded or 0,
-            }
+            stats = {status: counts.get(status, 0) for status in ANNOTATION_STATUSES}
+            stats = {'total': sum(stats.values()), **stats}
             return stats
         finally:
-            session.close()
+            self.close_session(session)
 
     def get_general_stats(self) -> dict:
         """Obtiene estadísticas generales del sistema - Optimizada"""
@@ -536,25 +1038,25 @@ class DatabaseService:
             from sqlalchemy import func, distinct, case, and_
             
             # Consultas separadas pero más eficientes
-            total_users = session.query(func.count(distinct(User.id))).scalar()
-            total_images = session.query(func.count(distinct(Image.id))).scalar()
+            total_users = session.query(func.count(User.id)).scalar()
+            total_images = session.query(func.count(Image.id)).scalar()
             
-            # Consulta única para estadísticas de anotaciones
+            # Totales de usuarios no-admin desde los contadores materializados (O(usuarios))
             annotation_stats = session.query(
-                # Anotaciones totales (solo usuarios no-admin)
-                func.sum(case((User.role != 'admin', 1), else_=0)).label('total_annotations'),
-                # Tareas pendientes (solo usuarios no-admin)
-                func.sum(case((and_(Annotation.status == 'pending', User.role != 'admin'), 1), else_=0)).label('pending_tasks'),
-                # Tareas completadas (solo usuarios no-admin)
-                func.sum(case((and_(Annotation.status.in_(['corrected', 'approved', 'discarded']), User.role != 'admin'), 1), else_=0)).label('completed_tasks'),
-                # Imágenes únicas con anotaciones completadas (todos los usuarios para progreso)
-                func.count(distinct(case((Annotation.status.in_(['corrected', 'approved', 'discarded']), Annotation.image_id)))).label('annotated_images_for_progress')
-            ).join(User, Annotation.user_id == User.id).first()
+                func.sum(UserAnnotationCounter.count).label('total_annotations'),
+                func.sum(case((UserAnnotationCounter.status == 'pending', UserAnnotationCounter.count), else_=0)).label('pending_tasks'),
+                func.sum(case((UserAnnotationCounter.status.in_(COMPLETED_STATUSES), UserAnnotationCounter.count), else_=0)).label('completed_tasks')
+            ).join(User, UserAnnotationCounter.user_id == User.id).filter(User.role != 'admin').first()
+            
+            # Imágenes con al menos una anotación completada (todos los usuarios para progreso),
+            # desde el contador materializado por imagen: se resuelve con su índice
+            annotated_images_for_progress = session.query(
+                func.count(Image.id)
+            ).filter(Image.completed_annotations > 0).scalar() or 0
             
             total_annotations = annotation_stats.total_annotations or 0
             pending_tasks = annotation_stats.pending_tasks or 0
             completed_tasks = annotation_stats.completed_tasks or 0
-            annotated_images_for_progress = annotation_stats.annotated_images_for_progress or 0
             
             # Imágenes sin anotar
             unannotated_images = total_images - annotated_images_for_progress
@@ -573,7 +1075,7 @@ class DatabaseService:
                 'progress_percentage': progress_percentage
             }
         finally:
-            session.close()
+            self.close_session(session)
 
     def get_recent_user_activity(self, limit: int = 6) -> List[dict]:
         """Obtiene la actividad reciente de usuarios - Solo actividad real (no asignaciones)"""
@@ -581,56 +1083,31 @@ class DatabaseService:
         try:
             from sqlalchemy import func, desc, and_, case
             
-            # Subconsulta para obtener la última actividad real de cada usuario (solo anotaciones revisadas)
-            last_activity_subquery = session.query(
-                Annotation.user_id,
-                func.max(Annotation.updated_at).label('last_activity')
-            ).filter(
-                Annotation.status.in_(['corrected', 'approved', 'discarded'])
-            ).group_by(Annotation.user_id).subquery()
+            # Última actividad real (solo estados revisados) y totales desde los contadores materializados
+            last_activity = func.max(case(
+                (UserAnnotationCounter.status.in_(COMPLETED_STATUSES), UserAnnotationCounter.last_activity)
+            ))
+            
+            def count_for(statuses):
+                return func.sum(case((UserAnnotationCounter.status.in_(statuses), UserAnnotationCounter.count), else_=0))
             
-            # Query principal que obtiene estadísticas completas pero ordena por actividad real
             user_activity = session.query(
                 User.id,
                 User.username,
-                last_activity_subquery.c.last_activity,
-                func.count(Annotation.id).label('total_assigned'),
-                func.sum(
-                    case(
-                        (Annotation.status.in_(['corrected', 'approved', 'discarded']), 1),
-                        else_=0
-                    )
-                ).label('completed'),
-                func.sum(
-                    case(
-                        (Annotation.status == 'approved', 1),
-                        else_=0
-                    )
-                ).label('approved'),
-                func.sum(
-                    case(
-                        (Annotation.status == 'corrected', 1),
-                        else_=0
-                    )
-                ).label('corrected'),
-                func.sum(
-                    case(
-                        (Annotation.status == 'discarded', 1),
-                        else_=0
-                    )
-                ).label('discarded')
+                last_activity.label('last_activity'),
+                func.sum(UserAnnotationCounter.count).label('total_assigned'),
+                count_for(COMPLETED_STATUSES).label('completed'),
+                count_for(['approved']).label('approved'),
+                count_for(['corrected']).label('corrected'),
+                count_for(['discarded']).label('discarded')
             ).join(
-                Annotation, User.id == Annotation.user_id
-            ).join(
-                last_activity_subquery, User.id == last_activity_subquery.c.user_id
-            ).filter(
-                Annotation.user_id.isnot(None)
+                UserAnnotationCounter, User.id == UserAnnotationCounter.user_id
             ).group_by(
-                User.id, User.username, last_activity_subquery.c.last_activity
+                User.id, User.username
             ).having(
-                last_activity_subquery.c.last_activity.isnot(None)
+                last_activity.isnot(None)
             ).order_by(
-                desc(last_activity_subquery.c.last_activity)
+                desc(last_activity)
             ).limit(limit).all()
             
             # Formatear los resultados
@@ -662,61 +1139,86 @@ class DatabaseService:
             
             return activity_list
         except Exception as e:
-            print(f"Error in get_recent_user_activity: {e}")
+            session.rollback()
+            logger.error(f"Error obteniendo actividad reciente de usuarios: {e}")
             return []
         finally:
-            session.close()
+            self.close_session(session)
     
-    def get_all_images_with_annotations(self) -> List[dict]:
-        """Obtiene todas las imágenes con información de sus anotaciones"""
+    def get_all_images_with_annotations(self, cursor: str = None, limit: int = PAGE_SIZE_DEFAULT,
+                                        sort: str = 'id') -> dict:
+        """Obtiene una página de imágenes con información de sus anotaciones.
+
+        sort: 'id' o '-id'. Retorna {'items', 'next_cursor', 'has_more', 'total_estimate'};
+        ValueError si el orden o el cursor no son válidos.
+        """
+        if sort not in ('id', '-id'):
+            raise ValueError(f"Orden inválido: {sort}")
         session = self.get_session()
         try:
-            from sqlalchemy import func, case
+            images, next_cursor = self._keyset_page(
+                session.query(Image.id, Image.image_path, Image.initial_ocr_text),
+                sort, [(Image.id, cursor_int)], lambda row: (row.id,),
+                cursor=cursor, limit=limit, descending=sort.startswith('-')
+            )
             
-            # Obtener imágenes con estadísticas de anotaciones
-            images_query = session.query(
-                Image,
-                func.count(Annotation.id).label('total_annotations'),
-                func.sum(case((Annotation.status == 'pending', 1), else_=0)).label('pending'),
-                func.sum(case((Annotation.status == 'corrected', 1), else_=0)).label('corrected'),
-                func.sum(case((Annotation.status == 'approved', 1), else_=0)).label('approved'),
-                func.sum(case((Annotation.status == 'discarded', 1), else_=0)).label('discarded')
-            ).outerjoin(Annotation).group_by(Image.id).all()
+            # Estadísticas de anotaciones solo de las imágenes de la página
+            counts = {}
+            if images:
+                status_counts = session.query(
+                    Annotation.image_id,
+                    Annotation.status,
+                    func.count(Annotation.id)
+                ).filter(
+                    Annotation.image_id.in_([image.id for image in images])
+                ).group_by(Annotation.image_id, Annotation.status)
+                for image_id, status, count in status_counts:
+                    counts.setdefault(image_id, Counter())[status] = count
             
             result = []
-            for image, total_annotations, pending, corrected, approved, discarded in images_query:
+            for image in images:
+                image_counts = counts.get(image.id, Counter())
                 result.append({
                     'id': image.id,
                     'image_path': image.image_path,
                     'initial_ocr_text': image.initial_ocr_text[:100] + '...' if len(image.initial_ocr_text) > 100 else image.initial_ocr_text,
-                    'total_annotations': total_annotations or 0,
-                    'pending': pending or 0,
-                    'corrected': corrected or 0,
-                    'approved': approved or 0,
-                    'discarded': discarded or 0
+                    'total_annotations': sum(image_counts.values()),
+                    'pending': image_counts['pending'],
+                    'corrected': image_counts['corrected'],
+                    'approved': image_counts['approved'],
+                    'discarded': image_counts['discarded']
                 })
             
-            return result
+            return {
+                'items': result,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'total_estimate': self._estimate_row_count(session, Image)
+            }
         finally:
-            session.close()
+            self.close_session(session)
+
+    def get_all_users_with_stats(self, cursor: str = None, limit: int = PAGE_SIZE_DEFAULT) -> dict:
+        """Obtiene una página de usuarios con sus estadísticas de tareas, ordenados por username.
 
-    def get_all_users_with_stats(self) -> List[dict]:
-        """Obtiene todos los usuarios con sus estadísticas de tareas"""
+        Retorna {'items', 'next_cursor', 'has_more', 'total_estimate'}; ValueError si el cursor no es válido.
+        """
         session = self.get_session()
         try:
-            from sqlalchemy import func, case
-            
-            # Consulta que une usuarios con estadísticas de anotaciones
-            result = session.query(
+            # Consulta que une usuarios con sus contadores materializados
+            query = session.query(
                 User.id,
                 User.username,
                 User.role,
-                func.count(Annotation.id).label('total_assigned'),
-                func.sum(case((Annotation.status.in_(['corrected', 'approved', 'discarded']), 1), else_=0)).label('completed'),
-                func.sum(case((Annotation.status == 'pending', 1), else_=0)).label('pending')
-            ).outerjoin(Annotation, User.id == Annotation.user_id)\
-             .group_by(User.id, User.username, User.role)\
-             .order_by(User.username).all()
+                func.sum(UserAnnotationCounter.count).label('total_assigned'),
+                func.sum(case((UserAnnotationCounter.status.in_(COMPLETED_STATUSES), UserAnnotationCounter.count), else_=0)).label('completed'),
+                func.sum(case((UserAnnotationCounter.status == 'pending', UserAnnotationCounter.count), else_=0)).label('pending')
+            ).outerjoin(UserAnnotationCounter, User.id == UserAnnotationCounter.user_id)\
+             .group_by(User.id, User.username, User.role)
+            result, next_cursor = self._keyset_page(
+                query, 'username', [(User.username, cursor_str), (User.id, cursor_int)],
+                lambda row: (row.username, row.id), cursor=cursor, limit=limit
+            )
             
             users_with_stats = []
             for row in result:
@@ -730,35 +1232,54 @@ class DatabaseService:
                 }
                 users_with_stats.append(user_dict)
             
-            return users_with_stats
+            return {
+                'items': users_with_stats,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'total_estimate': session.query(func.count(User.id)).scalar()
+            }
         finally:
-            session.close()
+            self.close_session(session)
     
-    def get_user_annotations_detailed(self, user_id: int) -> List[dict]:
-        """Obtiene todas las anotaciones de un usuario con detalles, ordenadas por fecha"""
+    def get_user_annotations_detailed(self, user_id: int, cursor: str = None, limit: int = PAGE_SIZE_DEFAULT,
+                                      sort: str = '-updated_at') -> dict:
+        """Obtiene una página de anotaciones de un usuario con detalles, ordenadas por fecha.
+
+        sort: '-updated_at' (más recientes primero) o 'updated_at'. Retorna {'items' (UserAnnotationRow),
+        'next_cursor', 'has_more', 'total_estimate'}; ValueError si el orden o el cursor no son válidos.
+        """
+        if sort not in ('-updated_at', 'updated_at'):
+            raise ValueError(f"Orden inválido: {sort}")
         session = self.get_session()
         try:
-            annotations = session.query(Annotation, Image).join(
-                Image, Annotation.image_id == Image.id
-            ).filter(
-                Annotation.user_id == user_id
-            ).order_by(Annotation.updated_at.desc()).all()
+            rows, next_cursor = self._keyset_page(
+                session.query(
+                    Annotation.id, Annotation.image_id, Image.image_path, Image.initial_ocr_text,
+                    Annotation.corrected_text, Annotation.status, Annotation.updated_at
+                ).join(
+                    Image, Annotation.image_id == Image.id
+                ).filter(
+                    Annotation.user_id == user_id
+                ),
+                sort, [(Annotation.updated_at, cursor_datetime), (Annotation.id, cursor_int)],
+                lambda row: (row.updated_at, row.id),
+                cursor=cursor, limit=limit, descending=sort.startswith('-')
+            )
+            result = [UserAnnotationRow._make(row) for row in rows]
             
-            result = []
-            for annotation, image in annotations:
-                result.append({
-                    'annotation_id': annotation.id,
-                    'image_id': image.id,
-                    'image_path': image.image_path,
-                    'initial_ocr_text': image.initial_ocr_text[:100] + '...' if len(image.initial_ocr_text) > 100 else image.initial_ocr_text,
-                    'corrected_text': annotation.corrected_text[:100] + '...' if annotation.corrected_text and len(annotation.corrected_text) > 100 else annotation.corrected_text,
-                    'status': annotation.status,
-                    'updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None
-                })
+            # Total exacto y en O(1) desde los contadores materializados
+            total = session.query(
+                func.coalesce(func.sum(UserAnnotationCounter.count), 0)
+            ).filter(UserAnnotationCounter.user_id == user_id).scalar()
             
-            return result
+            return {
+                'items': result,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'total_estimate': total
+            }
         finally:
-            session.close()
+            self.close_session(session)
 
     def delete_user_annotation(self, annotation_id: int, user_id: int) -> bool:
         """Elimina una anotación específica de un usuario"""
@@ -770,7 +1291,11 @@ class DatabaseService:
             ).first()
             
             if annotation:
+                record_annotation_deletions(session, Annotation.id == annotation.id)
                 session.delete(annotation)
+                self._record_annotation_changes(session, [(user_id, annotation.image_id, annotation.status, None)])
+                if annotation.status in COMPLETED_STATUSES:
+                    self._refresh_agreements(session, [annotation.image_id])
                 session.commit()
                 logger.info(f"Anotación {annotation_id} del usuario {user_id} eliminada")
                 return True
@@ -780,16 +1305,22 @@ class DatabaseService:
             logger.error(f"Error eliminando anotación {annotation_id}: {e}")
             return False
         finally:
-            session.close()
+            self.close_session(session)
 
     def delete_user_annotations_by_status(self, user_id: int, statuses: List[str]) -> int:
         """Elimina todas las anotaciones de un usuario por estado(s)"""
         session = self.get_session()
         try:
-            deleted_count = session.query(Annotation).filter(
-                Annotation.user_id == user_id,
-                Annotation.status.in_(statuses)
-            ).delete(synchronize_session=False)
+            record_annotation_deletions(session, Annotation.user_id == user_id, Annotation.status.in_(statuses))
+            deleted = session.execute(
+                delete(Annotation).where(
+                    Annotation.user_id == user_id,
+                    Annotation.status.in_(statuses)
+                ).returning(Annotation.status, Annotation.image_id).execution_options(synchronize_session=False)
+            ).all()
+            deleted_count = len(deleted)
+            self._record_annotation_changes(session, [(user_id, image_id, status, None) for status, image_id in deleted])
+            self._refresh_agreements(session, [image_id for status, image_id in deleted if status in COMPLETED_STATUSES])
             
             session.commit()
             logger.info(f"Eliminadas {deleted_count} anotaciones del usuario {user_id} con estados {statuses}")
@@ -799,20 +1330,40 @@ class DatabaseService:
             logger.error(f"Error eliminando anotaciones del usuario {user_id}: {e}")
             return 0
         finally:
-            session.close()
+            self.close_session(session)
 
     def delete_user_completely(self, user_id: int) -> bool:
         """Elimina un usuario y todas sus anotaciones"""
         session = self.get_session()
         try:
-            # Primero eliminar todas las anotaciones del usuario
+            # Si es el admin de referencia del agreement, todas las comparaciones cambian
+            is_reference_admin = self._reference_admin_id(session) == user_id
+            
+            # Primero eliminar todas las anotaciones del usuario, sus contadores y sus agreements
+            reviewed_image_ids = session.scalars(
+                select(Annotation.image_id).where(
+                    Annotation.user_id == user_id,
+                    Annotation.status.in_(COMPLETED_STATUSES)
+                )
+            ).all()
+            record_annotation_deletions(session, Annotation.user_id == user_id)
             deleted_annotations = session.query(Annotation).filter_by(user_id=user_id).delete()
+            self._apply_image_completed_deltas(session, Counter({image_id: -1 for image_id in reviewed_image_ids}))
+            session.query(UserAnnotationCounter).filter_by(user_id=user_id).delete()
+            if not is_reference_admin:
+                self._refresh_agreements(session, reviewed_image_ids)
+            session.query(AnnotationAgreement).filter_by(user_id=user_id).delete()
+            session.query(UserAgreementStats).filter_by(user_id=user_id).delete()
             
             # Luego eliminar el usuario
             user = session.query(User).filter_by(id=user_id).first()
             if user:
                 session.delete(user)
+                if is_reference_admin:
+                    session.flush()
+                    self._rebuild_agreements(session)
                 session.commit()
+                self.invalidate_cached_user(user_id)
                 logger.info(f"Usuario {user_id} eliminado junto con {deleted_annotations} anotaciones")
                 return True
             return False
@@ -821,7 +1372,7 @@ class DatabaseService:
             logger.error(f"Error eliminando usuario {user_id}: {e}")
             return False
         finally:
-            session.close()
+            self.close_session(session)
 
     def transfer_user_annotations(self, from_user_id: int, to_user_id: int, 
                                  include_pending: bool = True, include_reviewed: bool = True) -> dict:
@@ -853,6 +1404,9 @@ class DatabaseService:
             
             transferred_count = 0
             skipped_count = 0
+            changes = []
+            moves = []
+            reviewed_image_ids = []
             
             # Destino es admin (por rol o por ID 1)
             is_to_admin = (to_user.role == 'admin') or (to_user_id == 1)
@@ -868,10 +1422,12 @@ class DatabaseService:
                     # Caso especial: si el destino es admin y su anotación está pendiente,
                     # y la anotación del origen NO está pendiente, consolidamos:
                     if is_to_admin and existing.status == 'pending' and annotation.status != 'pending':
+                        changes.append((to_user_id, existing.image_id, existing.status, annotation.status))
                         # Determinar texto a aplicar; si fue "approved" sin texto, usar OCR inicial
                         existing.corrected_text = annotation.corrected_text
                         existing.status = annotation.status
                         existing.updated_at = datetime.now(timezone.utc)
+                        reviewed_image_ids.append(existing.image_id)
                         transferred_count += 1
                         # No reasignamos ni borramos la anotación de origen; se considera consolidada
                         continue
@@ -882,12 +1438,20 @@ class DatabaseService:
                 
                 # Transferir la anotación
                 annotation.user_id = to_user_id
+                moves.append((from_user_id, annotation.image_id, annotation.status, None))
+                moves.append((to_user_id, annotation.image_id, None, annotation.status))
+                if annotation.status in COMPLETED_STATUSES:
+                    reviewed_image_ids.append(annotation.image_id)
                 # Si es una anotación revisada, mantener el estado; si es pending, resetear fecha
                 if annotation.status == 'pending':
                     annotation.updated_at = datetime.now(timezone.utc)
                 
                 transferred_count += 1
             
+            self._record_annotation_changes(session, changes)
+            # Mover anotaciones no es actividad nueva del usuario destino
+            self._record_annotation_changes(session, moves, touch_activity=False)
+            self._refresh_agreements(session, reviewed_image_ids)
             session.commit()
             
             logger.info(f"Transferidas {transferred_count} anotaciones de usuario {from_user_id} a {to_user_id}")
@@ -904,24 +1468,30 @@ class DatabaseService:
             logger.error(f"Error transfiriendo anotaciones: {e}")
             return {'success': False, 'error': str(e)}
         finally:
-            session.close()
+            self.close_session(session)
     
     # Métodos para Control de Calidad
-    def get_quality_control_annotations(self, user_ids: List[int] = None, usernames: List[str] = None) -> List[dict]:
-        """Obtiene anotaciones para control de calidad: mismo image_id anotado por admin y otro usuario con respuestas distintas.
+    def get_quality_control_annotations(self, user_ids: List[int] = None, usernames: List[str] = None,
+                                        cursor: str = None, limit: int = PAGE_SIZE_DEFAULT,
+                                        sort: str = '-updated_at') -> dict:
+        """Obtiene una página de anotaciones para control de calidad: mismo image_id anotado por admin y otro usuario con respuestas distintas.
         Filtros opcionales:
           - user_ids: lista de IDs de usuario a incluir
           - usernames: lista de usernames a incluir
+        sort: '-updated_at' (más recientes primero) o 'updated_at'.
+        Retorna {'items' (QualityControlRow), 'next_cursor', 'has_more', 'total_estimate'};
+        ValueError si el orden, el cursor o algún user_id no son válidos.
         """
+        if sort not in ('-updated_at', 'updated_at'):
+            raise ValueError(f"Orden inválido: {sort}")
+        empty_page = {'items': [], 'next_cursor': None, 'has_more': False, 'total_estimate': 0}
         session = self.get_session()
         try:
-            from sqlalchemy import and_, func, or_
-
             # Primero, encontrar imágenes que tienen anotaciones tanto del admin como de otros usuarios
-            admin_user = session.query(User).filter_by(role='admin').first()
-            if not admin_user:
+            admin_user_id = self._reference_admin_id(session)
+            if admin_user_id is None:
                 logger.warning("No se encontró usuario admin para control de calidad")
-                return []
+                return empty_page
 
             # Subconsulta para obtener anotaciones del admin (no pending)
             admin_annotations = session.query(
@@ -932,7 +1502,7 @@ class DatabaseService:
                 Annotation.updated_at.label('admin_updated_at')
             ).filter(
                 and_(
-                    Annotation.user_id == admin_user.id,
+                    Annotation.user_id == admin_user_id,
                     Annotation.status != 'pending'
                 )
             ).subquery()
@@ -941,19 +1511,25 @@ class DatabaseService:
             # que tengan una anotación correspondiente del admin en la misma imagen
             # y que el texto corregido sea diferente o uno de los dos sea NULL
             query = session.query(
-                Annotation,
-                Image,
-                User,
+                Annotation.id,
+                Annotation.image_id,
+                Image.image_path,
+                Image.initial_ocr_text,
+                Annotation.user_id,
+                User.username,
+                Annotation.corrected_text,
+                Annotation.status,
+                Annotation.updated_at,
+                admin_annotations.c.admin_annotation_id,
                 admin_annotations.c.admin_text,
                 admin_annotations.c.admin_status,
-                admin_annotations.c.admin_annotation_id,
                 admin_annotations.c.admin_updated_at
-            ).join(Image, Annotation.image_id == Image.id)\
+            ).select_from(Annotation).join(Image, Annotation.image_id == Image.id)\
             .join(User, Annotation.user_id == User.id)\
             .join(admin_annotations, Annotation.image_id == admin_annotations.c.image_id)\
             .filter(
                 and_(
-                    Annotation.user_id != admin_user.id,
+                    Annotation.user_id != admin_user_id,
                     Annotation.status != 'pending',
                     admin_annotations.c.admin_status != 'pending',
                     or_(
@@ -974,51 +1550,41 @@ class DatabaseService:
 
             # Aplicar filtros opcionales por usuario
             if user_ids:
-                try:
-                    ids = [int(x) for x in user_ids]
-                    if ids:
-                        query = query.filter(Annotation.user_id.in_(ids))
-                except Exception:
-                    pass
+                query = query.filter(Annotation.user_id.in_([int(x) for x in user_ids]))
             elif usernames:
-                if usernames:
-                    query = query.filter(User.username.in_(usernames))
+                query = query.filter(User.username.in_(usernames))
 
-            quality_data = query.order_by(Annotation.updated_at.desc()).all()
-            # Crear lista de resultados
-            results = []
-            for annotation, image, user, admin_text, admin_status, admin_annotation_id, admin_updated_at in quality_data:
-                logger.debug(f"Control de calidad: {user.username} - {image.image_path} - {annotation.status} vs {admin_status}")
-                # Determinar el texto final del usuario (corrected_text o texto original de la imagen)
-                user_final_text = annotation.corrected_text if annotation.corrected_text else "NULL"
-                admin_final_text = admin_text if admin_text else "NULL"
-                
-                results.append({
-                    'annotation_id': annotation.id,
-                    'image_id': image.id,
-                    'image_path': image.image_path,
-                    'initial_ocr_text': image.initial_ocr_text,
-                    'user_id': user.id,
-                    'username': user.username,
-                    'user_annotation_text': user_final_text,
-                    'user_status': annotation.status,
-                    'user_updated_at': annotation.updated_at.isoformat() if annotation.updated_at else None,
-                    'admin_annotation_id': admin_annotation_id,
-                    'admin_annotation_text': admin_final_text,
-                    'admin_status': admin_status,
-                    'admin_updated_at': admin_updated_at.isoformat() if admin_updated_at else None
-                })
+            # El total se cuenta con el mismo WHERE que la página
+            total = query.with_entities(func.count()).scalar()
+
+            rows, next_cursor = self._keyset_page(
+                query, sort, [(Annotation.updated_at, cursor_datetime), (Annotation.id, cursor_int)],
+                lambda row: (row.updated_at, row.id),
+                cursor=cursor, limit=limit, descending=sort.startswith('-')
+            )
+            results = [QualityControlRow._make(row) for row in rows]
             
-            logger.info(f"Control de calidad: encontradas {len(results)} discrepancias")
-            return results
+            logger.info(f"Control de calidad: {len(results)} discrepancias en la página")
+            return {
+                'items': results,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'total_estimate': total
+            }
+        except ValueError:
+            raise
         except Exception as e:
+            session.rollback()
             logger.error(f"Error obteniendo datos de control de calidad: {e}")
-            return []
+            return empty_page
         finally:
-            session.close()
+            self.close_session(session)
 
     def consolidate_annotation(self, user_annotation_id: int, admin_annotation_id: int) -> bool:
-        """Consolida una anotación: actualiza la anotación del admin con el texto del usuario"""
+        """Consolida una anotación: actualiza la anotación del admin con el texto del usuario.
+
+        False si las anotaciones no existen, son de imágenes distintas o no hay texto que copiar.
+        """
         session = self.get_session()
         try:
             # Obtener ambas anotaciones
@@ -1045,259 +1611,205 @@ class DatabaseService:
                 logger.warning(f"No se pudo determinar el texto final del usuario para consolidación")
                 return False
             
-            success = self.update_annotation(admin_annotation_id, admin_annotation.user_id, user_annotation.status, user_final_text)
-            # Actualizar la anotación del admin
-            # admin_annotation.corrected_text = user_final_text
-            # admin_annotation.status = 'corrected'  # Marcar como corregida
-            # admin_annotation.updated_at = datetime.now(timezone.utc)
-            
+            # Actualizar la anotación del admin en la misma transacción
+            self._apply_annotation_update(session, admin_annotation, user_annotation.status, user_final_text)
             session.commit()
-            if not success:
-                logger.error(f"Error actualizando anotación del admin {admin_annotation_id} con texto del usuario {user_annotation_id}")
-                return False
             logger.info(f"Anotación consolidada exitosamente: admin_annotation={admin_annotation_id} actualizada con texto de user_annotation={user_annotation_id}")
             return True
             
-        except Exception as e:
-            logger.error(f"Error consolidando anotación: {e}")
+        except Exception:
             session.rollback()
-            return False
+            logger.exception(f"Error consolidando anotación: user={user_annotation_id}, admin={admin_annotation_id}")
+            raise
         finally:
-            session.close()
+            self.close_session(session)
 
-    def get_annotation_with_image(self, annotation_id: int, user_id: int = None) -> Optional[Tuple[Annotation, Image]]:
+    def get_annotation_with_image(self, annotation_id: int, user_id: int = None) -> Optional[TaskRow]:
         """Obtiene una anotación con su imagen asociada"""
         session = self.get_session()
         try:
-            query = session.query(Annotation).join(Image).filter(Annotation.id == annotation_id)
+            query = select(*TASK_COLUMNS).join(Image, Annotation.image_id == Image.id).where(
+                Annotation.id == annotation_id
+            )
             if user_id:
-                query = query.filter(Annotation.user_id == user_id)
-            
-            annotation = query.first()
-            if annotation:
-                image = annotation.image
-                
-                # Crear instancias desvinculadas
-                detached_annotation = Annotation()
-                detached_annotation.id = annotation.id
-                detached_annotation.image_id = annotation.image_id
-                detached_annotation.user_id = annotation.user_id
-                detached_annotation.corrected_text = annotation.corrected_text
-                detached_annotation.status = annotation.status
-                detached_annotation.updated_at = annotation.updated_at
-                
-                detached_image = Image()
-                detached_image.id = image.id
-                detached_image.image_path = image.image_path
-                detached_image.initial_ocr_text = image.initial_ocr_text
-                
-                return (detached_annotation, detached_image)
-            return None
+                query = query.where(Annotation.user_id == user_id)
+            row = session.execute(query).first()
+            return TaskRow._make(row) if row else None
         finally:
-            session.close()
+            self.close_session(session)
     
     def calculate_user_admin_agreement(self, user_id: int) -> float:
         """Calcula el porcentaje de agreement entre un usuario y el admin"""
         session = self.get_session()
         try:
-            from sqlalchemy import and_, func
-            
-            # Obtener el ID del admin
-            admin = session.query(User).filter_by(role='admin').first()
-            if not admin:
+            stats = session.get(UserAgreementStats, user_id)
+            if not stats or not stats.comparisons:
                 return 0.0
             
-            # Query para encontrar imágenes anotadas por ambos (usuario y admin)
-            # donde ambos hayan completado la anotación (no pending)
-            user_annotations = session.query(Annotation).filter(
-                and_(
-                    Annotation.user_id == user_id,
-                    Annotation.status.in_(['corrected', 'approved', 'discarded']),
-                    Annotation.corrected_text.isnot(None)
-                )
-            ).subquery()
-            
-            admin_annotations = session.query(Annotation).filter(
-                and_(
-                    Annotation.user_id == admin.id,
-                    Annotation.status.in_(['corrected', 'approved', 'discarded']),
-                    Annotation.corrected_text.isnot(None)
-                )
-            ).subquery()
-            
-            # Encontrar imágenes donde ambos tienen anotaciones completadas
-            common_images = session.query(
-                user_annotations.c.image_id,
-                user_annotations.c.corrected_text.label('user_text'),
-                admin_annotations.c.corrected_text.label('admin_text')
-            ).join(
-                admin_annotations,
-                user_annotations.c.image_id == admin_annotations.c.image_id
-            ).all()
-            
-            if not common_images:
-                return 0.0
-            
-            # Contar agreements (textos idénticos)
-            agreements = 0
-            total_comparisons = len(common_images)
-            
-            for image_id, user_text, admin_text in common_images:
-                # Normalizar textos para comparación (strip whitespace, lowercase)
-                user_text_norm = (user_text or '').strip().lower()
-                admin_text_norm = (admin_text or '').strip().lower()
-                
-                if user_text_norm == admin_text_norm:
-                    agreements += 1
-            
-            # Calcular porcentaje
-            agreement_percentage = (agreements / total_comparisons * 100) if total_comparisons > 0 else 0.0
-            
-            logger.debug(f"Agreement para usuario {user_id}: {agreements}/{total_comparisons} = {agreement_percentage:.1f}%")
-            
+            agreement_percentage = stats.agreements / stats.comparisons * 100
+            logger.debug(f"Agreement para usuario {user_id}: {stats.agreements}/{stats.comparisons} = {agreement_percentage:.1f}%")
             return round(agreement_percentage, 1)
             
         except Exception as e:
+            session.rollback()
             logger.error(f"Error calculando agreement para usuario {user_id}: {e}")
             return 0.0
         finally:
-            session.close()
+            self.close_session(session)
 
     def get_all_users_agreement_stats(self) -> dict:
-        """Obtiene estadísticas de agreement para todos los usuarios (optimizado)"""
+        """Obtiene estadísticas de agreement para todos los usuarios desde user_agreement_stats"""
         session = self.get_session()
         try:
-            from sqlalchemy import and_, func, case
-            
-            # Obtener el ID del admin
-            admin = session.query(User).filter_by(role='admin').first()
-            if not admin:
-                return {}
-            
-            # Query optimizada para calcular agreements de todos los usuarios de una vez
-            # Subconsulta para anotaciones de usuarios (no admin)
-            user_annotations = session.query(
-                Annotation.user_id,
-                Annotation.image_id,
-                Annotation.corrected_text.label('user_text')
-            ).filter(
-                and_(
-                    Annotation.user_id != admin.id,
-                    Annotation.status.in_(['corrected', 'approved', 'discarded'])                    
-                )
-            ).subquery()
-            
-            # Subconsulta para anotaciones del admin
-            admin_annotations = session.query(
-                Annotation.image_id,
-                Annotation.corrected_text.label('admin_text')
-            ).filter(
-                and_(
-                    Annotation.user_id == admin.id,
-                    Annotation.status.in_(['corrected', 'approved', 'discarded'])
-                )
-            ).subquery()
-            
-            # Unir anotaciones de usuarios con anotaciones del admin
-            comparisons = session.query(
-                user_annotations.c.user_id,
-                user_annotations.c.user_text,
-                admin_annotations.c.admin_text,
-                admin_annotations.c.image_id
-            ).join(
-                admin_annotations,
-                user_annotations.c.image_id == admin_annotations.c.image_id
-            ).all()
+            rows = session.query(UserAgreementStats).filter(UserAgreementStats.comparisons > 0).all()
             
-            # Procesar resultados para calcular agreements por usuario
-            user_stats = {}
-            for user_id, user_text, admin_text, image_id in comparisons:
-                if user_id not in user_stats:
-                    user_stats[user_id] = {'total': 0, 'agreements': 0}
-                
-                user_stats[user_id]['total'] += 1
-                #logger.debug(f"Comparando image_id {image_id} para usuario {user_id}. Texto usuario: {user_text}, Texto admin: {admin_text}.")
-                
-                # Normalizar textos para comparación
-                user_text_norm = (user_text if user_text else 'NULL')
-                admin_text_norm = (admin_text if admin_text else 'NULL')
-
-                if user_text_norm == admin_text_norm:
-                    user_stats[user_id]['agreements'] += 1
-                    #logger.debug(f"Agreement encontrado para usuario {user_id} en image_id {image_id}")
-                else:
-                    logger.debug(f"No agreement para usuario {user_id} en image_id {image_id}. Texto usuario: {user_text_norm}, Texto admin: {admin_text_norm}")
-
-            
-            # Calcular porcentajes
             result = {}
-            for user_id, stats in user_stats.items():
-                agreement_pct = (stats['agreements'] / stats['total'] * 100) if stats['total'] > 0 else 0.0
-                result[user_id] = {
+            for stats in rows:
+                agreement_pct = stats.agreements / stats.comparisons * 100
+                result[stats.user_id] = {
                     'agreement_percentage': round(agreement_pct, 1),
-                    'total_comparisons': stats['total'],
-                    'agreements': stats['agreements']
+                    'total_comparisons': stats.comparisons,
+                    'agreements': stats.agreements
                 }
             
-            logger.debug(f"Agreement stats calculadas para {len(result)} usuarios")
+            logger.debug(f"Agreement stats obtenidas para {len(result)} usuarios")
             return result
             
         except Exception as e:
-            logger.error(f"Error calculando agreement stats: {e}")
+            session.rollback()
+            logger.error(f"Error obteniendo agreement stats: {e}")
             return {}
         finally:
-            session.close()
+            self.close_session(session)
 
-    def export_annotations_by_image(self) -> dict:
-        """Exporta todas las anotaciones agrupadas por image_id con username como clave
-        
-        Estructura de retorno:
-        {
-            "image_id_1": {
-                "username1": "texto_corregido1",
-                "username2": "texto_corregido2",
-                ...
-            },
-            "image_id_2": {
-                ...
-            }
-        }
+    def iter_annotations_for_export(self, statuses: List[str] = None, user_ids: List[int] = None,
+                                    updated_since: datetime = None, updated_until: datetime = None,
+                                    batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+        """Recorre las anotaciones a exportar sin cargarlas completas en memoria.
+
+        La consulta se ejecuta con yield_per, que activa stream_results (cursor del
+        lado del servidor en PostgreSQL), y las filas se entregan lote a lote. Cada
+        fila trae image_id, image_path, user_id, username, status, corrected_text y
+        updated_at, ordenadas por imagen y usuario. La sesión vive mientras se itera
+        y se cierra al agotar o cerrar el generador.
+        """
+        query = select(
+            Annotation.image_id,
+            Image.image_path,
+            Annotation.user_id,
+            User.username,
+            Annotation.status,
+            Annotation.corrected_text,
+            Annotation.updated_at
+        ).join(
+            User, Annotation.user_id == User.id
+        ).join(
+            Image, Annotation.image_id == Image.id
+        ).where(
+            Annotation.status.in_(statuses or COMPLETED_STATUSES)
+        )
+        if user_ids:
+            query = query.where(Annotation.user_id.in_(user_ids))
+        if updated_since is not None:
+            query = query.where(Annotation.updated_at >= updated_since)
+        if updated_until is not None:
+            query = query.where(Annotation.updated_at < updated_until)
+        query = query.order_by(Annotation.image_id, User.username)
+        yield from self._stream_query(query, batch_size)
+
+    def iter_annotation_changes(self, after: int = None, statuses: List[str] = None, limit: int = None,
+                                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+        """Recorre las anotaciones modificadas o eliminadas después de la posición `after` del feed.
+
+        Orden y filtro keyset sobre change_seq (idx_annotation_change_seq), que se asigna en
+        orden de commit: todo lo confirmado después de entregar un cursor queda por delante de
+        él, sin importar cuánto duró la transacción. Las filas incluyen annotation_id,
+        change_seq y deleted además de las columnas de iter_annotations_for_export.
+
+        Las eliminaciones salen de annotation_deletions con deleted=True, status y
+        corrected_text en None y updated_at con la fecha del borrado; no se filtran por
+        estado, para que un consumidor nunca conserve una anotación que ya no existe.
+        """
+        changed = select(
+            Annotation.id.label('annotation_id'),
+            Annotation.change_seq,
+            Annotation.image_id,
+            Image.image_path,
+            Annotation.user_id,
+            User.username,
+            Annotation.status,
+            Annotation.corrected_text,
+            Annotation.updated_at,
+            literal(False).label('deleted')
+        ).join(
+            User, Annotation.user_id == User.id
+        ).join(
+            Image, Annotation.image_id == Image.id
+        ).where(Annotation.change_seq > (after or 0))
+        if statuses:
+            changed = changed.where(Annotation.status.in_(statuses))
+        deleted = select(
+            AnnotationDeletion.annotation_id,
+            AnnotationDeletion.change_seq,
+            AnnotationDeletion.image_id,
+            Image.image_path,
+            AnnotationDeletion.user_id,
+            User.username,
+            literal(None, String).label('status'),
+            literal(None, Text).label('corrected_text'),
+            AnnotationDeletion.deleted_at.label('updated_at'),
+            literal(True).label('deleted')
+        ).outerjoin(
+            User, AnnotationDeletion.user_id == User.id
+        ).outerjoin(
+            Image, AnnotationDeletion.image_id == Image.id
+        ).where(AnnotationDeletion.change_seq > (after or 0))
+        feed = union_all(changed, deleted).subquery()
+        query = select(feed).order_by(feed.c.change_seq).limit(limit)
+        yield from self._stream_query(query, batch_size)
+
+    def _keyset_page(self, query, sort: str, keys: list, row_key, cursor: str = None,
+                     limit: int = PAGE_SIZE_DEFAULT, descending: bool = False) -> Tuple[list, Optional[str]]:
+        """Aplica paginación keyset a una consulta ORM y retorna (filas, next_cursor).
+
+        keys: pares (columna, parser de cursor) que forman una clave de orden única;
+        row_key extrae de una fila los valores de esa clave. El cursor incluye el nombre
+        del orden para rechazar cursores de otro orden (ValueError). next_cursor es None
+        en la última página.
+        """
+        columns = [column for column, _ in keys]
+        if cursor:
+            values = decode_cursor(cursor, len(keys) + 1)
+            if values[0] != sort:
+                raise ValueError("El cursor corresponde a otro orden")
+            after = tuple_(*[parse(value) for (_, parse), value in zip(keys, values[1:])])
+            query = query.filter(tuple_(*columns) < after if descending else tuple_(*columns) > after)
+        query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+        rows = query.limit(limit + 1).all()
+        next_cursor = encode_cursor(sort, *row_key(rows[limit - 1])) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def _estimate_row_count(self, session: Session, model) -> int:
+        """Total aproximado de filas de una tabla: estadísticas del planner en PostgreSQL, COUNT(*) en otros motores"""
+        if self.dialect == 'postgresql':
+            estimate = session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                {'table': model.__tablename__}
+            ).scalar()
+            # reltuples es -1 (o 0) mientras la tabla no se ha analizado
+            if estimate and estimate > 0:
+                return estimate
+        return session.query(func.count()).select_from(model).scalar()
+
+    def _stream_query(self, query, batch_size: int) -> Iterator:
+        """Ejecuta una consulta con yield_per y entrega sus filas lote a lote.
+
+        La sesión vive mientras se itera y se cierra al agotar o cerrar el generador.
         """
         session = self.get_session()
         try:
-            # Query optimizada: obtener todas las anotaciones con username en una sola consulta
-            annotations = session.query(
-                Annotation.image_id,
-                User.username,
-                Annotation.corrected_text,
-                Annotation.status
-            ).join(
-                User, Annotation.user_id == User.id
-            ).filter(
-                Annotation.status.in_(['corrected', 'approved', 'discarded'])  # Solo exportar anotaciones completadas
-            ).order_by(
-                Annotation.image_id,
-                User.username
-            ).all()
-            
-            # Agrupar por image_id
-            result = {}
-            for image_id, username, corrected_text, status in annotations:
-                # formatear nombre a muchos 0s a la izquierda
-                # img_00000000001
-                image_key = f"img_{image_id:0>11}"
-                
-                if image_key not in result:
-                    result[image_key] = {}
-                
-                # Usar el texto corregido, o vacío si es None
-                result[image_key][username] = corrected_text if corrected_text else "NULL"
-            
-            logger.info(f"Exportadas anotaciones de {len(result)} imágenes")
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error exportando anotaciones: {e}")
-            return {}
+            result = session.execute(query.execution_options(yield_per=batch_size))
+            for partition in result.partitions():
+                yield from partition
         finally:
-            session.close()
+            self.close_session(session)
@@ -0,0 +1,119 @@
+"""
+Caché de archivos derivados en disco (paquetes de imágenes, miniaturas), acotada por tamaño.
+
+Las escrituras son atómicas (temporal + rename), así que varios workers pueden generar el mismo
+archivo a la vez sin leer uno a medio escribir. Cada acceso actualiza el mtime y, al superar el
+tamaño máximo, se eliminan primero los archivos usados hace más tiempo.
+
+Cada proceso lleva un total de bytes en uso que suma sus propias escrituras, así que una escritura
+no recorre la carpeta. Solo se recorre (y se desaloja) al superar el máximo o cada
+CACHE_RESCAN_INTERVAL segundos, para incorporar lo que escribieron o borraron otros workers.
+"""
+import os
+import time
+import logging
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Optional
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+TEMP_SUFFIX = '.tmp'
+# Cada cuánto se recalcula el total recorriendo la carpeta aunque no se haya superado (segundos)
+CACHE_RESCAN_INTERVAL = 60
+
+class DiskCache:
+    """Carpeta de archivos con desalojo LRU por tamaño total"""
+
+    def __init__(self, folder: str, max_bytes: int, name: str = 'caché'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.name = name
+        self._evict_lock = threading.Lock()
+        self._total_lock = threading.Lock()
+        self._total: Optional[int] = None  # bytes en uso estimados; None hasta el primer recorrido
+        self._next_scan = 0.0
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+
+    def get(self, filename: str) -> Optional[str]:
+        """Ruta del archivo si está en la caché (marcándolo como usado), None si no"""
+        path = self.path(filename)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, filename: str, writer: Callable[[BinaryIO], None]) -> str:
+        """Genera el archivo con writer(file) y lo publica de forma atómica; retorna su ruta"""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(filename)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=TEMP_SUFFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+                size = f.tell()
+            try:
+                # Otro worker pudo publicar el mismo archivo: se reemplaza, no se suma dos veces
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._add_bytes(size)
+        return path
+
+    def put_bytes(self, filename: str, data: bytes) -> str:
+        return self.put(filename, lambda f: f.write(data))
+
+    def _add_bytes(self, size: int):
+        """Suma una escritura al total y recorre la carpeta solo si hace falta"""
+        with self._total_lock:
+            if self._total is not None:
+                self._total += size
+            scan = (self._total is None or self._total > self.max_bytes
+                    or time.monotonic() >= self._next_scan)
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """Recorre la carpeta, recalcula el total y elimina los archivos usados hace más tiempo
+        mientras se supere el tamaño máximo"""
+        # Si otro hilo ya está desalojando, no hace falta repetirlo
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(TEMP_SUFFIX):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+            with self._total_lock:
+                self._total = total
+                self._next_scan = time.monotonic() + CACHE_RESCAN_INTERVAL
+            if evicted:
+                logger.info(f"{self.name}: {evicted} archivos eliminados ({total} bytes en uso)")
+        finally:
+            self._evict_lock.release()
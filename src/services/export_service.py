@@ -0,0 +1,249 @@
+"""
+Servicio de exportación de anotaciones en streaming (JSON, JSON Lines, CSV, Parquet y Arrow)
+"""
+import csv
+import io
+import logging
+import zlib
+from typing import Iterable, Iterator
+
+from services.json_provider import dumps_bytes
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él solo se ofrecen los formatos de texto
+    pa = None
+    pq = None
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+# Formato -> (content type, extensión)
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+# Formatos columnares que requieren pyarrow
+ARROW_FORMATS = {'parquet', 'arrow'}
+
+EXPORT_COLUMNS = ['image_key', 'image_id', 'image_path', 'user_id', 'username',
+                  'status', 'corrected_text', 'updated_at']
+
+# Filas por bloque de salida en formatos de texto y por row group/record batch en Arrow
+TEXT_CHUNK_ROWS = 1000
+ARROW_BATCH_ROWS = 50000
+
+def image_key(image_id: int) -> str:
+    """Clave de imagen usada en las exportaciones: img_00000000001"""
+    return f"img_{image_id:0>11}"
+
+def export_record(row) -> dict:
+    """Fila de exportación como dict serializable (columnas EXPORT_COLUMNS)"""
+    return {
+        'image_key': image_key(row.image_id),
+        'image_id': row.image_id,
+        'image_path': row.image_path,
+        'user_id': row.user_id,
+        'username': row.username,
+        'status': row.status,
+        'corrected_text': row.corrected_text,
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None
+    }
+
+class _StreamSink(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes para entregarlos por partes.
+
+    tell() reporta el total escrito, como exige el escritor de Parquet para los offsets del footer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ExportService:
+    """Codifica filas de anotaciones en distintos formatos como un flujo de bytes"""
+
+    @staticmethod
+    def is_available(fmt: str) -> bool:
+        """Indica si el formato es conocido y sus dependencias están instaladas"""
+        if fmt not in EXPORT_FORMATS:
+            return False
+        return fmt not in ARROW_FORMATS or pa is not None
+
+    @staticmethod
+    def content_type(fmt: str, compress: bool = False) -> str:
+        return 'application/gzip' if compress else EXPORT_FORMATS[fmt][0]
+
+    @staticmethod
+    def filename(fmt: str, compress: bool = False, prefix: str = 'annotations_export') -> str:
+        name = f"{prefix}.{EXPORT_FORMATS[fmt][1]}"
+        return f"{name}.gz" if compress else name
+
+    def stream(self, rows: Iterable, fmt: str, compress: bool = False, metadata: dict = None) -> Iterator[bytes]:
+        """Genera la exportación por bloques; la memoria usada no depende del total de filas.
+
+        rows: iterable de filas con image_id, image_path, user_id, username, status,
+        corrected_text y updated_at (ver DatabaseService.iter_annotations_for_export).
+        metadata: datos extra para el formato json (export_date, exported_by).
+        """
+        encoders = {
+            'json': self._iter_json,
+            'jsonl': self._iter_jsonl,
+            'csv': self._iter_csv,
+            'parquet': self._iter_parquet,
+            'arrow': self._iter_arrow,
+        }
+        chunks = encoders[fmt](rows, metadata or {})
+        return self._gzip(chunks) if compress else chunks
+
+    def _iter_json(self, rows: Iterable, metadata: dict) -> Iterator[bytes]:
+        """Mismo documento que la exportación original ({data: {img: {username: texto}}, metadata}),
+        escrito incrementalmente; requiere filas ordenadas por imagen."""
+        yield b'{"success": true, "data": {'
+        buffer = []
+        current_image = None
+        total_images = 0
+        total_annotations = 0
+        for row in rows:
+            if row.image_id != current_image:
+                if current_image is not None:
+                    buffer.append(b'}, ')
+                buffer.append(dumps_bytes(image_key(row.image_id)) + b': {')
+                current_image = row.image_id
+                total_images += 1
+            else:
+                buffer.append(b', ')
+            # Usar el texto corregido, o "NULL" si es None
+            buffer.append(dumps_bytes(row.username) + b': ' + dumps_bytes(row.corrected_text or "NULL"))
+            total_annotations += 1
+            if total_annotations % TEXT_CHUNK_ROWS == 0:
+                yield b''.join(buffer)
+                buffer = []
+        if current_image is not None:
+            buffer.append(b'}')
+        metadata = {'total_images': total_images, 'total_annotations': total_annotations, **metadata}
+        buffer.append(b'}, "metadata": ' + dumps_bytes(metadata) + b'}')
+        yield b''.join(buffer)
+        logger.info(f"Exportación json completada: {total_annotations} anotaciones de {total_images} imágenes")
+
+    def _iter_jsonl(self, rows: Iterable, metadata: dict) -> Iterator[bytes]:
+        buffer = []
+        count = 0
+        for row in rows:
+            buffer.append(dumps_bytes(export_record(row)))
+            count += 1
+            if len(buffer) >= TEXT_CHUNK_ROWS:
+                yield b'\n'.join(buffer) + b'\n'
+                buffer = []
+        if buffer:
+            yield b'\n'.join(buffer) + b'\n'
+        logger.info(f"Exportación jsonl completada: {count} anotaciones")
+
+    def _iter_csv(self, rows: Iterable, metadata: dict) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        count = 0
+        for row in rows:
+            writer.writerow(export_record(row))
+            count += 1
+            if count % TEXT_CHUNK_ROWS == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+        logger.info(f"Exportación csv completada: {count} anotaciones")
+
+    @staticmethod
+    def _arrow_schema():
+        return pa.schema([
+            ('image_key', pa.string()),
+            ('image_id', pa.int64()),
+            ('image_path', pa.string()),
+            ('user_id', pa.int64()),
+            ('username', pa.string()),
+            ('status', pa.string()),
+            ('corrected_text', pa.string()),
+            ('updated_at', pa.timestamp('us', tz='UTC')),
+        ])
+
+    def _iter_arrow_batches(self, rows: Iterable, schema) -> Iterator:
+        """Agrupa las filas en RecordBatches de ARROW_BATCH_ROWS"""
+        columns = {name: [] for name in schema.names}
+        size = 0
+        for row in rows:
+            columns['image_key'].append(image_key(row.image_id))
+            columns['image_id'].append(row.image_id)
+            columns['image_path'].append(row.image_path)
+            columns['user_id'].append(row.user_id)
+            columns['username'].append(row.username)
+            columns['status'].append(row.status)
+            columns['corrected_text'].append(row.corrected_text)
+            columns['updated_at'].append(row.updated_at)
+            size += 1
+            if size >= ARROW_BATCH_ROWS:
+                yield pa.RecordBatch.from_pydict(columns, schema=schema)
+                columns = {name: [] for name in schema.names}
+                size = 0
+        if size:
+            yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+    def _iter_parquet(self, rows: Iterable, metadata: dict) -> Iterator[bytes]:
+        schema = self._arrow_schema()
+        sink = _StreamSink()
+        count = 0
+        with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+            for batch in self._iter_arrow_batches(rows, schema):
+                # Un row group por lote: el footer solo guarda sus metadatos
+                writer.write_batch(batch)
+                count += batch.num_rows
+                yield sink.drain()
+        yield sink.drain()
+        logger.info(f"Exportación parquet completada: {count} anotaciones")
+
+    def _iter_arrow(self, rows: Iterable, metadata: dict) -> Iterator[bytes]:
+        schema = self._arrow_schema()
+        sink = _StreamSink()
+        count = 0
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for batch in self._iter_arrow_batches(rows, schema):
+                writer.write_batch(batch)
+                count += batch.num_rows
+                yield sink.drain()
+        yield sink.drain()
+        logger.info(f"Exportación arrow completada: {count} anotaciones")
+
+    @staticmethod
+    def _gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Comprime el flujo en formato gzip sin acumularlo"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+# Instancia global del servicio de exportación
+export_service = ExportService()
@@ -0,0 +1,224 @@
+"""
+Importación masiva de imágenes: recorre un directorio, toma el texto OCR inicial de un
+diccionario JSON {nombre_de_imagen: texto}, hashea los archivos en un pool de procesos,
+descarta los duplicados (mismo contenido o mismo nombre que una imagen ya importada) e inserta
+las filas de Image por lotes, con un INSERT multi-fila por transacción.
+
+El hasheo del lote siguiente corre en el pool mientras se deduplica e inserta el actual.
+Se usa desde utils/ingest_images.py o, en segundo plano, desde POST /admin/images/ingest;
+el progreso de los trabajos del endpoint se guarda en el almacén de estado compartido para
+que cualquier worker pueda responder la consulta.
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from werkzeug.security import safe_join
+from config import Config
+from services.image_service import image_service, hash_file, APP_ROOT
+from services.json_provider import dumps_bytes, loads
+from services.state_store import state_store
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+
+# Lotes que cada proceso del pool toma de una vez
+HASH_CHUNK_SIZE = 64
+
+# Estado de los trabajos del endpoint: se conserva un día tras la última actualización
+INGEST_JOB_TTL = 24 * 3600
+# Reserva para que no corran dos importaciones a la vez; se renueva con cada lote
+INGEST_LOCK_KEY = 'ingest:running'
+INGEST_LOCK_TTL = 600
+
+@dataclass
+class IngestReport:
+    """Progreso / resultado de una importación"""
+    scanned: int = 0  # archivos de imagen encontrados
+    inserted: int = 0
+    duplicate_content: int = 0  # mismo contenido que una imagen existente o ya vista
+    duplicate_name: int = 0  # mismo nombre que una imagen existente o ya vista
+    missing_ocr: int = 0  # sin entrada en el diccionario OCR
+    unreadable: int = 0
+    elapsed_seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+class ImageIngestService:
+    """Importa directorios de imágenes a la tabla images"""
+
+    def __init__(self, db_service, config: Config = None):
+        config = config or Config.from_env()
+        self.db_service = db_service
+        self.workers = config.IMAGE_INGEST_WORKERS or os.cpu_count() or 1
+        self.batch_size = config.IMAGE_INGEST_BATCH_SIZE
+        root = config.IMAGE_INGEST_ROOT
+        self.ingest_root = root if os.path.isabs(root) else os.path.join(APP_ROOT, root)
+
+    @staticmethod
+    def load_ocr_dictionary(ocr_path: str) -> Dict[str, str]:
+        """Lee el JSON {nombre_de_imagen: texto OCR}"""
+        with open(ocr_path, 'rb') as f:
+            ocr = loads(f.read())
+        if not isinstance(ocr, dict):
+            raise ValueError(f"{ocr_path} debe contener un objeto JSON {{imagen: texto}}")
+        return ocr
+
+    @staticmethod
+    def scan_directory(directory: str) -> Iterator[Tuple[str, str]]:
+        """Recorre el directorio (recursivo) y produce (ruta relativa, ruta absoluta) de cada imagen"""
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, directory), path
+
+    def ingest(self, directory: str, ocr: Dict[str, str],
+               progress: Callable[[IngestReport], None] = None) -> IngestReport:
+        """
+        Importa las imágenes de un directorio
+
+        Args:
+            directory: Carpeta a recorrer; si no es IMAGES_FOLDER, las imágenes nuevas se copian ahí
+            ocr: Texto OCR inicial por nombre de archivo (o ruta relativa al directorio)
+            progress: Callback invocado tras cada lote con el reporte acumulado
+
+        Returns:
+            IngestReport: Totales de la importación
+        """
+        started = time.time()
+        report = IngestReport()
+        copy_files = os.path.realpath(directory) != os.path.realpath(image_service.images_folder)
+        logger.info(f"Importando imágenes de {directory} ({self.workers} procesos, lotes de {self.batch_size})")
+
+        executor = None
+        if self.workers > 1:
+            # spawn: los procesos no heredan los hilos ni las conexiones del proceso que importa
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            for batch, hashes in self._hashed_batches(self._batches(directory, ocr, report), executor):
+                self._insert_batch(batch, hashes, report, copy_files)
+                report.elapsed_seconds = round(time.time() - started, 1)
+                if progress:
+                    progress(report)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        report.elapsed_seconds = round(time.time() - started, 1)
+        logger.info(f"Importación de {directory} terminada: {report.to_dict()}")
+        return report
+
+    def _batches(self, directory: str, ocr: Dict[str, str], report: IngestReport) -> Iterator[List[tuple]]:
+        """Lotes de (image_path, texto OCR, ruta en disco); las imágenes sin OCR se descartan aquí"""
+        batch = []
+        for relative_path, path in self.scan_directory(directory):
+            report.scanned += 1
+            image_path = os.path.basename(path)
+            ocr_text = ocr.get(relative_path, ocr.get(image_path))
+            if ocr_text is None:
+                report.missing_ocr += 1
+                continue
+            batch.append((image_path, str(ocr_text), path))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _hashed_batches(batches: Iterator[List[tuple]], executor) -> Iterator[Tuple[List[tuple], List[Optional[str]]]]:
+        """Hashea cada lote en el pool, dejando el siguiente en curso mientras se procesa el actual"""
+        pending = None
+        for batch in batches:
+            paths = [path for _, _, path in batch]
+            hashes = executor.map(hash_file, paths, chunksize=HASH_CHUNK_SIZE) if executor else map(hash_file, paths)
+            if pending is not None:
+                yield pending[0], list(pending[1])
+            pending = (batch, hashes)
+        if pending is not None:
+            yield pending[0], list(pending[1])
+
+    def _insert_batch(self, batch: List[tuple], hashes: List[Optional[str]], report: IngestReport, copy_files: bool):
+        """Deduplica un lote contra sí mismo y contra la BD, copia los archivos nuevos e inserta"""
+        readable = []
+        for (image_path, ocr_text, path), content_hash in zip(batch, hashes):
+            if content_hash is None:
+                report.unreadable += 1
+            else:
+                readable.append((image_path, ocr_text, path, content_hash))
+        existing_paths, existing_hashes = self.db_service.find_existing_images(
+            [row[0] for row in readable], [row[3] for row in readable]
+        )
+
+        rows = []
+        for image_path, ocr_text, path, content_hash in readable:
+            if content_hash in existing_hashes:
+                report.duplicate_content += 1
+                continue
+            if image_path in existing_paths:
+                report.duplicate_name += 1
+                continue
+            existing_hashes.add(content_hash)
+            existing_paths.add(image_path)
+            if copy_files:
+                # La imagen debe poder servirse antes de que su fila exista
+                shutil.copyfile(path, os.path.join(image_service.images_folder, image_path))
+            rows.append((image_path, ocr_text, content_hash))
+
+        report.inserted += self.db_service.bulk_create_images(rows)
+        for image_path, _, content_hash in rows:
+            image_service.register_hash(image_path, content_hash)
+
+    # Trabajos en segundo plano (endpoint)
+    def resolve_ingest_path(self, path: str) -> Optional[str]:
+        """Ruta dentro de IMAGE_INGEST_ROOT (None si intenta salir de ella)"""
+        return safe_join(self.ingest_root, path)
+
+    def start_job(self, directory: str, ocr: Dict[str, str], started_by: str) -> Optional[str]:
+        """Lanza una importación en un hilo; retorna el id del trabajo o None si ya hay una en curso"""
+        job_id = uuid.uuid4().hex
+        if not state_store.add(INGEST_LOCK_KEY, job_id, INGEST_LOCK_TTL):
+            return None
+        self._save_job(job_id, {'status': 'running', 'directory': directory, 'started_by': started_by,
+                                'report': IngestReport().to_dict()})
+
+        def run():
+            def progress(report: IngestReport):
+                state_store.set(INGEST_LOCK_KEY, job_id, INGEST_LOCK_TTL)
+                self._save_job(job_id, {'status': 'running', 'directory': directory,
+                                        'started_by': started_by, 'report': report.to_dict()})
+            try:
+                report = self.ingest(directory, ocr, progress)
+                self._save_job(job_id, {'status': 'completed', 'directory': directory,
+                                        'started_by': started_by, 'report': report.to_dict()})
+            except Exception as e:
+                logger.error(f"Error en la importación {job_id} de {directory}: {e}")
+                job = self.get_job(job_id) or {}
+                self._save_job(job_id, {**job, 'status': 'failed', 'error': str(e)})
+            finally:
+                state_store.delete(INGEST_LOCK_KEY)
+
+        threading.Thread(target=run, name=f'image-ingest-{job_id[:8]}', daemon=True).start()
+        logger.info(f"Importación {job_id} de {directory} iniciada por {started_by}")
+        return job_id
+
+    @staticmethod
+    def _save_job(job_id: str, job: dict):
+        state_store.set(f"ingest:job:{job_id}", dumps_bytes(job).decode('utf-8'), INGEST_JOB_TTL)
+
+    @staticmethod
+    def get_job(job_id: str) -> Optional[dict]:
+        """Estado de un trabajo de importación (None si no existe o ya venció)"""
+        job = state_store.get(f"ingest:job:{job_id}")
+        return loads(job) if job is not None else None
@@ -0,0 +1,156 @@
+"""
+Paquetes de imágenes: varios recortes concatenados en un único archivo binario con un índice
+de offsets, para que el cliente descargue un lote completo de tareas en una sola petición.
+
+Formato: PACK_MAGIC, largo del índice (4 bytes, big endian), índice JSON y a continuación los
+bytes de cada imagen; los offsets del índice son absolutos dentro del archivo.
+
+El id del paquete es un hash de los nombres y hashes de contenido de sus imágenes, así que un
+paquete nunca cambia: se sirve con ETag fuerte, caché inmutable y soporte de Range. Los paquetes
+se guardan en una caché en disco acotada (ver services/disk_cache.py).
+"""
+import os
+import re
+import struct
+import hashlib
+import logging
+import mimetypes
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+from config import Config
+from services.disk_cache import DiskCache
+from services.image_service import image_service, APP_ROOT
+from services.json_provider import dumps_bytes, loads
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+PACK_SUFFIX = '.pack'
+PACK_MAGIC = b'IMGPACK1'
+PACK_HEADER = struct.Struct('>I')
+PACK_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+@dataclass(frozen=True)
+class PackEntry:
+    """Ubicación de una imagen dentro del paquete"""
+    filename: str
+    offset: int
+    length: int
+    etag: str
+    content_type: str
+
+    def to_dict(self) -> dict:
+        return {
+            'filename': self.filename,
+            'offset': self.offset,
+            'length': self.length,
+            'etag': self.etag,
+            'content_type': self.content_type
+        }
+
+@dataclass(frozen=True)
+class ImagePack:
+    """Paquete construido en disco"""
+    pack_id: str
+    path: str
+    size: int
+    entries: Tuple[PackEntry, ...]
+
+    def entry_for(self, filename: str) -> Optional[PackEntry]:
+        for entry in self.entries:
+            if entry.filename == filename:
+                return entry
+        return None
+
+class ImagePackService:
+    """Construye, cachea y localiza paquetes de imágenes"""
+
+    def __init__(self, pack_folder: str = None):
+        config = Config.from_env()
+        folder = pack_folder or config.IMAGE_PACK_FOLDER
+        if not os.path.isabs(folder):
+            folder = os.path.join(APP_ROOT, folder)
+        self.pack_folder = folder
+        self.max_images = config.IMAGE_PACK_MAX_IMAGES
+        self.cache = DiskCache(folder, config.IMAGE_PACK_CACHE_MAX_BYTES, name='Caché de paquetes')
+        logger.debug(f"ImagePackService inicializado con carpeta: {self.pack_folder}")
+
+    def build_pack(self, filenames: Iterable[str]) -> Optional[ImagePack]:
+        """
+        Obtiene (o construye) el paquete con las imágenes dadas, en ese orden
+
+        Las imágenes que no existen en disco se omiten; sin ninguna imagen retorna None.
+        """
+        infos = []
+        for filename in dict.fromkeys(filenames):
+            info = image_service.get_file_info(filename)
+            if info is not None:
+                infos.append(info)
+            if len(infos) >= self.max_images:
+                break
+        if not infos:
+            return None
+
+        pack_id = hashlib.sha256(
+            '\n'.join(f"{info.filename}:{info.etag}" for info in infos).encode('utf-8')
+        ).hexdigest()[:32]
+
+        pack = self.get_pack(pack_id)
+        if pack is not None:
+            return pack
+
+        layout = [(info, mimetypes.guess_type(info.filename)[0] or 'application/octet-stream') for info in infos]
+        entries, index = self._build_index(layout)
+        offset = entries[-1].offset + entries[-1].length
+
+        def write_pack(pack_file):
+            pack_file.write(PACK_MAGIC)
+            pack_file.write(PACK_HEADER.pack(len(index)))
+            pack_file.write(index)
+            for info, _ in layout:
+                with open(info.path, 'rb') as image_file:
+                    data = image_file.read()
+                if len(data) != info.size:
+                    raise OSError(f"La imagen {info.filename} cambió mientras se armaba el paquete")
+                pack_file.write(data)
+
+        path = self.cache.put(pack_id + PACK_SUFFIX, write_pack)
+        logger.debug(f"Paquete {pack_id} construido: {len(entries)} imágenes, {offset} bytes")
+        return ImagePack(pack_id, path, offset, tuple(entries))
+
+    @staticmethod
+    def _build_index(layout) -> Tuple[List[PackEntry], bytes]:
+        """Índice con offsets absolutos; como el índice va antes que los datos, su largo
+        desplaza los offsets y estos cambian su largo: se itera hasta que se estabiliza"""
+        index_length = 0
+        while True:
+            offset = len(PACK_MAGIC) + PACK_HEADER.size + index_length
+            entries = []
+            for info, content_type in layout:
+                entries.append(PackEntry(info.filename, offset, info.size, info.etag, content_type))
+                offset += info.size
+            index = dumps_bytes([entry.to_dict() for entry in entries])
+            if len(index) == index_length:
+                return entries, index
+            index_length = len(index)
+
+    def get_pack(self, pack_id: str) -> Optional[ImagePack]:
+        """Paquete ya construido (None si el id es inválido o no está en la caché)"""
+        if not PACK_ID_PATTERN.match(pack_id):
+            return None
+        path = self.cache.get(pack_id + PACK_SUFFIX)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as pack_file:
+                if pack_file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+                    return None
+                (index_length,) = PACK_HEADER.unpack(pack_file.read(PACK_HEADER.size))
+                entries = tuple(PackEntry(**entry) for entry in loads(pack_file.read(index_length)))
+            size = os.path.getsize(path)
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+        return ImagePack(pack_id, path, size, entries)
+
+# Instancia global del servicio de paquetes de imágenes
+image_pack_service = ImagePackService()
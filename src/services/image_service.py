@@ -0,0 +1,115 @@
+"""
+Servicio de archivos de imagen: ubicación y metadatos (tamaño, ETag) de los recortes servidos
+
+El ETag es el SHA-256 del contenido. Los hashes se calculan al importar imágenes (o con
+utils/build_image_hashes.py), se guardan en images.content_hash y se cargan al arrancar en
+un índice en memoria; las imágenes sin hash precalculado se hashean en su primer uso.
+"""
+import os
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+from werkzeug.security import safe_join
+from config import Config
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+# Bloque de lectura al hashear archivos
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Las rutas relativas de Config se resuelven contra src/, igual que send_from_directory
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@dataclass(frozen=True)
+class ImageFileInfo:
+    """Metadatos de un archivo de imagen en disco"""
+    filename: str
+    path: str
+    size: int
+    etag: str
+
+class ImageService:
+    """Servicio para localizar imágenes y calcular sus metadatos HTTP"""
+
+    def __init__(self, images_folder: str = None):
+        config = Config.from_env()
+        folder = images_folder or config.IMAGES_FOLDER
+        if not os.path.isabs(folder):
+            folder = os.path.join(APP_ROOT, folder)
+        self.images_folder = folder
+        # Índice filename -> SHA-256 del contenido
+        self._content_hashes: Dict[str, str] = {}
+        logger.debug(f"ImageService inicializado con carpeta: {self.images_folder}")
+
+    @staticmethod
+    def filename_for(image_path: str) -> str:
+        """Nombre de archivo servido en /images/<filename> para un image_path de la BD"""
+        return os.path.basename(image_path or '')
+
+    def resolve_path(self, filename: str) -> Optional[str]:
+        """Ruta absoluta segura de una imagen (None si intenta salir de la carpeta)"""
+        return safe_join(self.images_folder, filename)
+
+    @staticmethod
+    def compute_content_hash(path: str) -> str:
+        """SHA-256 (hex) del contenido de un archivo"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_hash_index(self, hashes: Iterable[Tuple[str, str]]) -> int:
+        """Carga pares (image_path, content_hash) precalculados en el índice; retorna cuántos"""
+        count = 0
+        for image_path, content_hash in hashes:
+            self._content_hashes[self.filename_for(image_path)] = content_hash
+            count += 1
+        logger.info(f"Índice de hashes de imágenes cargado: {count} entradas")
+        return count
+
+    def register_hash(self, image_path: str, content_hash: str):
+        """Agrega al índice el hash de una imagen recién importada"""
+        self._content_hashes[self.filename_for(image_path)] = content_hash
+
+    def content_hash(self, filename: str, path: str = None) -> Optional[str]:
+        """Hash del contenido de una imagen: del índice o, si falta, calculado y agregado"""
+        content_hash = self._content_hashes.get(filename)
+        if content_hash is not None:
+            return content_hash
+        path = path or self.resolve_path(filename)
+        if path is None:
+            return None
+        try:
+            content_hash = self.compute_content_hash(path)
+        except OSError:
+            return None
+        self._content_hashes[filename] = content_hash
+        return content_hash
+
+    def get_file_info(self, filename: str) -> Optional[ImageFileInfo]:
+        """Obtiene tamaño y ETag de una imagen (None si no existe)"""
+        path = self.resolve_path(filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # Mismo ETag que envía /images/<filename>, para que el cliente pueda reutilizar su caché
+        etag = self.content_hash(filename, path)
+        if etag is None:
+            return None
+        return ImageFileInfo(filename=filename, path=path, size=stat.st_size, etag=etag)
+
+def hash_file(path: str) -> Optional[str]:
+    """SHA-256 de un archivo o None si no se puede leer (apto para pools de procesos)"""
+    try:
+        return ImageService.compute_content_hash(path)
+    except OSError:
+        return None
+
+# Instancia global del servicio de imágenes
+image_service = ImageService()
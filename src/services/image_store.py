@@ -0,0 +1,222 @@
+"""
+Almacenes de imágenes para /images/<filename>, seleccionados con IMAGE_STORE:
+  - filesystem: un archivo por imagen en IMAGES_FOLDER (stat + open + read por petición)
+  - mmap: un único archivo de almacén (utils/build_image_store.py) mapeado en memoria. El
+    índice filename -> (offset, largo, hash) está ordenado dentro del mismo archivo y se busca
+    por bisección sobre el mapeo, así que vive en el page cache compartido por todos los
+    workers: no hay copia por proceso ni syscalls por petición. Las imágenes que no están en
+    el almacén (importadas después de armarlo) se sirven desde el sistema de archivos.
+  - accel: la app solo valida y pone los headers; el proxy inverso (nginx) envía el archivo
+    con sendfile a partir de X-Accel-Redirect.
+"""
+import os
+import mmap
+import time
+import hashlib
+import struct
+import logging
+import mimetypes
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, Optional, Tuple
+from flask import Response, request, send_file
+from config import Config
+from services.image_service import image_service, APP_ROOT
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+IMAGE_STORES = ('filesystem', 'mmap', 'accel')
+
+# Formato del almacén: cabecera, registros de índice de ancho fijo ordenados por nombre,
+# bloque de nombres y bloque de datos. Offsets absolutos dentro del archivo.
+STORE_MAGIC = b'IMGSTOR1'
+STORE_HEADER = struct.Struct('>8sI')  # magic, cantidad de imágenes
+# offset del nombre, largo del nombre, offset de los datos, largo de los datos, sha256
+STORE_RECORD = struct.Struct('>QHQI32s')
+
+# Cada cuánto se comprueba si el archivo del almacén fue reemplazado (segundos)
+STORE_RELOAD_INTERVAL = 30
+COPY_CHUNK_SIZE = 1024 * 1024
+
+@dataclass(frozen=True)
+class StoredImage:
+    """Imagen localizada en un almacén"""
+    filename: str
+    size: int
+    etag: str
+    mimetype: str
+    path: Optional[str] = None  # archivo en disco (filesystem / accel)
+    offset: Optional[int] = None  # posición en el almacén mapeado (mmap)
+    mapping: Optional[mmap.mmap] = field(default=None, repr=False, compare=False)
+
+def _mimetype(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+class FilesystemImageStore:
+    """Un archivo por imagen en IMAGES_FOLDER"""
+
+    def __init__(self, max_age: int = None):
+        self.max_age = Config.from_env().IMAGE_CACHE_MAX_AGE if max_age is None else max_age
+
+    def lookup(self, filename: str) -> Optional[StoredImage]:
+        info = image_service.get_file_info(filename)
+        if info is None:
+            return None
+        return StoredImage(filename, info.size, info.etag, _mimetype(filename), path=info.path)
+
+    def send(self, image: StoredImage) -> Response:
+        return send_file(image.path, mimetype=image.mimetype, conditional=True,
+                         etag=image.etag, max_age=self.max_age)
+
+class AccelRedirectImageStore(FilesystemImageStore):
+    """Delega el envío del archivo al proxy inverso (X-Accel-Redirect de nginx)"""
+
+    def __init__(self, prefix: str, max_age: int = None):
+        super().__init__(max_age)
+        self.prefix = prefix.rstrip('/')
+
+    def send(self, image: StoredImage) -> Response:
+        response = Response(mimetype=image.mimetype)
+        response.headers['X-Accel-Redirect'] = f"{self.prefix}/{image.filename}"
+        response.set_etag(image.etag)
+        return response
+
+class MmapImageStore:
+    """Almacén de un único archivo mapeado en memoria, con el sistema de archivos como respaldo"""
+
+    def __init__(self, path: str, max_age: int = None):
+        self.path = path
+        self.fallback = FilesystemImageStore(max_age)
+        self._lock = threading.Lock()
+        self._mm: Optional[mmap.mmap] = None
+        self._pid: Optional[int] = None
+        self._identity: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+
+    def _mapping(self) -> Optional[mmap.mmap]:
+        """Mapeo vigente: se abre en el primer uso de cada proceso y se renueva si el archivo cambió"""
+        now = time.monotonic()
+        if self._pid == os.getpid() and now < self._next_check:
+            return self._mm
+        with self._lock:
+            self._next_check = now + STORE_RELOAD_INTERVAL
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if self._pid != os.getpid() or self._mm is not None:
+                    logger.warning(f"Almacén de imágenes no encontrado: {self.path} (se usa el sistema de archivos)")
+                self._mm, self._identity = None, None
+                self._pid = os.getpid()
+                return None
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            if self._pid == os.getpid() and identity == self._identity:
+                return self._mm
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = STORE_HEADER.unpack_from(mm, 0)
+            if magic != STORE_MAGIC:
+                mm.close()
+                raise ValueError(f"{self.path} no es un almacén de imágenes")
+            # El mapeo anterior se deja al recolector: otra petición puede estar leyéndolo
+            self._mm, self._identity, self._pid = mm, identity, os.getpid()
+            logger.info(f"Almacén de imágenes mapeado: {self.path} ({count} imágenes)")
+            return mm
+
+    def _find(self, mm: mmap.mmap, filename: bytes):
+        """Búsqueda binaria del registro de un nombre en el índice ordenado"""
+        low, high = 0, STORE_HEADER.unpack_from(mm, 0)[1]
+        while low < high:
+            middle = (low + high) // 2
+            record = STORE_RECORD.unpack_from(mm, STORE_HEADER.size + middle * STORE_RECORD.size)
+            name = mm[record[0]:record[0] + record[1]]
+            if name == filename:
+                return record
+            if name < filename:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, filename: str) -> Optional[StoredImage]:
+        mm = self._mapping()
+        record = self._find(mm, filename.encode('utf-8')) if mm is not None else None
+        if record is None:
+            return self.fallback.lookup(filename)
+        _, _, data_offset, data_length, digest = record
+        return StoredImage(filename, data_length, digest.hex(), _mimetype(filename),
+                           offset=data_offset, mapping=mm)
+
+    def send(self, image: StoredImage) -> Response:
+        if image.mapping is None:
+            return self.fallback.send(image)
+        # Se lee del mapeo en que se encontró la imagen, aunque entretanto se haya renovado
+        response = Response(image.mapping[image.offset:image.offset + image.size], mimetype=image.mimetype)
+        response.set_etag(image.etag)
+        response = response.make_conditional(request, accept_ranges=True, complete_length=image.size)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+def write_image_store(path: str, files: Iterable[Tuple[str, str]]) -> int:
+    """
+    Escribe un almacén mapeable con los archivos dados, leyéndolos de a uno (sin cargarlos
+    todos en memoria) y calculando su SHA-256 en el mismo recorrido
+
+    Args:
+        path: Archivo destino (se reemplaza de forma atómica)
+        files: Pares (filename, ruta del archivo); se ordenan por nombre
+
+    Returns:
+        int: Cantidad de imágenes escritas
+    """
+    files = sorted(dict(files).items(), key=lambda item: item[0].encode('utf-8'))
+    names = [filename.encode('utf-8') for filename, _ in files]
+    names_offset = STORE_HEADER.size + len(files) * STORE_RECORD.size
+    offset = names_offset + sum(len(name) for name in names)
+    records = []
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            # Los registros llevan el hash y el largo de cada archivo: se escriben al final
+            f.seek(names_offset)
+            for name in names:
+                f.write(name)
+            name_offset = names_offset
+            for name, (_, source_path) in zip(names, files):
+                digest = hashlib.sha256()
+                length = 0
+                with open(source_path, 'rb') as source:
+                    for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        length += len(chunk)
+                records.append(STORE_RECORD.pack(name_offset, len(name), offset, length, digest.digest()))
+                name_offset += len(name)
+                offset += length
+            f.seek(0)
+            f.write(STORE_HEADER.pack(STORE_MAGIC, len(records)))
+            f.write(b''.join(records))
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(records)
+
+def create_image_store(config: Config = None):
+    """Crea el almacén configurado en IMAGE_STORE"""
+    config = config or Config.from_env()
+    backend = config.IMAGE_STORE
+    if backend not in IMAGE_STORES:
+        raise ValueError(f"IMAGE_STORE inválido: {backend} (use {', '.join(IMAGE_STORES)})")
+    if backend == 'mmap':
+        path = config.IMAGE_STORE_PATH
+        if not os.path.isabs(path):
+            path = os.path.join(APP_ROOT, path)
+        return MmapImageStore(path, config.IMAGE_CACHE_MAX_AGE)
+    if backend == 'accel':
+        return AccelRedirectImageStore(config.IMAGE_ACCEL_PREFIX, config.IMAGE_CACHE_MAX_AGE)
+    return FilesystemImageStore(config.IMAGE_CACHE_MAX_AGE)
+
+# Instancia global del almacén de imágenes
+image_store = create_image_store()
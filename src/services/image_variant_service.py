@@ -0,0 +1,109 @@
+"""
+Variantes de imágenes (miniaturas y transcodificación a WebP/JPEG/PNG) generadas bajo demanda
+para /images/<filename>?w=<ancho>&fmt=<formato>.
+
+Las variantes se nombran por el hash de contenido del original, así que son inmutables; se
+guardan en una caché en disco acotada (ver services/disk_cache.py). Requiere Pillow: sin él
+se sirve siempre el original.
+"""
+import io
+import os
+import logging
+import mimetypes
+from dataclasses import dataclass
+from typing import Optional
+from config import Config
+from services.disk_cache import DiskCache
+from services.image_service import ImageFileInfo, APP_ROOT
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # Pillow es opcional: sin él no hay variantes
+    PILImage = None
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+# Anchos permitidos: el pedido se redondea hacia arriba para acotar la cantidad de variantes
+VARIANT_WIDTHS = (64, 128, 256, 512, 1024)
+# fmt -> (formato de Pillow, mimetype)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+@dataclass(frozen=True)
+class ImageVariant:
+    """Variante generada en disco"""
+    path: str
+    etag: str
+    mimetype: str
+
+class ImageVariantService:
+    """Genera y cachea miniaturas y conversiones de formato"""
+
+    def __init__(self, variant_folder: str = None):
+        config = Config.from_env()
+        folder = variant_folder or config.IMAGE_VARIANT_FOLDER
+        if not os.path.isabs(folder):
+            folder = os.path.join(APP_ROOT, folder)
+        self.quality = config.IMAGE_VARIANT_QUALITY
+        self.cache = DiskCache(folder, config.IMAGE_VARIANT_CACHE_MAX_BYTES, name='Caché de variantes')
+        if PILImage is None:
+            logger.info("Pillow no instalado: /images sirve solo los originales (pip install Pillow)")
+
+    @staticmethod
+    def normalize_width(width: int) -> int:
+        """Menor ancho permitido que cubre el pedido"""
+        for allowed in VARIANT_WIDTHS:
+            if width <= allowed:
+                return allowed
+        return VARIANT_WIDTHS[-1]
+
+    def get_variant(self, info: ImageFileInfo, width: Optional[int], fmt: Optional[str]) -> Optional[ImageVariant]:
+        """
+        Obtiene (o genera) la variante de una imagen
+
+        Args:
+            info: Metadatos del original (su ETag es el hash de contenido)
+            width: Ancho máximo (ya normalizado) o None para conservar el tamaño
+            fmt: Clave de VARIANT_FORMATS o None para conservar el formato
+
+        Returns:
+            ImageVariant, o None si no hay Pillow o el original ya cumple lo pedido
+        """
+        if PILImage is None:
+            return None
+        etag = f"{info.etag}-w{width or 0}-{fmt or 'orig'}"
+        cached = self.cache.get(etag)
+        if cached is not None:
+            return ImageVariant(cached, etag, self._mimetype(info, fmt))
+
+        # open() solo lee la cabecera: tamaño y formato se conocen sin decodificar
+        with PILImage.open(info.path) as image:
+            source_format = image.format
+            if (width is None or image.width <= width) and (fmt is None or VARIANT_FORMATS[fmt][0] == source_format):
+                # Nunca se agranda: el original es la mejor respuesta
+                return None
+            pil_format = VARIANT_FORMATS[fmt][0] if fmt else source_format
+            if width is not None and image.width > width:
+                image.thumbnail((width, image.height), PILImage.LANCZOS)
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, format=pil_format, quality=self.quality)
+
+        path = self.cache.put_bytes(etag, buffer.getvalue())
+        logger.debug(f"Variante generada para {info.filename}: ancho {width}, formato {pil_format}")
+        return ImageVariant(path, etag, self._mimetype(info, fmt))
+
+    @staticmethod
+    def _mimetype(info: ImageFileInfo, fmt: Optional[str]) -> str:
+        if fmt:
+            return VARIANT_FORMATS[fmt][1]
+        # Mismo formato que el original
+        return mimetypes.guess_type(info.filename)[0] or 'application/octet-stream'
+
+# Instancia global del servicio de variantes de imágenes
+image_variant_service = ImageVariantService()
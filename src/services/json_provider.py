@@ -0,0 +1,116 @@
+"""
+Serialización JSON rápida para las respuestas de la API.
+
+Usa orjson si está instalado y, si no, la librería estándar con las mismas reglas:
+Decimal como texto, UUID y dataclasses como en Flask. Las respuestas de la API emiten
+datetimes y dates en formato HTTP date, como el proveedor por defecto de Flask; dumps_bytes
+(exportaciones, índices de paquetes) los emite en ISO 8601.
+"""
+import dataclasses
+import decimal
+import json
+import logging
+import uuid
+from datetime import date, datetime
+from typing import Any
+
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la librería estándar
+    orjson = None
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+def _default(o: Any) -> Any:
+    """Tipos que ninguno de los dos backends serializa por sí mismo"""
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    if isinstance(o, (tuple, set, frozenset)):
+        # namedtuples (orjson no los acepta) y conjuntos se emiten como arrays, igual que en json
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+def _http_date_default(o: Any) -> Any:
+    """Como el DefaultJSONProvider de Flask: dates y datetimes en formato HTTP date"""
+    if isinstance(o, date):
+        return http_date(o)
+    return _default(o)
+
+def _stdlib_default(o: Any) -> Any:
+    """Equivalente en la librería estándar de lo que orjson hace de forma nativa"""
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    return _default(o)
+
+def _stdlib_http_date_default(o: Any) -> Any:
+    if isinstance(o, date):
+        return http_date(o)
+    return _stdlib_default(o)
+
+def dumps_bytes(obj: Any, sort_keys: bool = False, http_dates: bool = False) -> bytes:
+    """Serializa a JSON compacto en UTF-8; con http_dates, los datetimes van en formato HTTP date"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        default = _default
+        if http_dates:
+            # Sin esta opción orjson escribe los datetimes en ISO 8601 sin pasar por default
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+            default = _http_date_default
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # p. ej. enteros de más de 64 bits: la librería estándar sí los admite
+            pass
+    return json.dumps(obj, default=_stdlib_http_date_default if http_dates else _stdlib_default,
+                      ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
+
+def dumps(obj: Any, sort_keys: bool = False, http_dates: bool = False) -> str:
+    return dumps_bytes(obj, sort_keys=sort_keys, http_dates=http_dates).decode('utf-8')
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONProvider(JSONProvider):
+    """Proveedor JSON de Flask respaldado por orjson (o json si no está disponible).
+
+    Reemplaza al DefaultJSONProvider: jsonify y request.get_json lo usan automáticamente.
+    Los datetimes se emiten en formato HTTP date, igual que con el proveedor por defecto,
+    para no cambiar las respuestas que ya consumen los clientes; la salida siempre es compacta.
+    """
+
+    # Igual que Flask: claves ordenadas para respuestas estables (app.json.sort_keys = False lo desactiva)
+    sort_keys = True
+    mimetype = 'application/json'
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), http_dates=True)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            dumps_bytes(obj, sort_keys=self.sort_keys, http_dates=True) + b'\n', mimetype=self.mimetype
+        )
+
+def init_json_provider(app):
+    """Instala FastJSONProvider en la aplicación"""
+    app.json = FastJSONProvider(app)
+    logger.info(f"Proveedor JSON: {JSON_BACKEND}")
@@ -2,7 +2,11 @@
 Servicio de autenticación JWT para mayor seguridad
 """
 import jwt
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, current_app, render_template
@@ -24,11 +28,20 @@ class JWTService:
         self.access_token_expire_minutes = 480  # 8 horas
         self.refresh_token_expire_days = 30
         
+        # Caché LRU de tokens de acceso ya verificados: digest del token -> payload
+        # Evita repetir HMAC + parseo de claims en cada request con el mismo token
+        self.verify_cache_size = config.JWT_VERIFY_CACHE_SIZE
+        self._verified_tokens: OrderedDict = OrderedDict()
+        self._verified_lock = threading.Lock()
+        self.verify_cache_hits = 0
+        self.verify_cache_misses = 0
+        
         # Log de configuración
         logger.info("JWT Service inicializado")
         logger.debug(f"Access token expira en: {self.access_token_expire_minutes} minutos")
         logger.debug(f"Refresh token expira en: {self.refresh_token_expire_days} días")
         logger.debug(f"Longitud de clave secreta: {len(self.secret_key)} caracteres")
+        logger.debug(f"Caché de verificación de tokens: {self.verify_cache_size} entradas")
     
     def _generate_secret_key(self):
         """Genera una clave secreta segura"""
@@ -116,7 +129,33 @@ class JWTService:
         return None
     
     def verify_access_token(self, token: str) -> dict:
-        """Verifica un token de acceso y retorna el payload"""
+        """Verifica un token de acceso y retorna el payload (no modificar: puede venir del caché)"""
+        if self.verify_cache_size <= 0:
+            return self._verify_access_token(token)
+        
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        with self._verified_lock:
+            payload = self._verified_tokens.get(digest)
+            if payload is not None:
+                # Mismo criterio que PyJWT: el token vale mientras exp > ahora
+                if payload['exp'] > time.time():
+                    self._verified_tokens.move_to_end(digest)
+                    self.verify_cache_hits += 1
+                    return payload
+                del self._verified_tokens[digest]
+            self.verify_cache_misses += 1
+        
+        # Los tokens inválidos o expirados lanzan ValueError y nunca entran al caché
+        payload = self._verify_access_token(token)
+        if 'exp' not in payload:
+            return payload
+        with self._verified_lock:
+            self._verified_tokens[digest] = payload
+            if len(self._verified_tokens) > self.verify_cache_size:
+                self._verified_tokens.popitem(last=False)
+        return payload
+    
+    def _verify_access_token(self, token: str) -> dict:
         payload = self.decode_token(token)
         if payload.get('type') != 'access':
             logger.warning(f"Tipo de token inválido: {payload.get('type')}")
@@ -124,6 +163,11 @@ class JWTService:
         logger.debug("Token de acceso verificado exitosamente")
         return payload
     
+    def clear_verify_cache(self):
+        """Vacía el caché de tokens verificados"""
+        with self._verified_lock:
+            self._verified_tokens.clear()
+    
     def verify_refresh_token(self, token: str) -> dict:
         """Verifica un token de refresh y retorna el payload"""
         payload = self.decode_token(token)
@@ -145,7 +189,7 @@ def jwt_required(f):
             payload = jwt_service.verify_access_token(token)
             
             # Log de autenticación exitosa
-            logger.info(f"Autenticación JWT exitosa para {payload.get('username')} (rol: {payload.get('role')})")
+            logger.debug(f"Autenticación JWT exitosa para {payload.get('username')} (rol: {payload.get('role')})")
             
             # Agregar información del usuario al contexto de la request
             request.current_user = {
@@ -177,7 +221,7 @@ def admin_required(f):
                 logger.warning(f"Acceso de admin denegado para {payload.get('username')} (rol: {payload.get('role')})")
                 return jsonify({'error': 'Admin access required'}), 403
             
-            logger.info(f"Acceso de admin concedido para {payload.get('username')}")
+            logger.debug(f"Acceso de admin concedido para {payload.get('username')}")
             
             # Agregar información del usuario al contexto de la request
             request.current_user = {
@@ -269,7 +313,7 @@ def require_auth(f):
                 'role': payload['role']
             }
             
-            logger.info(f"Acceso autorizado para {payload.get('username')}")
+            logger.debug(f"Acceso autorizado para {payload.get('username')}")
             return f(*args, **kwargs)
             
         except Exception as e:
@@ -303,7 +347,7 @@ def require_admin(f):
                 'role': payload['role']
             }
             
-            logger.info(f"Acceso de admin autorizado para {payload.get('username')}")
+            logger.debug(f"Acceso de admin autorizado para {payload.get('username')}")
             return f(*args, **kwargs)
             
         except Exception as e:
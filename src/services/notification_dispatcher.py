@@ -0,0 +1,187 @@
+# services/notification_dispatcher.py
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from config import Config
+from utils.telegram import send_telegram_message, ADMIN_CHAT_ID
+
+logger = logging.getLogger(__name__)
+
+# Límite de Telegram para el texto de un mensaje
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+MESSAGE_SEPARATOR = "\n\n➖➖➖\n\n"
+
+@dataclass
+class QueuedMessage:
+    """Mensaje pendiente de envío"""
+    chat_id: str
+    text: str
+    # Se invoca (en el hilo del dispatcher) si el mensaje se descarta tras agotar los reintentos
+    on_failure: Optional[Callable[[], None]] = None
+
+class NotificationDispatcher:
+    """
+    Envía notificaciones de Telegram desde un hilo en segundo plano
+
+    Las peticiones solo encolan (cola acotada, nunca bloquean). El hilo agrupa los mensajes
+    que llegan dentro de una ventana corta en un único envío por chat y reintenta con
+    backoff exponencial los envíos fallidos.
+    """
+
+    def __init__(self, sender: Callable[[str, str], bool] = None, config: Config = None):
+        config = config or Config.from_env()
+        self.sender = sender or (lambda text, chat_id: send_telegram_message(text, chat_id))
+        self.queue_size = config.NOTIFICATION_QUEUE_SIZE
+        self.batch_window = config.NOTIFICATION_BATCH_WINDOW_SECONDS
+        self.max_retries = config.NOTIFICATION_MAX_RETRIES
+        self.retry_backoff = config.NOTIFICATION_RETRY_BACKOFF_SECONDS
+
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stopping = threading.Event()
+        self._atexit_registered = False
+
+    def enqueue(self, text: str, chat_id: Optional[str] = None,
+                on_failure: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Encola un mensaje sin esperar su envío
+
+        Args:
+            text: Texto del mensaje (HTML de Telegram)
+            chat_id: ID del chat (por defecto el del admin)
+            on_failure: Callback si el mensaje se descarta tras agotar los reintentos
+
+        Returns:
+            bool: True si se encoló; False si la cola está llena
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(QueuedMessage(chat_id or ADMIN_CHAT_ID, text, on_failure))
+            return True
+        except queue.Full:
+            logger.warning(f"Cola de notificaciones llena ({self.queue_size}): mensaje descartado")
+            return False
+
+    def pending(self) -> int:
+        """Mensajes en cola aún no tomados por el hilo"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def flush(self, timeout: float = None) -> bool:
+        """Espera a que se procesen todos los mensajes encolados; True si terminó a tiempo"""
+        if self._queue is None:
+            return True
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el hilo intentando enviar antes lo que quede en cola"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self.flush(timeout)
+        self._stopping.set()
+        self._thread.join(timeout=1.0)
+
+    def _ensure_worker(self):
+        """Arranca el hilo en el primer uso y tras un fork (los hilos no se heredan)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Proceso nuevo (worker de gunicorn): la cola heredada pertenece al padre
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+            logger.debug(f"Dispatcher de notificaciones iniciado (pid {self._pid})")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            # Ventana de agrupación: juntar lo que llegue mientras tanto en un solo envío
+            deadline = time.monotonic() + self.batch_window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(batch)
+            except Exception as e:
+                logger.error(f"Error inesperado despachando notificaciones: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch: List[QueuedMessage]):
+        """Envía los mensajes agrupados por chat"""
+        by_chat: Dict[str, List[QueuedMessage]] = {}
+        for message in batch:
+            by_chat.setdefault(message.chat_id, []).append(message)
+        for chat_id, messages in by_chat.items():
+            for chunk in self._coalesce(messages):
+                self._send_with_retry(chat_id, chunk)
+
+    @staticmethod
+    def _coalesce(messages: List[QueuedMessage]) -> List[List[QueuedMessage]]:
+        """Agrupa mensajes consecutivos sin superar el largo máximo de Telegram"""
+        chunks, current, length = [], [], 0
+        for message in messages:
+            extra = len(message.text) + (len(MESSAGE_SEPARATOR) if current else 0)
+            if current and length + extra > TELEGRAM_MAX_MESSAGE_LENGTH:
+                chunks.append(current)
+                current, length = [], 0
+                extra = len(message.text)
+            current.append(message)
+            length += extra
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _send_with_retry(self, chat_id: str, messages: List[QueuedMessage]):
+        text = MESSAGE_SEPARATOR.join(message.text for message in messages)
+        for attempt in range(self.max_retries + 1):
+            if self.sender(text, chat_id):
+                if len(messages) > 1:
+                    logger.info(f"{len(messages)} notificaciones agrupadas en un mensaje a chat {chat_id}")
+                return
+            if attempt < self.max_retries:
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"Envío a chat {chat_id} fallido (intento {attempt + 1}/{self.max_retries + 1}), "
+                               f"reintentando en {delay:.1f}s")
+                # Esperar sin impedir que stop() termine el hilo
+                if self._stopping.wait(delay):
+                    break
+        logger.error(f"Descartadas {len(messages)} notificaciones para chat {chat_id} tras {self.max_retries + 1} intentos")
+        for message in messages:
+            if message.on_failure:
+                try:
+                    message.on_failure()
+                except Exception as e:
+                    logger.error(f"Error en callback de notificación fallida: {e}")
+
+# Instancia global del dispatcher de notificaciones
+notification_dispatcher = NotificationDispatcher()
@@ -1,31 +1,47 @@
 # services/notification_service.py
 import time
 import logging
-from typing import Dict, Set
-from datetime import datetime, timedelta
-from utils.telegram import send_admin_notification
+from typing import Dict, Optional
+from datetime import datetime
+from utils.telegram import is_configured
+from services.notification_dispatcher import notification_dispatcher
+from services.state_store import state_store
 
 logger = logging.getLogger(__name__)
 
 class NotificationService:
     """
     Servicio para manejar notificaciones con protección anti-spam
+    
+    El estado anti-spam vive en el almacén de estado compartido (ver services/state_store.py),
+    así que todos los workers ven las mismas marcas y estas expiran solas.
     """
     
-    def __init__(self):
-        # Diccionario para trackear últimas notificaciones por usuario
-        # user_id -> timestamp de última notificación
-        self._last_notifications: Dict[int, float] = {}
-        
-        # Set de usuarios que ya fueron notificados y aún no tienen tareas nuevas
-        self._notified_users: Set[int] = set()
+    def __init__(self, dispatcher=None, store=None):
+        # Los mensajes se envían desde un hilo en segundo plano; las peticiones solo encolan
+        self.dispatcher = dispatcher or notification_dispatcher
+        self.store = store or state_store
         
         # Tiempo mínimo entre notificaciones para el mismo usuario (en segundos)
         self.min_notification_interval = 3600  # 1 hora
         
-        # Tiempo máximo para considerar una notificación como "reciente"
+        # Tiempo máximo para considerar una notificación como "reciente" (TTL de las marcas)
         self.notification_timeout = 24 * 3600  # 24 horas
     
+    @staticmethod
+    def _notified_key(user_id: int) -> str:
+        """Marca de usuario ya notificado que aún no tiene tareas nuevas"""
+        return f"notify:notified:{user_id}"
+    
+    @staticmethod
+    def _last_key(user_id: int) -> str:
+        """Timestamp de la última notificación del usuario"""
+        return f"notify:last:{user_id}"
+    
+    def _last_notification(self, user_id: int) -> Optional[float]:
+        value = self.store.get(self._last_key(user_id))
+        return float(value) if value is not None else None
+    
     def should_notify_no_tasks(self, user_id: int, username: str) -> bool:
         """
         Determina si se debe enviar una notificación de "sin tareas" para un usuario
@@ -37,16 +53,18 @@ class NotificationService:
         Returns:
             bool: True si se debe enviar la notificación
         """
-        current_time = time.time()
+        # Sin Telegram no hay nada que enviar: no reservar marcas ni registrar errores
+        if not is_configured():
+            return False
         
         # Verificar si el usuario ya fue notificado recientemente
-        if user_id in self._notified_users:
+        if self.store.get(self._notified_key(user_id)) is not None:
             logger.debug(f"Usuario {username} (ID: {user_id}) ya fue notificado anteriormente")
             return False
         
         # Verificar el intervalo mínimo desde la última notificación
-        last_notification = self._last_notifications.get(user_id, 0)
-        time_since_last = current_time - last_notification
+        last_notification = self._last_notification(user_id) or 0
+        time_since_last = time.time() - last_notification
         
         if time_since_last < self.min_notification_interval:
             minutes_remaining = int((self.min_notification_interval - time_since_last) / 60)
@@ -54,25 +72,35 @@ class NotificationService:
                         f"Faltan {minutes_remaining} minutos")
             return False
         
-        # Limpiar notificaciones antiguas
-        self._cleanup_old_notifications()
-        
         return True
     
     def send_no_tasks_notification(self, user_id: int, username: str) -> bool:
         """
-        Envía una notificación al admin cuando un usuario no tiene más tareas
+        Encola una notificación al admin cuando un usuario no tiene más tareas
+        
+        El usuario queda marcado como notificado al encolar, para que peticiones concurrentes
+        (de cualquier worker) no repitan el aviso; si el envío se descarta tras los reintentos
+        se libera la marca.
         
         Args:
             user_id: ID del usuario
             username: Nombre del usuario
         
         Returns:
-            bool: True si la notificación se envió correctamente
+            bool: True si la notificación se encoló
         """
         if not self.should_notify_no_tasks(user_id, username):
             return False
         
+        notified_key, last_key = self._notified_key(user_id), self._last_key(user_id)
+        now = time.time()
+        # Reservar la notificación de forma atómica: solo una petición gana la marca
+        if not self.store.add(notified_key, str(now), ttl=self.notification_timeout):
+            logger.debug(f"Notificación para {username} (ID: {user_id}) ya reservada por otra petición")
+            return False
+        previous_notification = self._last_notification(user_id)
+        self.store.set(last_key, str(now), ttl=self.notification_timeout)
+        
         # Preparar el mensaje
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         message = (
@@ -83,20 +111,39 @@ class NotificationService:
             f"💡 <i>¡Asígnale más tareas para que pueda continuar!</i>"
         )
         
-        # Intentar enviar la notificación
-        success = send_admin_notification(message)
-        
-        if success:
-            # Marcar como notificado
-            current_timestamp = time.time()
-            self._last_notifications[user_id] = current_timestamp
-            self._notified_users.add(user_id)
-            
-            logger.info(f"Notificación de 'sin tareas' enviada exitosamente para usuario {username} (ID: {user_id})")
+        def release():
+            """El envío falló: permitir que el próximo /task/next vuelva a avisar"""
+            try:
+                self.store.delete(notified_key)
+                if previous_notification is None:
+                    self.store.delete(last_key)
+                else:
+                    remaining = previous_notification + self.notification_timeout - time.time()
+                    self.store.set(last_key, str(previous_notification), ttl=max(remaining, 1))
+            except Exception as e:
+                logger.error(f"Error liberando marca de notificación para usuario {user_id}: {e}")
+        
+        if self.dispatcher.enqueue(message, on_failure=release):
+            logger.info(f"Notificación de 'sin tareas' encolada para usuario {username} (ID: {user_id})")
             return True
-        else:
-            logger.error(f"Error enviando notificación de 'sin tareas' para usuario {username} (ID: {user_id})")
+        
+        release()
+        logger.error(f"Error encolando notificación de 'sin tareas' para usuario {username} (ID: {user_id})")
+        return False
+    
+    def send_admin_notification(self, message: str) -> bool:
+        """
+        Encola un mensaje libre para el admin (sin anti-spam)
+        
+        Args:
+            message: Mensaje (HTML de Telegram)
+        
+        Returns:
+            bool: True si Telegram está configurado y el mensaje se encoló
+        """
+        if not is_configured():
             return False
+        return self.dispatcher.enqueue(message)
     
     def mark_user_has_tasks(self, user_id: int, username: str = None):
         """
@@ -107,30 +154,17 @@ class NotificationService:
             user_id: ID del usuario
             username: Nombre del usuario (opcional, para logging)
         """
-        if user_id in self._notified_users:
-            self._notified_users.remove(user_id)
-            user_info = f"{username} (ID: {user_id})" if username else f"ID: {user_id}"
-            logger.debug(f"Usuario {user_info} ahora tiene tareas disponibles - estado de notificación reseteado")
-    
-    def _cleanup_old_notifications(self):
-        """
-        Limpia notificaciones antiguas del cache
-        """
-        current_time = time.time()
-        cutoff_time = current_time - self.notification_timeout
-        
-        # Limpiar notificaciones antiguas
-        old_notifications = [
-            user_id for user_id, timestamp in self._last_notifications.items()
-            if timestamp < cutoff_time
-        ]
-        
-        for user_id in old_notifications:
-            del self._last_notifications[user_id]
-            self._notified_users.discard(user_id)
-        
-        if old_notifications:
-            logger.debug(f"Limpiadas {len(old_notifications)} notificaciones antiguas")
+        notified_key = self._notified_key(user_id)
+        try:
+            # Lectura primero: en el caso común no hay marca y se evita una escritura por petición
+            if self.store.get(notified_key) is None:
+                return
+            self.store.delete(notified_key)
+        except Exception as e:
+            logger.error(f"Error reseteando estado de notificación para usuario {user_id}: {e}")
+            return
+        user_info = f"{username} (ID: {user_id})" if username else f"ID: {user_id}"
+        logger.debug(f"Usuario {user_info} ahora tiene tareas disponibles - estado de notificación reseteado")
     
     def get_notification_status(self, user_id: int) -> Dict:
         """
@@ -142,14 +176,13 @@ class NotificationService:
         Returns:
             dict: Estado de notificaciones del usuario
         """
-        current_time = time.time()
-        last_notification = self._last_notifications.get(user_id, 0)
-        time_since_last = current_time - last_notification if last_notification > 0 else None
+        last_notification = self._last_notification(user_id)
+        time_since_last = time.time() - last_notification if last_notification else None
         
         return {
             'user_id': user_id,
-            'was_notified': user_id in self._notified_users,
-            'last_notification_timestamp': last_notification if last_notification > 0 else None,
+            'was_notified': self.store.get(self._notified_key(user_id)) is not None,
+            'last_notification_timestamp': last_notification,
             'time_since_last_notification_seconds': time_since_last,
             'can_notify': self.should_notify_no_tasks(user_id, f"user_{user_id}")
         }
@@ -0,0 +1,58 @@
+"""
+Cursores opacos para paginación keyset (continuar desde la última clave vista en lugar de OFFSET)
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+
+# Tamaño de página de los listados de administración
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+
+def _to_utc(value: datetime) -> datetime:
+    """Normaliza a UTC; las fechas sin zona se asumen UTC (así se guardan en la BD)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def encode_cursor(*values) -> str:
+    """Codifica los valores de la clave de orden de la última fila como un token opaco"""
+    payload = [_to_utc(value).isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decodifica un cursor de encode_cursor; ValueError si está malformado o no tiene `size` valores"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Cursor inválido: {e}") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Cursor inválido")
+    return values
+
+def cursor_datetime(value) -> datetime:
+    """Convierte un valor de cursor (ISO 8601) en datetime UTC; ValueError si no es válido"""
+    if not isinstance(value, str):
+        raise ValueError("Cursor inválido")
+    return _to_utc(datetime.fromisoformat(value))
+
+def cursor_int(value) -> int:
+    """Valida un valor entero de cursor"""
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("Cursor inválido")
+    return value
+
+def cursor_str(value) -> str:
+    """Valida un valor de texto de cursor"""
+    if not isinstance(value, str):
+        raise ValueError("Cursor inválido")
+    return value
+
+def clamp_page_size(value, default: int, maximum: int) -> int:
+    """Tamaño de página pedido acotado a [1, maximum]; ValueError si no es entero"""
+    if value in (None, ''):
+        return default
+    return min(max(int(value), 1), maximum)
@@ -3,11 +3,13 @@ Utilidades de seguridad adicionales para la aplicación
 """
 import hashlib
 import hmac
+import math
 import time
 import logging
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, make_response
 import re
+from services.state_store import state_store
 
 # Configurar logger para este módulo
 logger = logging.getLogger(__name__)
@@ -114,35 +116,111 @@ class SecurityUtils:
             logger.warning(f"Error verificando token CSRF: {e}")
             return False
 
-def rate_limit(max_requests: int = 60, window_seconds: int = 60):
-    """Decorador para limitar tasa de requests por IP"""
-    request_counts = {}
+RATE_LIMIT_KEYS = ('ip', 'user')
+
+def client_ip() -> str:
+    """IP del cliente; detrás de un proxy se toma la última entrada de X-Forwarded-For
+    (la que agregó el proxy, no la que pudo enviar el cliente)"""
+    forwarded = request.environ.get('HTTP_X_FORWARDED_FOR')
+    if forwarded:
+        return forwarded.split(',')[-1].strip()
+    return request.remote_addr or 'unknown'
+
+def _rate_limit_identity(key: str) -> str:
+    """Identidad a la que se cuenta el request: usuario autenticado (si key='user') o IP"""
+    if key == 'user':
+        current_user = getattr(request, 'current_user', None)
+        if current_user and current_user.get('user_id') is not None:
+            return f"user:{current_user['user_id']}"
+    return f"ip:{client_ip()}"
+
+def sliding_window_hit(counter_key: str, max_requests: int, window_seconds: int, now: float = None):
+    """
+    Registra un request con un contador de ventana deslizante.
+    
+    Se guardan solo dos contadores por clave (ventana actual y anterior) y el uso se estima
+    como anterior * fracción restante + actual: memoria y costo constantes sin importar el
+    tamaño de la ventana. Los contadores expiran solos a las dos ventanas.
+    
+    Returns:
+        tuple: (permitido, restantes, segundos hasta que se libere cupo)
+    """
+    now = time.time() if now is None else now
+    window = int(now // window_seconds)
+    elapsed = now - window * window_seconds
+    current_key = f"{counter_key}:{window}"
+    
+    current = state_store.incr(current_key, ttl=2 * window_seconds)
+    previous = int(state_store.get(f"{counter_key}:{window - 1}") or 0)
+    weight = 1 - elapsed / window_seconds
+    used = previous * weight + current
+    
+    if used > max_requests:
+        # Los requests rechazados no consumen cupo
+        state_store.incr(current_key, -1, ttl=2 * window_seconds)
+        # Tiempo hasta que quepa un request más: primero se libera la ventana anterior
+        # (decae linealmente) y, si no alcanza, hay que esperar a la siguiente ventana
+        count = current - 1
+        excess = used - max_requests
+        if previous and excess <= previous * weight:
+            reset = excess * window_seconds / previous
+        else:
+            reset = window_seconds - elapsed
+            if count and count + 1 > max_requests:
+                reset += (count + 1 - max_requests) * window_seconds / count
+        return False, 0, max(int(math.ceil(reset)), 1)
+    
+    return True, max(int(max_requests - used), 0), max(int(math.ceil(window_seconds - elapsed)), 1)
+
+def rate_limit(max_requests: int = 60, window_seconds: int = 60, key: str = 'ip', scope: str = None):
+    """Decorador para limitar tasa de requests (ventana deslizante).
+    
+    Los contadores viven en el almacén de estado compartido, así que el límite es global
+    para todos los workers. Cada ruta tiene su propio límite (o el de `scope`, para
+    compartirlo entre rutas) y se cuenta por IP o, con key='user', por usuario autenticado
+    (el decorador debe ir debajo de @jwt_required; sin usuario se cuenta por IP).
+    
+    Las respuestas incluyen los headers RateLimit-Limit, RateLimit-Remaining y
+    RateLimit-Reset, y Retry-After cuando se responde 429.
+    """
+    if key not in RATE_LIMIT_KEYS:
+        raise ValueError(f"key de rate limit inválida: {key} (use {', '.join(RATE_LIMIT_KEYS)})")
     
     def decorator(f):
+        route_scope = f"ratelimit:{scope or f.__name__}"
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            current_time = time.time()
+            identity = _rate_limit_identity(key)
             
-            # Limpiar entradas antiguas
-            request_counts[client_ip] = [
-                req_time for req_time in request_counts.get(client_ip, [])
-                if current_time - req_time < window_seconds
-            ]
+            try:
+                allowed, remaining, reset = sliding_window_hit(
+                    f"{route_scope}:{identity}", max_requests, window_seconds
+                )
+            except Exception as e:
+                # Sin almacén de estado no se bloquea el servicio: se deja pasar el request
+                logger.error(f"Error consultando rate limit para {identity}: {e}")
+                return f(*args, **kwargs)
             
-            # Verificar límite
-            current_count = len(request_counts.get(client_ip, []))
-            if current_count >= max_requests:
-                logger.warning(f"Rate limit excedido para IP {client_ip}: {current_count}/{max_requests} requests")
-                return jsonify({'error': 'Rate limit exceeded'}), 429
+            headers = {
+                'RateLimit-Limit': str(max_requests),
+                'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(reset)
+            }
             
-            # Agregar request actual
-            if client_ip not in request_counts:
-                request_counts[client_ip] = []
-            request_counts[client_ip].append(current_time)
+            # Verificar límite
+            if not allowed:
+                logger.warning(f"Rate limit excedido para {identity} en {route_scope}: máximo {max_requests} requests en {window_seconds}s")
+                response = jsonify({'error': 'Rate limit exceeded'})
+                response.status_code = 429
+                response.headers.extend(headers)
+                response.headers['Retry-After'] = str(reset)
+                return response
             
-            logger.debug(f"Request aceptado para IP {client_ip}: {current_count + 1}/{max_requests}")
-            return f(*args, **kwargs)
+            logger.debug(f"Request aceptado para {identity} en {route_scope}: quedan {remaining}/{max_requests}")
+            response = make_response(f(*args, **kwargs))
+            response.headers.extend(headers)
+            return response
         
         return decorated_function
     return decorator
@@ -0,0 +1,234 @@
+"""
+Almacén de estado efímero compartido entre workers (rate limits, anti-spam de notificaciones).
+
+Backends intercambiables con la misma interfaz y expiración por clave (TTL):
+  - database: tabla state_entries en la base de datos de la app (por defecto)
+  - redis: servidor Redis o compatible (requiere el paquete redis)
+  - memory: diccionario del proceso, acotado; no se comparte entre workers
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import select, delete, case, cast, Integer, Text
+from sqlalchemy.dialects import postgresql, sqlite
+from config import Config
+from models.database import StateEntry, get_engine
+
+try:
+    import redis
+except ImportError:  # redis es opcional: solo lo necesita STATE_BACKEND=redis
+    redis = None
+
+# Configurar logger para este módulo
+logger = logging.getLogger(__name__)
+
+STATE_BACKENDS = ('database', 'redis', 'memory')
+
+class StateStore:
+    """Interfaz común: valores de texto con TTL en segundos"""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        """Guarda el valor solo si la clave no existe (o venció); True si se guardó"""
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        """Incrementa un contador y retorna el nuevo valor; el TTL corre desde su creación"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+class MemoryStateStore(StateStore):
+    """Backend en memoria del proceso, con expiración y tope de claves (LRU)"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._data: OrderedDict = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _live(self, key: str, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: str, expires_at: float):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._store(key, str(value), time.time() + ttl)
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        with self._lock:
+            now = time.time()
+            if self._live(key, now) is not None:
+                return False
+            self._store(key, str(value), now + ttl)
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        with self._lock:
+            now = time.time()
+            entry = self._live(key, now)
+            if entry is None:
+                value, expires_at = amount, now + ttl
+            else:
+                value, expires_at = int(entry[0]) + amount, entry[1]
+            self._store(key, str(value), expires_at)
+            return value
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+class DatabaseStateStore(StateStore):
+    """Backend sobre la tabla state_entries: cada operación es una sentencia atómica (upsert)"""
+
+    # Cada cuánto se purgan las filas vencidas (segundos)
+    PURGE_INTERVAL = 60
+
+    def __init__(self, database_url: str):
+        self.engine = get_engine(database_url)
+        self.dialect = self.engine.dialect.name
+        if self.dialect not in ('postgresql', 'sqlite'):
+            raise ValueError(f"STATE_BACKEND=database requiere PostgreSQL o SQLite (motor: {self.dialect})")
+        self._next_purge = 0.0
+
+    def _insert(self):
+        return (postgresql.insert if self.dialect == 'postgresql' else sqlite.insert)(StateEntry)
+
+    def _purge_expired(self, conn, now: float):
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.PURGE_INTERVAL
+        result = conn.execute(delete(StateEntry).where(StateEntry.expires_at <= now))
+        if result.rowcount:
+            logger.debug(f"Estado compartido: {result.rowcount} entradas vencidas eliminadas")
+
+    def get(self, key: str) -> Optional[str]:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(StateEntry.value).where(StateEntry.key == key, StateEntry.expires_at > time.time())
+            ).scalar()
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        stmt = self._insert().values(key=key, value=str(value), expires_at=now + ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StateEntry.key],
+            set_={'value': stmt.excluded.value, 'expires_at': stmt.excluded.expires_at}
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+            self._purge_expired(conn, now)
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        now = time.time()
+        stmt = self._insert().values(key=key, value=str(value), expires_at=now + ttl)
+        # Solo reemplaza una fila existente si ya venció
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StateEntry.key],
+            set_={'value': stmt.excluded.value, 'expires_at': stmt.excluded.expires_at},
+            where=StateEntry.expires_at <= now
+        ).returning(StateEntry.key)
+        with self.engine.begin() as conn:
+            added = conn.execute(stmt).first() is not None
+            self._purge_expired(conn, now)
+        return added
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        now = time.time()
+        expired = StateEntry.expires_at <= now
+        stmt = self._insert().values(key=key, value=str(amount), expires_at=now + ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StateEntry.key],
+            set_={
+                'value': case(
+                    (expired, str(amount)),
+                    else_=cast(cast(StateEntry.value, Integer) + amount, Text)
+                ),
+                'expires_at': case((expired, now + ttl), else_=StateEntry.expires_at)
+            }
+        ).returning(StateEntry.value)
+        with self.engine.begin() as conn:
+            value = conn.execute(stmt).scalar()
+            self._purge_expired(conn, now)
+        return int(value)
+
+    def delete(self, key: str):
+        with self.engine.begin() as conn:
+            conn.execute(delete(StateEntry).where(StateEntry.key == key))
+
+class RedisStateStore(StateStore):
+    """Backend sobre Redis (o cualquier servidor compatible con su protocolo)"""
+
+    def __init__(self, url: str = None, client=None):
+        if client is None:
+            if redis is None:
+                raise ImportError("STATE_BACKEND=redis requiere el paquete redis (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+
+    @staticmethod
+    def _ms(ttl: float) -> int:
+        return max(int(ttl * 1000), 1)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key: str, value: str, ttl: float):
+        self.client.set(key, str(value), px=self._ms(ttl))
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        return bool(self.client.set(key, str(value), px=self._ms(ttl), nx=True))
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        # MULTI: crea la clave con su TTL solo si no existe; INCRBY conserva el TTL
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(key, 0, px=self._ms(ttl), nx=True)
+        pipe.incrby(key, amount)
+        return int(pipe.execute()[1])
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+def create_state_store(config: Config = None) -> StateStore:
+    """Crea el backend configurado en STATE_BACKEND"""
+    config = config or Config.from_env()
+    backend = config.STATE_BACKEND
+    if backend not in STATE_BACKENDS:
+        raise ValueError(f"STATE_BACKEND inválido: {backend} (use {', '.join(STATE_BACKENDS)})")
+    if backend == 'redis':
+        store = RedisStateStore(config.STATE_REDIS_URL)
+    elif backend == 'database':
+        store = DatabaseStateStore(config.DATABASE_URL)
+    else:
+        store = MemoryStateStore(config.STATE_MEMORY_MAX_KEYS)
+        logger.warning("STATE_BACKEND=memory: rate limits y anti-spam no se comparten entre workers")
+    logger.info(f"Estado compartido: backend {backend}")
+    return store
+
+# Instancia global del almacén de estado
+state_store = create_state_store()
@@ -13,7 +13,7 @@ export function openImageViewerModal({ imagePath, initialOcrText='' }) {
         <div style="background:#f8f9fa;padding:.5rem;border-radius:6px;font-family:monospace;max-height:140px;overflow:auto;font-size:.7rem;">${escapeHtml(initialOcrText)||'N/A'}</div>
       </div>
       <div style="text-align:center;">
-        <img src="/images/${name}" alt="Imagen" style="max-width:100%;max-height:420px;border:1px solid #ddd;border-radius:6px;object-fit:contain;" onerror="this.style.display='none';this.nextElementSibling.style.display='block';" />
+        <img src="/images/${name}?w=1024&fmt=webp" alt="Imagen" style="max-width:100%;max-height:420px;border:1px solid #ddd;border-radius:6px;object-fit:contain;" onerror="this.style.display='none';this.nextElementSibling.style.display='block';" />
         <div style="display:none;color:#666;font-size:.8rem;margin-top:.5rem;">❌ No se pudo cargar la imagen</div>
       </div>
     </div>`;
@@ -1,16 +1,33 @@
 import { http } from '../core/http.js';
 
 const API_BASE = '/api/v2/admin';
+// Tope de items que la UI carga de listados largos (anotaciones de un usuario, control de calidad)
+const LIST_MAX_ITEMS = 5000;
+
+// Recorre las páginas (cursor keyset) de un listado hasta agotarlo o llegar a maxItems
+async function fetchPages(url, key, { pageSize = 1000, maxItems = Infinity } = {}) {
+  const sep = url.includes('?') ? '&' : '?';
+  const items = [];
+  let first = null;
+  let cursor = null;
+  do {
+    const page = await http(`${url}${sep}limit=${pageSize}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`);
+    first = first || page;
+    items.push(...(page[key] || []));
+    cursor = page.has_more ? page.next_cursor : null;
+  } while (cursor && items.length < maxItems);
+  return { ...first, [key]: items, has_more: !!cursor, next_cursor: cursor };
+}
 
 export const adminService = {
   // users
-  listUsers() { return http(`${API_BASE}/users`); },
+  listUsers() { return fetchPages(`${API_BASE}/users`, 'users'); },
   createUser({ username, password, role = 'annotator' }) {
     return http(`${API_BASE}/users`, { method: 'POST', body: JSON.stringify({ username, password, role }) });
   },
   deleteUser(userId) { return http(`${API_BASE}/users/${userId}`, { method: 'DELETE' }); },
   userStats(userId) { return http(`${API_BASE}/users/${userId}/stats`); },
-  userAnnotations(userId) { return http(`${API_BASE}/users/${userId}/annotations`); },
+  userAnnotations(userId) { return fetchPages(`${API_BASE}/users/${userId}/annotations`, 'annotations', { maxItems: LIST_MAX_ITEMS }); },
   deleteUserAnnotation(userId, annotationId) {
     return http(`${API_BASE}/users/${userId}/annotations/${annotationId}`, { method: 'DELETE' });
   },
@@ -44,7 +61,7 @@ export const adminService = {
       if (names.length) params.set('usernames', names.join(','));
     }
     const qs = params.toString();
-    return http(`${API_BASE}/quality-control${qs ? `?${qs}` : ''}`);
+    return fetchPages(`${API_BASE}/quality-control${qs ? `?${qs}` : ''}`, 'quality_control_data', { maxItems: LIST_MAX_ITEMS });
   },
   consolidateQuality({ user_annotation_id, admin_annotation_id }) {
     return http(`${API_BASE}/quality-control/consolidate`, { method: 'POST', body: JSON.stringify({ user_annotation_id, admin_annotation_id }) });
@@ -1,18 +1,75 @@
 import { http } from '../core/http.js';
 
+// Cola local de tareas reservadas con /task/batch; la primera es la tarea actual
+const BATCH_SIZE = 10;
+let queue = [];
+// Object URLs creados a partir del paquete de imágenes del lote actual
+let packUrls = [];
+
+function prefetchImages(tasks) {
+  tasks.forEach((task) => {
+    if (!task.image_url) return;
+    const img = new Image();
+    img.src = task.image_url;
+  });
+}
+
+function releasePackUrls() {
+  packUrls.forEach((url) => URL.revokeObjectURL(url));
+  packUrls = [];
+}
+
+// Descarga el paquete del lote en una sola petición y asigna a cada tarea un blob URL (image_src)
+async function loadPack(pack, tasks) {
+  try {
+    const res = await fetch(pack.url);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const buffer = await res.arrayBuffer();
+    const types = new Map(pack.entries.map((entry) => [entry.offset, entry.content_type]));
+    tasks.forEach((task) => {
+      if (task.pack_offset == null) return;
+      const bytes = buffer.slice(task.pack_offset, task.pack_offset + task.pack_length);
+      task.image_src = URL.createObjectURL(new Blob([bytes], { type: types.get(task.pack_offset) }));
+      packUrls.push(task.image_src);
+    });
+  } catch (err) {
+    // Sin paquete se vuelve a la precarga imagen por imagen
+    console.warn('Paquete de imágenes no disponible:', err);
+    prefetchImages(tasks);
+  }
+}
+
 export const taskService = {
   async getNextTask() {
-    const data = await http('/task/next');
-    if (data === null) return { completed: true };
-    return data;
+    if (queue.length === 0) {
+      const data = await http(`/task/batch?n=${BATCH_SIZE}&pack=true`);
+      releasePackUrls();
+      if (data === null) return { completed: true };
+      queue = data.tasks || [];
+      if (queue.length === 0) return { completed: true };
+      if (data.pack) await loadPack(data.pack, queue);
+      else prefetchImages(queue.slice(1));
+    }
+    return queue[0];
   },
+  clearQueue() { queue = []; releasePackUrls(); },
   getHistory(limit = 10) { return http(`/task/history?limit=${encodeURIComponent(limit)}`); },
   getPendingPreview(limit = 10) { return http(`/task/pending-preview?limit=${encodeURIComponent(limit)}`); },
   loadTask(annotationId) { return http(`/task/load/${annotationId}`); },
-  submitAction(annotationId, action, correctedText = null) {
-    const body = { status: action };
-    if (correctedText !== null) body.corrected_text = correctedText;
-    return http(`/annotations/${annotationId}`, { method: 'PUT', body: JSON.stringify(body) });
+  // Las acciones del anotador usan el mismo camino transaccional que los envíos masivos
+  async submitAction(annotationId, action, correctedText = null) {
+    const item = { annotation_id: annotationId, status: action };
+    if (correctedText !== null) item.corrected_text = correctedText;
+    const result = await this.submitActions([item]);
+    const [itemResult] = result.results || [];
+    if (!itemResult?.success) throw new Error(itemResult?.error || 'Error guardando la anotación');
+    return itemResult;
+  },
+  async submitActions(items) {
+    const result = await http('/annotations/bulk', { method: 'PUT', body: JSON.stringify({ items }) });
+    const done = new Set((result.results || []).filter((r) => r.success).map((r) => r.annotation_id));
+    queue = queue.filter((task) => !done.has(task.annotation_id));
+    return result;
   },
   getAnnotation(annotationId) { return http(`/annotations/${annotationId}`); },
 };
@@ -89,7 +89,8 @@ const uiAdapter = {
       const name = task.image_path.split('/').pop();
       // Set handler antes de cambiar src para cubrir cache race
       img.onload = () => adjustImageSize(img);
-      img.src = `/images/${name}`;
+      // image_src: blob URL del paquete del lote, si se descargó
+      img.src = task.image_src || `/images/${name}`;
       if (img.complete) adjustImageSize(img); // si viene de cache
       img.classList.remove('hidden');
       noImg.classList.add('hidden');
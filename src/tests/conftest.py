@@ -0,0 +1,89 @@
+"""
+Fixtures compartidas: la app corre contra una BD SQLite y carpetas de imágenes temporales.
+
+Los servicios globales (db_service, image_service, image_store...) leen la configuración al
+importarse, así que las variables de entorno se fijan aquí, antes de importar la app.
+"""
+import os
+import sys
+import uuid
+import shutil
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_ROOT = tempfile.mkdtemp(prefix='labeling-tests-')
+TEST_IMAGES_FOLDER = os.path.join(TEST_ROOT, 'images')
+os.makedirs(TEST_IMAGES_FOLDER)
+
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TEST_ROOT, 'app.db')}",
+    'IMAGES_FOLDER': TEST_IMAGES_FOLDER,
+    'IMAGE_PACK_FOLDER': os.path.join(TEST_ROOT, 'packs'),
+    'IMAGE_VARIANT_FOLDER': os.path.join(TEST_ROOT, 'variants'),
+    'IMAGE_STORE': 'filesystem',
+    'IMAGE_CACHE_MAX_AGE': '31536000',
+    'STATE_BACKEND': 'memory',
+    'JWT_SECRET_KEY': 'test-jwt-secret-key-with-at-least-32-bytes',
+    'SECRET_KEY': 'test-secret-key',
+    'FLASK_ENV': 'testing',
+    'DEBUG': 'False',
+    'LOG_LEVEL': 'WARNING',
+    'LOG_FILE': os.path.join(TEST_ROOT, 'app.log'),
+})
+
+@pytest.fixture(scope='session')
+def app():
+    """Aplicación Flask sobre la BD temporal"""
+    from app import create_app
+    app, _ = create_app()
+    app.config['TESTING'] = True
+    yield app
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(scope='session')
+def api_db_service(app):
+    """Servicio de base de datos que usan las rutas"""
+    from routes.sqlite_api_routes_jwt import db_service
+    return db_service
+
+@pytest.fixture
+def db_service(tmp_path):
+    """Servicio sobre una BD SQLite propia del test (sin datos de otros tests)"""
+    from services.database_service import DatabaseService
+    service = DatabaseService(f"sqlite:///{tmp_path / 'test.db'}")
+    service.db_manager.create_tables()
+    service.db_manager.init_admin_user()
+    yield service
+    service.db_manager.engine.dispose()
+
+def auth_headers(user) -> dict:
+    """Header Authorization con un token de acceso para el usuario"""
+    from services.jwt_service import jwt_service
+    token = jwt_service.create_access_token(user.id, user.username, user.role)
+    return {'Authorization': f"Bearer {token}"}
+
+@pytest.fixture
+def make_user(api_db_service):
+    """Crea un usuario con nombre único en la BD de la app"""
+    def make(role='annotator'):
+        return api_db_service.create_user(f"{role}-{uuid.uuid4().hex[:8]}", 'password123', role)
+    return make
+
+@pytest.fixture
+def make_images(api_db_service):
+    """Crea imágenes (archivo en IMAGES_FOLDER + fila) con contenido único; retorna sus filas"""
+    def make(count=1, extension='png'):
+        images = []
+        for _ in range(count):
+            filename = f"{uuid.uuid4().hex}.{extension}"
+            with open(os.path.join(TEST_IMAGES_FOLDER, filename), 'wb') as f:
+                f.write(os.urandom(256))
+            images.append(api_db_service.create_image(filename, f"ocr {filename[:8]}"))
+        return images
+    return make
@@ -0,0 +1,123 @@
+"""
+Tests de asignación de tareas: inserción set-based con índice único (usuario, imagen)
+"""
+from sqlalchemy import event, inspect, text
+from conftest import auth_headers
+from models.database import Annotation, DatabaseManager
+from services.json_provider import loads
+from utils.dedupe_annotations import dedupe_annotations
+
+def _annotation_pairs(db_service):
+    session = db_service.get_session()
+    try:
+        return [(row.user_id, row.image_id) for row in session.query(Annotation.user_id, Annotation.image_id)]
+    finally:
+        db_service.close_session(session)
+
+def test_assign_tasks_skips_existing_pairs(db_service):
+    users = [db_service.create_user(f"user{i}", 'password123') for i in range(2)]
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    user_ids = [user.id for user in users]
+    image_ids = [image.id for image in images]
+
+    assert db_service.assign_tasks(user_ids, image_ids[:2]) == {'created': 4, 'skipped': 0}
+    # Repetidos dentro de la misma llamada y pares ya asignados no se duplican
+    assert db_service.assign_tasks(user_ids + user_ids, image_ids + [image_ids[0]]) == {'created': 2, 'skipped': 4}
+
+    pairs = _annotation_pairs(db_service)
+    assert len(pairs) == 6
+    assert len(set(pairs)) == 6
+
+def test_assign_tasks_ignores_unknown_ids(db_service):
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    assert db_service.assign_tasks([user.id, 9999], [image.id, 9999]) == {'created': 1, 'skipped': 3}
+
+def test_assign_tasks_updates_user_counters(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    assert db_service.get_user_stats(user.id)['pending'] == 3
+
+def test_assign_tasks_counts_per_user_in_the_database(db_service):
+    """Los contadores se calculan con una fila por usuario, no con un par por asignación"""
+    users = [db_service.create_user(f"user{i}", 'password123') for i in range(2)]
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(4)]
+    db_service.assign_tasks([users[0].id], [images[0].id])
+    statements = []
+    event.listen(db_service.db_manager.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    assert db_service.assign_tasks([user.id for user in users], [image.id for image in images])['created'] == 7
+    assert not [statement for statement in statements if 'RETURNING' in statement and 'image_id' in statement]
+    assert [db_service.get_user_stats(user.id)['pending'] for user in users] == [4, 4]
+
+def test_assignments_route_reports_created_and_skipped(client, make_user, make_images):
+    admin_headers = auth_headers(make_user('admin'))
+    user = make_user()
+    image_ids = [image.id for image in make_images(2)]
+
+    response = client.post('/api/v2/admin/assignments', headers=admin_headers,
+                           json={'user_ids': [user.id], 'image_ids': image_ids})
+    assert response.status_code == 200
+    assert response.get_json()['assignments_created'] == 2
+
+    response = client.post('/api/v2/admin/assignments', headers=admin_headers,
+                           json={'user_ids': [user.id], 'image_ids': image_ids})
+    data = response.get_json()
+    assert data['assignments_created'] == 0
+    assert data['assignments_skipped'] == 2
+
+def _create_duplicates(db_service):
+    """BD anterior al índice único con (usuario, imagen) repetidos; retorna (imagen, otra imagen)"""
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    other = db_service.create_image('other.png', 'otro')
+    with db_service.db_manager.engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_annotation_user_image"))
+        conn.execute(text(
+            "INSERT INTO annotations (user_id, image_id, status, corrected_text, updated_at) VALUES "
+            "(:user, :image, 'pending', NULL, '2024-01-01 00:00:00'), "
+            "(:user, :image, 'corrected', 'revisada', '2024-01-02 00:00:00'), "
+            "(:user, :image, 'pending', NULL, '2024-01-03 00:00:00'), "
+            "(:user, :other, 'pending', NULL, '2024-01-01 00:00:00')"
+        ), {'user': user.id, 'image': image.id, 'other': other.id})
+    return image, other
+
+def _annotation_rows(engine):
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(
+            "SELECT image_id, status, corrected_text FROM annotations ORDER BY image_id, id"
+        ))]
+
+def test_upgrade_schema_keeps_duplicates_and_skips_unique_index(db_service):
+    """Al arrancar no se borran anotaciones: sin el índice único hasta deduplicar a mano"""
+    _create_duplicates(db_service)
+    engine = db_service.db_manager.engine
+    before = _annotation_rows(engine)
+
+    manager = DatabaseManager(str(engine.url))
+    manager.create_tables()
+    assert manager.count_duplicate_annotations() == 2
+    assert _annotation_rows(engine) == before
+    assert 'uq_annotation_user_image' not in {index['name'] for index in inspect(engine).get_indexes('annotations')}
+
+def test_dedupe_script_backs_up_and_creates_unique_index(db_service, tmp_path):
+    image, other = _create_duplicates(db_service)
+    engine = db_service.db_manager.engine
+    backup = tmp_path / 'duplicates.jsonl'
+
+    assert dedupe_annotations(str(engine.url), str(backup), dry_run=True) == 0
+    assert not backup.exists()
+
+    assert dedupe_annotations(str(engine.url), str(backup)) == 2
+    # Se conserva la anotación revisada, aunque haya una pending más reciente
+    assert _annotation_rows(engine) == [(image.id, 'corrected', 'revisada'), (other.id, 'pending', None)]
+    removed = [loads(line) for line in backup.read_bytes().splitlines()]
+    assert sorted(row['status'] for row in removed) == ['pending', 'pending']
+    # Las eliminadas se informan en el feed de cambios
+    deleted = [row.annotation_id for row in db_service.iter_annotation_changes() if row.deleted]
+    assert sorted(deleted) == sorted(row['id'] for row in removed)
+    indexes = {index['name']: index for index in inspect(engine).get_indexes('annotations')}
+    assert indexes['uq_annotation_user_image']['unique']
@@ -0,0 +1,108 @@
+"""
+Tests de PUT /api/v2/annotations/bulk: envío de varias anotaciones en una sola transacción
+"""
+from conftest import auth_headers
+from models.database import Annotation
+from routes.sqlite_api_routes_jwt import BULK_UPDATE_MAX
+
+BULK_URL = '/api/v2/annotations/bulk'
+
+def _annotation_ids(api_db_service, user_id, image_ids):
+    """IDs de las anotaciones del usuario para las imágenes dadas, en el mismo orden"""
+    session = api_db_service.get_session()
+    try:
+        ids = dict(session.query(Annotation.image_id, Annotation.id).filter(
+            Annotation.user_id == user_id, Annotation.image_id.in_(image_ids)
+        ).all())
+        return [ids[image_id] for image_id in image_ids]
+    finally:
+        api_db_service.close_session(session)
+
+def _user_with_tasks(make_user, make_images, api_db_service, count):
+    user = make_user()
+    images = make_images(count)
+    image_ids = [image.id for image in images]
+    api_db_service.assign_tasks([user.id], image_ids)
+    return user, images, _annotation_ids(api_db_service, user.id, image_ids)
+
+def _reference_admin_id(api_db_service):
+    return min(user.id for user in api_db_service.get_all_users() if user.role == 'admin')
+
+def test_bulk_reports_invalid_items_without_aborting(client, make_user, make_images, api_db_service):
+    user, _, (own_id,) = _user_with_tasks(make_user, make_images, api_db_service, 1)
+    _, _, (foreign_id,) = _user_with_tasks(make_user, make_images, api_db_service, 1)
+
+    response = client.put(BULK_URL, headers=auth_headers(user), json={'items': [
+        {'annotation_id': own_id, 'status': 'corrected', 'corrected_text': 'texto'},
+        {'annotation_id': foreign_id, 'status': 'approved'},
+        {'annotation_id': str(own_id), 'status': 'approved'},
+        {'annotation_id': True, 'status': 'approved'},
+        {'annotation_id': own_id, 'status': 'unknown'},
+    ]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['success'], data['updated'], data['failed']) == (False, 1, 4)
+    results = data['results']
+    assert results[0] == {'annotation_id': own_id, 'success': True, 'status': 'corrected'}
+    assert results[1]['error'] == 'Annotation not found or not authorized'
+    assert 'integer' in results[2]['error']
+    assert 'integer' in results[3]['error']
+    assert 'Invalid status' in results[4]['error']
+    assert not any(result['success'] for result in results[1:])
+
+    assert api_db_service.get_annotation_by_id(own_id).corrected_text == 'texto'
+    assert api_db_service.get_annotation_by_id(foreign_id).status == 'pending'
+
+def test_bulk_repeated_id_keeps_the_last_item(client, make_user, make_images, api_db_service):
+    user, _, (annotation_id,) = _user_with_tasks(make_user, make_images, api_db_service, 1)
+
+    data = client.put(BULK_URL, headers=auth_headers(user), json={'items': [
+        {'annotation_id': annotation_id, 'status': 'corrected', 'corrected_text': 'primero'},
+        {'annotation_id': annotation_id, 'status': 'discarded'},
+    ]}).get_json()
+    assert data['updated'] == 2
+    assert api_db_service.get_annotation_by_id(annotation_id).status == 'discarded'
+    # La anotación cuenta una sola vez, en su último estado
+    stats = api_db_service.get_user_stats(user.id)
+    assert (stats['total'], stats['discarded'], stats['corrected'], stats['pending']) == (1, 1, 0, 0)
+
+def test_bulk_approved_falls_back_to_the_ocr_text(client, make_user, make_images, api_db_service):
+    user, (image,), (annotation_id,) = _user_with_tasks(make_user, make_images, api_db_service, 1)
+
+    data = client.put(BULK_URL, headers=auth_headers(user), json={'items': [
+        {'annotation_id': annotation_id, 'status': 'approved'},
+    ]}).get_json()
+    assert data['success']
+    annotation = api_db_service.get_annotation_by_id(annotation_id)
+    assert (annotation.status, annotation.corrected_text) == ('approved', image.initial_ocr_text)
+
+def test_bulk_updates_counters_and_agreements(client, make_user, make_images, api_db_service):
+    admin_id = _reference_admin_id(api_db_service)
+    user, images, annotation_ids = _user_with_tasks(make_user, make_images, api_db_service, 3)
+    image_ids = [image.id for image in images]
+    api_db_service.assign_tasks([admin_id], image_ids)
+    for admin_annotation_id in _annotation_ids(api_db_service, admin_id, image_ids[:2]):
+        assert api_db_service.update_annotation(admin_annotation_id, admin_id, 'corrected', 'admin')
+
+    data = client.put(BULK_URL, headers=auth_headers(user), json={'items': [
+        {'annotation_id': annotation_ids[0], 'status': 'corrected', 'corrected_text': 'admin'},
+        {'annotation_id': annotation_ids[1], 'status': 'corrected', 'corrected_text': 'otro'},
+        {'annotation_id': annotation_ids[2], 'status': 'discarded'},
+    ]}).get_json()
+    assert data['updated'] == 3
+
+    stats = api_db_service.get_user_stats(user.id)
+    assert (stats['pending'], stats['corrected'], stats['discarded']) == (0, 2, 1)
+    # Solo las dos imágenes revisadas por el admin se comparan: una coincide
+    assert api_db_service.get_all_users_agreement_stats()[user.id] == {
+        'agreement_percentage': 50.0, 'total_comparisons': 2, 'agreements': 1
+    }
+
+def test_bulk_rejects_bad_payloads(client, make_user):
+    headers = auth_headers(make_user())
+    assert client.put(BULK_URL, headers=headers, json={'items': []}).status_code == 400
+    assert client.put(BULK_URL, headers=headers, json={'items': {'annotation_id': 1}}).status_code == 400
+    items = [{'annotation_id': 1, 'status': 'approved'}] * (BULK_UPDATE_MAX + 1)
+    response = client.put(BULK_URL, headers=headers, json={'items': items})
+    assert response.status_code == 400
+    assert str(BULK_UPDATE_MAX) in response.get_json()['error']
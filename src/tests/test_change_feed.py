@@ -0,0 +1,246 @@
+"""
+Tests del feed de cambios de anotaciones (annotations.change_seq) y de
+/api/v2/admin/export/annotations/changes
+"""
+from datetime import datetime, timezone
+from sqlalchemy import event, text
+from conftest import auth_headers
+from models.database import DatabaseManager
+from services.pagination import encode_cursor
+
+CHANGES_URL = '/api/v2/admin/export/annotations/changes'
+
+def _changes(db_service, after=None):
+    return [(row.annotation_id, row.status) for row in db_service.iter_annotation_changes(after=after)]
+
+def _watermark(db_service):
+    rows = list(db_service.iter_annotation_changes())
+    return rows[-1].change_seq if rows else 0
+
+def test_changes_follow_commit_order(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    tasks = db_service.claim_pending_tasks(user.id, 3)
+    watermark = _watermark(db_service)
+
+    # Se actualizan en orden inverso al de los ids: el feed sigue el orden de commit
+    for task in reversed(tasks):
+        assert db_service.update_annotation(task.annotation_id, user.id, 'approved')
+    assert _changes(db_service, watermark) == [(task.annotation_id, 'approved') for task in reversed(tasks)]
+
+def test_updated_annotation_moves_to_the_end(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(2)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    first, second = db_service.claim_pending_tasks(user.id, 2)
+
+    db_service.update_annotation(first.annotation_id, user.id, 'approved')
+    db_service.update_annotation(second.annotation_id, user.id, 'approved')
+    db_service.update_annotation(first.annotation_id, user.id, 'corrected', 'corregido')
+
+    changes = _changes(db_service)
+    assert changes[-2:] == [(second.annotation_id, 'approved'), (first.annotation_id, 'corrected')]
+    # Cada anotación aparece una sola vez, con su última versión
+    assert len(changes) == len({annotation_id for annotation_id, _ in changes})
+
+def test_claims_do_not_enter_the_feed(db_service):
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    db_service.assign_tasks([user.id], [image.id])
+    watermark = _watermark(db_service)
+
+    assert db_service.claim_pending_tasks(user.id, 1)
+    assert _changes(db_service, watermark) == []
+
+def test_bulk_update_gets_one_position_per_row(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    tasks = db_service.claim_pending_tasks(user.id, 3)
+    watermark = _watermark(db_service)
+
+    results = db_service.bulk_update_annotations(
+        user.id, [{'annotation_id': task.annotation_id, 'status': 'discarded'} for task in tasks]
+    )
+    assert all(result['success'] for result in results)
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert len(rows) == 3
+    assert len({row.change_seq for row in rows}) == 3
+
+def test_restart_keeps_the_sequence(db_service):
+    """Volver a iniciar sobre una BD existente no reinicia ni duplica el contador del feed"""
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    db_service.assign_tasks([user.id], [image.id])
+    watermark = _watermark(db_service)
+
+    manager = DatabaseManager(str(db_service.db_manager.engine.url))
+    manager.create_tables()
+    manager.engine.dispose()
+
+    other = db_service.create_image('other.png', 'otro')
+    db_service.assign_tasks([user.id], [other.id])
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert [row.image_id for row in rows] == [other.id]
+
+def _read_all(client, headers, since=None):
+    """Recorre el feed hasta el final; retorna (cambios, último cursor)"""
+    changes = []
+    while True:
+        params = {'limit': 2}
+        if since:
+            params['since'] = since
+        data = client.get(CHANGES_URL, headers=headers, query_string=params).get_json()
+        changes += data['changes']
+        since = data['next_cursor']
+        if not data['has_more']:
+            return changes, since
+
+def test_changes_endpoint_pages_with_cursor(client, make_user, make_images, api_db_service):
+    headers = auth_headers(make_user('admin'))
+    _, watermark = _read_all(client, headers)
+
+    user = make_user()
+    images = make_images(3)
+    api_db_service.assign_tasks([user.id], [image.id for image in images])
+    changes, watermark = _read_all(client, headers, watermark)
+    assert sorted(change['image_id'] for change in changes) == sorted(image.id for image in images)
+    assert {change['status'] for change in changes} == {'pending'}
+
+    # Sin cambios nuevos el cursor no avanza
+    data = client.get(CHANGES_URL, headers=headers, query_string={'since': watermark}).get_json()
+    assert data['changes'] == []
+    assert data['next_cursor'] == watermark
+
+    task = api_db_service.claim_pending_tasks(user.id, 1)[0]
+    api_db_service.update_annotation(task.annotation_id, user.id, 'approved')
+    changes, _ = _read_all(client, headers, watermark)
+    assert [(change['annotation_id'], change['status']) for change in changes] == [(task.annotation_id, 'approved')]
+
+def test_changes_endpoint_jsonl(client, make_user, make_images, api_db_service):
+    headers = auth_headers(make_user('admin'))
+    _, watermark = _read_all(client, headers)
+    user = make_user()
+    image = make_images(1)[0]
+    api_db_service.assign_tasks([user.id], [image.id])
+
+    response = client.get(CHANGES_URL, headers=headers, query_string={'since': watermark, 'format': 'jsonl'})
+    assert response.content_type == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 1
+    assert '"cursor"' in lines[0]
+
+def test_changes_endpoint_rejects_non_sequence_cursors(client, make_user):
+    """Solo se aceptan cursores de change_seq"""
+    headers = auth_headers(make_user('admin'))
+    for cursor in (encode_cursor(datetime(2000, 1, 1, tzinfo=timezone.utc), 0), encode_cursor('abc')):
+        assert client.get(CHANGES_URL, headers=headers, query_string={'since': cursor}).status_code == 400
+
+def test_changes_endpoint_rejects_bad_input(client, make_user):
+    headers = auth_headers(make_user('admin'))
+    assert client.get(CHANGES_URL, headers=headers, query_string={'since': 'not-a-cursor'}).status_code == 400
+    assert client.get(CHANGES_URL, headers=headers, query_string={'status': 'unknown'}).status_code == 400
+    assert client.get(CHANGES_URL, headers=headers, query_string={'format': 'xml'}).status_code == 400
+    assert client.get(CHANGES_URL, headers=auth_headers(make_user())).status_code == 403
+
+def test_commits_without_annotation_writes_skip_the_stamp(db_service):
+    statements = []
+    event.listen(db_service.db_manager.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    db_service.create_user('user', 'password123')
+    db_service.create_image('img.png', 'texto')
+    assert not [statement for statement in statements if 'sequence_counters' in statement or 'change_seq IS NULL' in statement]
+
+def test_missing_counter_row_is_recreated(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(2)]
+    db_service.assign_tasks([user.id], [images[0].id])
+    watermark = _watermark(db_service)
+    with db_service.db_manager.engine.begin() as conn:
+        conn.execute(text("DELETE FROM sequence_counters"))
+
+    assert db_service.assign_tasks([user.id], [images[1].id])['created'] == 1
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert [row.image_id for row in rows] == [images[1].id]
+    assert rows[0].change_seq == watermark + 1
+
+def test_stamp_is_a_single_statement(db_service):
+    """Una asignación masiva numera todas sus filas con un solo UPDATE, no uno por fila"""
+    users = [db_service.create_user(f"user{i}", 'password123') for i in range(2)]
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    watermark = _watermark(db_service)
+    stamps = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'change_seq' in statement and statement.lstrip().upper().startswith('UPDATE ANNOTATIONS'):
+            stamps.append(executemany)
+    event.listen(db_service.db_manager.engine, 'before_cursor_execute', record)
+
+    assert db_service.assign_tasks([user.id for user in users], [image.id for image in images])['created'] == 6
+    assert stamps == [False]
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert [row.change_seq for row in rows] == list(range(watermark + 1, watermark + 7))
+
+def _deletions(db_service, after=None):
+    return [row.annotation_id for row in db_service.iter_annotation_changes(after=after) if row.deleted]
+
+def test_deletions_enter_the_feed(db_service):
+    users = [db_service.create_user(f"user{i}", 'password123') for i in range(2)]
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    db_service.assign_tasks([user.id for user in users], [image.id for image in images])
+    first, second = users
+    tasks = db_service.claim_pending_tasks(first.id, 3)
+    db_service.update_annotation(tasks[0].annotation_id, first.id, 'approved')
+    watermark = _watermark(db_service)
+
+    assert db_service.delete_user_annotation(tasks[1].annotation_id, first.id)
+    assert db_service.delete_user_annotations_by_status(first.id, ['approved']) == 1
+    assert _deletions(db_service, watermark) == [tasks[1].annotation_id, tasks[0].annotation_id]
+
+    second_ids = [task.annotation_id for task in db_service.claim_pending_tasks(second.id, 3)]
+    watermark = _watermark(db_service)
+    assert db_service.delete_user_completely(second.id)
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert sorted(row.annotation_id for row in rows) == sorted(second_ids)
+    assert all(row.deleted and row.status is None and row.username is None for row in rows)
+    assert all(row.change_seq > watermark for row in rows)
+
+def test_deletions_ignore_the_status_filter(db_service):
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    db_service.assign_tasks([user.id], [image.id])
+    task = db_service.claim_pending_tasks(user.id, 1)[0]
+    watermark = _watermark(db_service)
+
+    assert db_service.delete_user_annotation(task.annotation_id, user.id)
+    rows = list(db_service.iter_annotation_changes(after=watermark, statuses=['approved']))
+    assert [(row.annotation_id, row.deleted, row.image_path) for row in rows] == [(task.annotation_id, True, 'img.png')]
+
+def test_changes_endpoint_reports_deletions(client, make_user, make_images, api_db_service):
+    headers = auth_headers(make_user('admin'))
+    _, watermark = _read_all(client, headers)
+    user = make_user()
+    image = make_images(1)[0]
+    api_db_service.assign_tasks([user.id], [image.id])
+    task = api_db_service.claim_pending_tasks(user.id, 1)[0]
+    assert api_db_service.delete_user_annotation(task.annotation_id, user.id)
+
+    changes, _ = _read_all(client, headers, watermark)
+    assert [(change['annotation_id'], change['deleted']) for change in changes] == [(task.annotation_id, True)]
+    assert changes[0]['status'] is None
+
+def test_reseeded_counter_skips_tombstone_positions(db_service):
+    """Sin fila del contador, el arranque la recrea por encima de las lápidas"""
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(2)]
+    db_service.assign_tasks([user.id], [images[0].id])
+    task = db_service.claim_pending_tasks(user.id, 1)[0]
+    assert db_service.delete_user_annotation(task.annotation_id, user.id)
+    watermark = _watermark(db_service)
+    with db_service.db_manager.engine.begin() as conn:
+        conn.execute(text("DELETE FROM sequence_counters"))
+
+    DatabaseManager(str(db_service.db_manager.engine.url)).create_tables()
+    db_service.assign_tasks([user.id], [images[1].id])
+    rows = list(db_service.iter_annotation_changes(after=watermark))
+    assert [(row.image_id, row.change_seq) for row in rows] == [(images[1].id, watermark + 1)]
@@ -0,0 +1,70 @@
+"""
+Tests de la caché de archivos derivados en disco (paquetes y variantes)
+"""
+import os
+import pytest
+from services import disk_cache as disk_cache_module
+from services.disk_cache import DiskCache
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Cuenta los recorridos de la carpeta"""
+    calls = []
+    scandir = os.scandir
+    def counting_scandir(path):
+        calls.append(path)
+        return scandir(path)
+    monkeypatch.setattr(disk_cache_module.os, 'scandir', counting_scandir)
+    return calls
+
+def _age(cache, filename, mtime):
+    os.utime(cache.path(filename), (mtime, mtime))
+
+def test_puts_below_the_limit_do_not_scan(tmp_path, scans):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for i in range(20):
+        cache.put_bytes(f"{i}.bin", b'x' * 10)
+    # Solo el primer put recorre la carpeta para conocer el total
+    assert len(scans) == 1
+    assert cache._total == 200
+
+def test_overwrite_is_not_counted_twice(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    cache.put_bytes('a.bin', b'x' * 100)
+    cache.put_bytes('a.bin', b'x' * 40)
+    assert cache._total == 40
+
+def test_exceeding_the_limit_evicts_least_recently_used(tmp_path, scans):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    for i, name in enumerate(('old.bin', 'used.bin', 'new.bin')):
+        cache.put_bytes(name, b'x' * 100 if name != 'new.bin' else b'')
+        _age(cache, name, 1000 + i)
+    _age(cache, 'used.bin', 2000)
+
+    cache.put_bytes('extra.bin', b'x' * 100)
+    assert len(scans) == 2
+    assert cache.get('old.bin') is None
+    assert cache.get('used.bin') is not None
+    assert cache.get('extra.bin') is not None
+    assert cache._total == 200
+
+def test_rescan_picks_up_files_from_other_workers(tmp_path, scans):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    cache.put_bytes('a.bin', b'x' * 10)
+    other = DiskCache(str(tmp_path), max_bytes=1000)
+    other.put_bytes('b.bin', b'x' * 500)
+    assert cache._total == 10
+
+    cache._next_scan = 0
+    cache.put_bytes('c.bin', b'x' * 10)
+    assert cache._total == 520
+
+def test_failed_writer_leaves_no_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    def writer(f):
+        f.write(b'partial')
+        raise OSError('disco lleno')
+    with pytest.raises(OSError):
+        cache.put('a.bin', writer)
+    assert os.listdir(tmp_path) == []
+    assert cache.get('a.bin') is None
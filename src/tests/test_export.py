@@ -0,0 +1,140 @@
+"""
+Tests de /api/v2/admin/export/annotations: formatos en streaming, gzip y filtros
+"""
+import csv
+import io
+import gzip
+import json
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from conftest import auth_headers
+from services.export_service import EXPORT_COLUMNS, image_key
+
+EXPORT_URL = '/api/v2/admin/export/annotations'
+
+def _rows_jsonl(data: bytes) -> list:
+    return [json.loads(line) for line in data.splitlines()]
+
+def _rows_csv(data: bytes) -> list:
+    rows = list(csv.DictReader(io.StringIO(data.decode('utf-8'))))
+    for row in rows:
+        row['image_id'] = int(row['image_id'])
+        row['user_id'] = int(row['user_id'])
+        row['corrected_text'] = row['corrected_text'] or None
+    return rows
+
+def _rows_parquet(data: bytes) -> list:
+    return pq.read_table(io.BytesIO(data)).to_pylist()
+
+def _rows_arrow(data: bytes) -> list:
+    return pa.ipc.open_stream(data).read_all().to_pylist()
+
+def _rows_json(data: bytes) -> list:
+    """El formato json agrupa por imagen: {image_key: {username: texto}}"""
+    document = json.loads(data)
+    return [{'image_key': key, 'username': username, 'corrected_text': value}
+            for key, users in document['data'].items() for username, value in users.items()]
+
+PARSERS = {
+    'jsonl': _rows_jsonl,
+    'csv': _rows_csv,
+    'parquet': _rows_parquet,
+    'arrow': _rows_arrow,
+}
+
+@pytest.fixture
+def dataset(make_user, make_images, api_db_service):
+    """Usuario con una anotación aprobada (enero), una corregida (febrero), una descartada
+    (marzo) y una pendiente"""
+    user = make_user()
+    images = make_images(4)
+    api_db_service.assign_tasks([user.id], [image.id for image in images])
+    tasks = {task.image_id: task for task in api_db_service.claim_pending_tasks(user.id, 4)}
+    updates = [
+        (images[0], 'approved', None, '2024-01-10 00:00:00.000000'),
+        (images[1], 'corrected', 'texto corregido', '2024-02-10 00:00:00.000000'),
+        (images[2], 'discarded', None, '2024-03-10 00:00:00.000000'),
+    ]
+    for image, status, corrected_text, _ in updates:
+        assert api_db_service.update_annotation(tasks[image.id].annotation_id, user.id, status, corrected_text)
+    with api_db_service.db_manager.engine.begin() as conn:
+        for image, _, _, updated_at in updates:
+            conn.execute(text("UPDATE annotations SET updated_at = :updated_at WHERE id = :id"),
+                         {'updated_at': updated_at, 'id': tasks[image.id].annotation_id})
+    return user, images
+
+def _export(client, headers, **params):
+    response = client.get(EXPORT_URL, headers=headers, query_string=params)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response
+
+@pytest.fixture
+def admin_headers(make_user):
+    return auth_headers(make_user('admin'))
+
+@pytest.mark.parametrize('fmt', sorted(PARSERS))
+def test_row_formats(client, admin_headers, dataset, fmt):
+    user, images = dataset
+    response = _export(client, admin_headers, format=fmt, user_id=user.id)
+    rows = PARSERS[fmt](response.data)
+
+    assert [row['image_id'] for row in rows] == [image.id for image in images[:3]]
+    assert set(rows[0]) == set(EXPORT_COLUMNS)
+    assert [row['status'] for row in rows] == ['approved', 'corrected', 'discarded']
+    assert rows[0]['corrected_text'] == images[0].initial_ocr_text
+    assert rows[1]['corrected_text'] == 'texto corregido'
+    assert {row['username'] for row in rows} == {user.username}
+    assert rows[0]['image_key'] == image_key(images[0].id)
+
+@pytest.mark.parametrize('fmt', sorted(PARSERS) + ['json'])
+def test_gzip_round_trip(client, admin_headers, dataset, fmt):
+    user, _ = dataset
+    plain = _export(client, admin_headers, format=fmt, user_id=user.id)
+    compressed = _export(client, admin_headers, format=fmt, user_id=user.id, gzip='true')
+
+    assert compressed.content_type == 'application/gzip'
+    assert compressed.headers['Content-Disposition'].endswith('.gz"')
+    parse = PARSERS.get(fmt, _rows_json)
+    assert parse(gzip.decompress(compressed.data)) == parse(plain.data)
+
+def test_json_keeps_the_original_document(client, admin_headers, dataset):
+    user, images = dataset
+    response = _export(client, admin_headers, user_id=user.id)
+    assert response.content_type == 'application/json'
+    document = response.get_json()
+    assert document['data'][image_key(images[1].id)] == {user.username: 'texto corregido'}
+    assert document['metadata']['total_annotations'] == 3
+    assert document['metadata']['total_images'] == 3
+
+def test_status_filter(client, admin_headers, dataset):
+    user, images = dataset
+    rows = _rows_jsonl(_export(client, admin_headers, format='jsonl', user_id=user.id, status='pending').data)
+    assert [(row['image_id'], row['status']) for row in rows] == [(images[3].id, 'pending')]
+    rows = _rows_jsonl(_export(client, admin_headers, format='jsonl', user_id=user.id,
+                               status='approved,discarded').data)
+    assert [row['status'] for row in rows] == ['approved', 'discarded']
+
+def test_user_filter(client, admin_headers, dataset, make_user):
+    user, _ = dataset
+    other = make_user()
+    rows = _rows_jsonl(_export(client, admin_headers, format='jsonl', user_id=f"{user.id},{other.id}").data)
+    assert {row['user_id'] for row in rows} == {user.id}
+    assert _export(client, admin_headers, format='jsonl', user_id=other.id).data == b''
+
+def test_date_filters(client, admin_headers, dataset):
+    user, images = dataset
+    rows = _rows_jsonl(_export(client, admin_headers, format='jsonl', user_id=user.id,
+                               since='2024-02-01', until='2024-03-10T00:00:00Z').data)
+    # since es inclusivo y until exclusivo
+    assert [row['image_id'] for row in rows] == [images[1].id]
+    rows = _rows_jsonl(_export(client, admin_headers, format='jsonl', user_id=user.id, since='2024-02-10').data)
+    assert [row['image_id'] for row in rows] == [images[1].id, images[2].id]
+
+def test_invalid_filters(client, admin_headers):
+    for params in ({'format': 'xml'}, {'status': 'unknown'}, {'user_id': 'abc'}, {'since': 'ayer'}):
+        assert client.get(EXPORT_URL, headers=admin_headers, query_string=params).status_code == 400
+
+def test_requires_admin(client, make_user):
+    assert client.get(EXPORT_URL, headers=auth_headers(make_user())).status_code == 403
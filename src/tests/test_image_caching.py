@@ -0,0 +1,86 @@
+"""
+Tests de caché HTTP en /images/<filename>: ETag por contenido, Cache-Control inmutable y 304
+"""
+import io
+import os
+import uuid
+import hashlib
+from PIL import Image as PILImage
+from conftest import TEST_IMAGES_FOLDER
+
+MAX_AGE = 31536000
+
+def _write_image(content: bytes = None) -> str:
+    filename = f"{uuid.uuid4().hex}.png"
+    with open(os.path.join(TEST_IMAGES_FOLDER, filename), 'wb') as f:
+        f.write(content if content is not None else os.urandom(512))
+    return filename
+
+def _write_png(width=200, height=50) -> str:
+    filename = f"{uuid.uuid4().hex}.png"
+    PILImage.new('RGB', (width, height), (200, 30, 30)).save(os.path.join(TEST_IMAGES_FOLDER, filename))
+    return filename
+
+def assert_immutable(response):
+    """Cache-Control de una imagen inmutable (sin no-cache, que obligaría a revalidar)"""
+    cache_control = response.cache_control
+    assert cache_control.public
+    assert cache_control.max_age == MAX_AGE
+    assert cache_control.immutable
+    assert not cache_control.no_cache
+    assert 'no-cache' not in response.headers['Cache-Control']
+
+def test_strong_content_etag(client):
+    content = os.urandom(512)
+    filename = _write_image(content)
+
+    response = client.get(f"/images/{filename}")
+    assert response.status_code == 200
+    assert response.data == content
+    etag, weak = response.get_etag()
+    assert not weak
+    assert etag == hashlib.sha256(content).hexdigest()
+    assert_immutable(response)
+
+def test_same_content_same_etag(client):
+    content = os.urandom(512)
+    first = client.get(f"/images/{_write_image(content)}")
+    second = client.get(f"/images/{_write_image(content)}")
+    assert first.get_etag() == second.get_etag()
+
+def test_if_none_match_returns_304(client):
+    filename = _write_image()
+    etag = client.get(f"/images/{filename}").get_etag()[0]
+
+    response = client.get(f"/images/{filename}", headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag()[0] == etag
+    assert_immutable(response)
+
+    response = client.get(f"/images/{filename}", headers={'If-None-Match': '"otro"'})
+    assert response.status_code == 200
+
+def test_missing_image(client):
+    assert client.get('/images/no-existe.png').status_code == 404
+    assert client.get('/images/..%2Fapp.db').status_code == 404
+
+def test_variant_cache_headers(client):
+    filename = _write_png()
+
+    response = client.get(f"/images/{filename}?w=128&fmt=webp")
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert PILImage.open(io.BytesIO(response.data)).size == (128, 32)
+    assert_immutable(response)
+    etag = response.get_etag()[0]
+    assert etag != client.get(f"/images/{filename}").get_etag()[0]
+
+    response = client.get(f"/images/{filename}?w=128&fmt=webp", headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert_immutable(response)
+
+def test_invalid_variant(client):
+    filename = _write_png()
+    assert client.get(f"/images/{filename}?w=0").status_code == 400
+    assert client.get(f"/images/{filename}?fmt=bmp").status_code == 400
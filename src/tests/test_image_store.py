@@ -0,0 +1,161 @@
+"""
+Tests de los almacenes de imágenes (filesystem, mmap, accel) detrás de /images/<filename>
+"""
+import os
+import uuid
+import hashlib
+import pytest
+import app as app_module
+from config import Config
+from conftest import TEST_IMAGES_FOLDER
+from services.image_store import (
+    AccelRedirectImageStore, FilesystemImageStore, MmapImageStore, create_image_store, write_image_store
+)
+
+MAX_AGE = 31536000
+
+def _write_image(content: bytes = None) -> str:
+    filename = f"{uuid.uuid4().hex}.png"
+    with open(os.path.join(TEST_IMAGES_FOLDER, filename), 'wb') as f:
+        f.write(content if content is not None else os.urandom(512))
+    return filename
+
+def _build_store(path, filenames):
+    return write_image_store(str(path), [(filename, os.path.join(TEST_IMAGES_FOLDER, filename))
+                                         for filename in filenames])
+
+@pytest.fixture
+def stored(tmp_path):
+    """Almacén mapeado con tres imágenes; retorna (ruta del almacén, {filename: contenido})"""
+    contents = {}
+    for _ in range(3):
+        content = os.urandom(300)
+        contents[_write_image(content)] = content
+    path = tmp_path / 'images.store'
+    assert _build_store(path, contents) == 3
+    return path, contents
+
+@pytest.fixture
+def use_store(monkeypatch, app):
+    """Sirve /images/<filename> con el almacén dado"""
+    def use(store):
+        monkeypatch.setattr(app_module, 'image_store', store)
+        return store
+    return use
+
+def assert_immutable(response):
+    assert response.cache_control.public
+    assert response.cache_control.max_age == MAX_AGE
+    assert response.cache_control.immutable
+    assert 'no-cache' not in response.headers['Cache-Control']
+
+def test_mmap_store_serves_from_the_mapping(client, stored, use_store):
+    path, contents = stored
+    store = use_store(MmapImageStore(str(path), MAX_AGE))
+
+    for filename, content in contents.items():
+        image = store.lookup(filename)
+        assert image.mapping is not None
+        response = client.get(f"/images/{filename}")
+        assert response.status_code == 200
+        assert response.data == content
+        assert response.get_etag() == (hashlib.sha256(content).hexdigest(), False)
+        assert response.headers['Accept-Ranges'] == 'bytes'
+        assert_immutable(response)
+
+def test_mmap_store_conditional_and_range(client, stored, use_store):
+    path, contents = stored
+    use_store(MmapImageStore(str(path), MAX_AGE))
+    filename, content = next(iter(contents.items()))
+    etag = hashlib.sha256(content).hexdigest()
+
+    response = client.get(f"/images/{filename}", headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert_immutable(response)
+
+    response = client.get(f"/images/{filename}", headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == content[10:20]
+    assert response.headers['Content-Range'] == f"bytes 10-19/{len(content)}"
+
+def test_mmap_store_falls_back_to_filesystem(client, stored, use_store):
+    path, _ = stored
+    store = use_store(MmapImageStore(str(path), MAX_AGE))
+    content = os.urandom(100)
+    filename = _write_image(content)
+
+    assert store.lookup(filename).mapping is None
+    response = client.get(f"/images/{filename}")
+    assert response.status_code == 200
+    assert response.data == content
+    assert_immutable(response)
+    assert client.get('/images/no-existe.png').status_code == 404
+
+def test_mmap_store_without_file_uses_filesystem(client, tmp_path, use_store):
+    use_store(MmapImageStore(str(tmp_path / 'missing.store'), MAX_AGE))
+    content = os.urandom(100)
+    response = client.get(f"/images/{_write_image(content)}")
+    assert response.status_code == 200
+    assert response.data == content
+
+def test_mmap_store_picks_up_a_rebuilt_store(stored):
+    path, contents = stored
+    store = MmapImageStore(str(path), MAX_AGE)
+    old = next(iter(contents))
+    old_image = store.lookup(old)
+
+    new_content = os.urandom(200)
+    new = _write_image(new_content)
+    _build_store(path, [new])
+    store._next_check = 0
+
+    image = store.lookup(new)
+    assert image.mapping is not None
+    assert image.mapping[image.offset:image.offset + image.size] == new_content
+    assert store.lookup(old).mapping is None
+    # Una imagen encontrada antes del cambio se sigue leyendo de su mapeo
+    assert old_image.mapping[old_image.offset:old_image.offset + old_image.size] == contents[old]
+
+def test_store_index_is_sorted_by_bytes(tmp_path):
+    names = ['b.png', 'a.png', 'Z.png', 'ñ.png', 'a0.png']
+    for name in names:
+        with open(os.path.join(TEST_IMAGES_FOLDER, name), 'wb') as f:
+            f.write(name.encode('utf-8'))
+    path = tmp_path / 'images.store'
+    _build_store(path, names)
+    store = MmapImageStore(str(path), MAX_AGE)
+    for name in names:
+        image = store.lookup(name)
+        assert image.mapping[image.offset:image.offset + image.size] == name.encode('utf-8')
+
+def test_accel_store_delegates_the_body(client, use_store):
+    use_store(AccelRedirectImageStore('/protected-images/', MAX_AGE))
+    content = os.urandom(100)
+    filename = _write_image(content)
+
+    response = client.get(f"/images/{filename}")
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == f"/protected-images/{filename}"
+    assert response.data == b''
+    assert response.get_etag() == (hashlib.sha256(content).hexdigest(), False)
+    assert_immutable(response)
+
+@pytest.mark.parametrize('make_store', [
+    lambda path: FilesystemImageStore(MAX_AGE),
+    lambda path: MmapImageStore(str(path), MAX_AGE),
+    lambda path: AccelRedirectImageStore('/protected-images', MAX_AGE),
+], ids=['filesystem', 'mmap', 'accel'])
+def test_no_store_sends_no_cache(client, stored, use_store, make_store):
+    """Regresión: send_file sin max_age agregaba no-cache y el navegador revalidaba cada imagen"""
+    path, contents = stored
+    use_store(make_store(path))
+    response = client.get(f"/images/{next(iter(contents))}")
+    assert response.status_code == 200
+    assert_immutable(response)
+
+def test_create_image_store():
+    assert isinstance(create_image_store(Config(IMAGE_STORE='filesystem')), FilesystemImageStore)
+    assert isinstance(create_image_store(Config(IMAGE_STORE='mmap')), MmapImageStore)
+    assert isinstance(create_image_store(Config(IMAGE_STORE='accel')), AccelRedirectImageStore)
+    with pytest.raises(ValueError):
+        create_image_store(Config(IMAGE_STORE='s3'))
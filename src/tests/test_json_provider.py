@@ -0,0 +1,76 @@
+"""
+Tests del proveedor JSON de la app: mismas respuestas que el proveedor por defecto de Flask
+"""
+import uuid
+import decimal
+import dataclasses
+from datetime import date, datetime, timezone
+from typing import NamedTuple
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from conftest import auth_headers
+from services import json_provider
+from services.json_provider import FastJSONProvider, dumps_bytes, loads
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: int
+
+class Row(NamedTuple):
+    id: int
+    updated_at: datetime
+
+PAYLOAD = {
+    'aware': datetime(2024, 3, 10, 15, 30, 5, tzinfo=timezone.utc),
+    'naive': datetime(2024, 3, 10, 15, 30, 5),
+    'day': date(2024, 3, 10),
+    'amount': decimal.Decimal('1.50'),
+    'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    'point': Point(1, 2),
+    'row': Row(7, datetime(2024, 1, 1, tzinfo=timezone.utc)),
+    'texto': 'ñandú',
+}
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request, monkeypatch):
+    if request.param == 'orjson':
+        if json_provider.orjson is None:
+            pytest.skip('orjson no está instalado')
+    else:
+        monkeypatch.setattr(json_provider, 'orjson', None)
+    return request.param
+
+def test_matches_flask_default_provider(backend):
+    flask_app = Flask(__name__)
+    expected = DefaultJSONProvider(flask_app).dumps(PAYLOAD)
+    assert loads(FastJSONProvider(flask_app).dumps(PAYLOAD)) == loads(expected)
+
+def test_datetimes_use_http_date_format(backend):
+    data = loads(FastJSONProvider(Flask(__name__)).dumps(PAYLOAD))
+    assert data['aware'] == 'Sun, 10 Mar 2024 15:30:05 GMT'
+    assert data['naive'] == 'Sun, 10 Mar 2024 15:30:05 GMT'
+    assert data['day'] == 'Sun, 10 Mar 2024 00:00:00 GMT'
+    assert data['row'] == [7, 'Mon, 01 Jan 2024 00:00:00 GMT']
+
+def test_dumps_bytes_keeps_iso_8601(backend):
+    data = loads(dumps_bytes(PAYLOAD))
+    assert data['aware'].startswith('2024-03-10T15:30:05')
+    assert data['day'] == '2024-03-10'
+
+def test_api_response_dates(client, make_user, make_images, api_db_service):
+    """Los campos de fecha de la API siguen en ISO 8601: los formatean to_dict y los DTOs"""
+    headers = auth_headers(make_user('admin'))
+    user = make_user()
+    image = make_images(1)[0]
+    api_db_service.assign_tasks([user.id], [image.id])
+
+    response = client.get(f"/api/v2/admin/images/{image.id}/annotations", headers=headers)
+    assert response.status_code == 200
+    updated_at = response.get_json()['annotations'][0]['updated_at']
+    assert datetime.fromisoformat(updated_at)
+    assert response.data.endswith(b'\n')
+
+    response = client.get(f"/api/v2/admin/users/{user.id}/annotations", headers=headers)
+    assert datetime.fromisoformat(response.get_json()['annotations'][0]['updated_at'])
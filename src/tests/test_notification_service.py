@@ -0,0 +1,69 @@
+"""
+Tests del anti-spam de NotificationService sobre el almacén de estado compartido
+"""
+import logging
+import pytest
+from services import notification_service as notification_module
+from services.notification_service import NotificationService
+from services.state_store import MemoryStateStore
+
+class FakeDispatcher:
+    """Dispatcher que guarda los mensajes encolados y sus callbacks de fallo"""
+
+    def __init__(self, accept: bool = True):
+        self.accept = accept
+        self.messages = []
+
+    def enqueue(self, text, chat_id=None, on_failure=None):
+        if self.accept:
+            self.messages.append((text, on_failure))
+        return self.accept
+
+@pytest.fixture
+def configured(monkeypatch):
+    def configure(value: bool = True):
+        monkeypatch.setattr(notification_module, 'is_configured', lambda chat_id=None: value)
+    configure()
+    return configure
+
+def test_unconfigured_telegram_reserves_nothing(configured, caplog):
+    configured(False)
+    store, dispatcher = MemoryStateStore(), FakeDispatcher()
+    service = NotificationService(dispatcher=dispatcher, store=store)
+
+    with caplog.at_level(logging.DEBUG, logger=notification_module.__name__):
+        assert not service.send_no_tasks_notification(1, 'user')
+    assert store._data == {}
+    assert dispatcher.messages == []
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    assert not service.get_notification_status(1)['can_notify']
+
+def test_notifies_once_until_user_has_tasks(configured):
+    store, dispatcher = MemoryStateStore(), FakeDispatcher()
+    service = NotificationService(dispatcher=dispatcher, store=store)
+
+    assert service.send_no_tasks_notification(1, 'user')
+    assert not service.send_no_tasks_notification(1, 'user')
+    assert len(dispatcher.messages) == 1
+    assert service.get_notification_status(1)['was_notified']
+
+    # Con tareas nuevas se libera la marca, pero el intervalo mínimo sigue vigente
+    service.mark_user_has_tasks(1, 'user')
+    assert not service.get_notification_status(1)['was_notified']
+    assert not service.send_no_tasks_notification(1, 'user')
+
+def test_failed_delivery_releases_the_reservation(configured):
+    store, dispatcher = MemoryStateStore(), FakeDispatcher()
+    service = NotificationService(dispatcher=dispatcher, store=store)
+
+    assert service.send_no_tasks_notification(1, 'user')
+    _, on_failure = dispatcher.messages[0]
+    on_failure()
+    assert store._data == {}
+    assert service.send_no_tasks_notification(1, 'user')
+
+def test_full_queue_releases_the_reservation(configured):
+    store = MemoryStateStore()
+    service = NotificationService(dispatcher=FakeDispatcher(accept=False), store=store)
+    assert not service.send_no_tasks_notification(1, 'user')
+    assert store._data == {}
@@ -0,0 +1,156 @@
+"""
+Tests de la paginación keyset de los listados de administración: recorrido completo con
+cursores, dirección del orden y cursores inválidos
+"""
+import pytest
+from sqlalchemy import text
+from conftest import auth_headers
+from services.pagination import encode_cursor
+
+def _walk(fetch, **kwargs):
+    """Recorre un listado con páginas de 2; retorna (items, páginas)"""
+    items, pages, cursor = [], 0, None
+    while True:
+        page = fetch(cursor=cursor, limit=2, **kwargs)
+        items += page['items']
+        pages += 1
+        assert page['has_more'] == (page['next_cursor'] is not None)
+        cursor = page['next_cursor']
+        if not cursor:
+            return items, pages
+
+def _set_updated_at(db_service, values):
+    with db_service.db_manager.engine.begin() as conn:
+        for annotation_id, updated_at in values:
+            conn.execute(text("UPDATE annotations SET updated_at = :updated_at WHERE id = :id"),
+                         {'updated_at': updated_at, 'id': annotation_id})
+
+@pytest.fixture
+def admin(db_service):
+    return next(user for user in db_service.get_all_users() if user.role == 'admin')
+
+def test_images_round_trip_both_directions(db_service):
+    image_ids = [db_service.create_image(f"img{i}.png", f"texto {i}").id for i in range(5)]
+
+    items, pages = _walk(db_service.get_all_images_with_annotations)
+    assert [item['id'] for item in items] == image_ids
+    assert pages == 3
+    items, _ = _walk(db_service.get_all_images_with_annotations, sort='-id')
+    assert [item['id'] for item in items] == image_ids[::-1]
+
+def test_users_round_trip_by_username(db_service):
+    for name in ('carla', 'ana', 'bruno', 'dario'):
+        db_service.create_user(name, 'password123')
+    items, _ = _walk(db_service.get_all_users_with_stats)
+    assert [item['username'] for item in items] == ['admin', 'ana', 'bruno', 'carla', 'dario']
+
+def test_user_annotations_round_trip_both_directions(db_service):
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(5)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    tasks = sorted(db_service.claim_pending_tasks(user.id, 5), key=lambda task: task.annotation_id)
+    # Dos anotaciones con la misma fecha: el id desempata sin saltarse ni repetir filas
+    dates = ['2024-01-03 00:00:00.000000', '2024-01-01 00:00:00.000000', '2024-01-02 00:00:00.000000',
+             '2024-01-02 00:00:00.000000', '2024-01-04 00:00:00.000000']
+    _set_updated_at(db_service, [(task.annotation_id, date) for task, date in zip(tasks, dates)])
+    expected = [task.annotation_id for _, task in sorted(zip(dates, tasks), key=lambda pair: (pair[0], pair[1].annotation_id))]
+
+    items, _ = _walk(db_service.get_user_annotations_detailed, user_id=user.id, sort='updated_at')
+    assert [row.annotation_id for row in items] == expected
+    items, _ = _walk(db_service.get_user_annotations_detailed, user_id=user.id)
+    assert [row.annotation_id for row in items] == expected[::-1]
+
+@pytest.fixture
+def discrepancies(db_service, admin):
+    """El admin revisa 4 imágenes; user1 discrepa en 3 y user2 en 1. Retorna (user1, user2)"""
+    users = [db_service.create_user(f"user{i}", 'password123') for i in (1, 2)]
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(4)]
+    db_service.assign_tasks([admin.id] + [user.id for user in users], [image.id for image in images])
+    texts = {
+        admin.id: ['a', 'b', 'c', 'd'],
+        users[0].id: ['x', 'b', 'y', 'z'],
+        users[1].id: ['a', 'b', 'c', 'w'],
+    }
+    for user_id, corrections in texts.items():
+        tasks = {task.image_id: task for task in db_service.claim_pending_tasks(user_id, 4)}
+        for image, corrected_text in zip(images, corrections):
+            assert db_service.update_annotation(tasks[image.id].annotation_id, user_id, 'corrected', corrected_text)
+    return users
+
+def test_quality_control_round_trip_and_total(db_service, discrepancies):
+    first = db_service.get_quality_control_annotations(limit=2)
+    assert first['total_estimate'] == 4
+
+    items, pages = _walk(db_service.get_quality_control_annotations, sort='updated_at')
+    assert pages == 2
+    assert len({row.annotation_id for row in items}) == 4
+    keys = [(row.user_updated_at, row.annotation_id) for row in items]
+    assert keys == sorted(keys)
+    descending, _ = _walk(db_service.get_quality_control_annotations)
+    assert [row.annotation_id for row in descending] == [row.annotation_id for row in items][::-1]
+
+def test_quality_control_total_uses_the_page_filters(db_service, discrepancies):
+    user1, user2 = discrepancies
+    page = db_service.get_quality_control_annotations(user_ids=[user1.id])
+    assert {row.user_id for row in page['items']} == {user1.id}
+    assert page['total_estimate'] == len(page['items']) == 3
+    page = db_service.get_quality_control_annotations(usernames=[user2.username])
+    assert page['total_estimate'] == len(page['items']) == 1
+
+    with pytest.raises(ValueError):
+        db_service.get_quality_control_annotations(user_ids=['abc'])
+
+@pytest.mark.parametrize('method, kwargs, foreign_cursor, wrong_types', [
+    ('get_all_images_with_annotations', {}, encode_cursor('-id', 1), encode_cursor('id', '1')),
+    ('get_all_users_with_stats', {}, encode_cursor('id', 1), encode_cursor('username', 1, 1)),
+    ('get_user_annotations_detailed', {'user_id': 1},
+     encode_cursor('updated_at', '2024-01-01T00:00:00+00:00', 1), encode_cursor('-updated_at', 5, 1)),
+    ('get_quality_control_annotations', {},
+     encode_cursor('updated_at', '2024-01-01T00:00:00+00:00', 1), encode_cursor('-updated_at', 'ayer', 1)),
+])
+def test_invalid_cursors(db_service, method, kwargs, foreign_cursor, wrong_types):
+    fetch = getattr(db_service, method)
+    # Malformado, con otro número de valores, de otro orden y con valores del tipo incorrecto
+    for cursor in ('no-es-un-cursor', encode_cursor('solo-un-valor'), foreign_cursor, wrong_types):
+        with pytest.raises(ValueError):
+            fetch(cursor=cursor, **kwargs)
+
+def test_invalid_sort(db_service):
+    with pytest.raises(ValueError):
+        db_service.get_all_images_with_annotations(sort='username')
+    with pytest.raises(ValueError):
+        db_service.get_user_annotations_detailed(1, sort='id')
+    with pytest.raises(ValueError):
+        db_service.get_quality_control_annotations(sort='-id')
+
+def test_routes_return_400_on_bad_input(client, make_user):
+    headers = auth_headers(make_user('admin'))
+    user = make_user()
+    for url in ('/api/v2/admin/images', '/api/v2/admin/users', f"/api/v2/admin/users/{user.id}/annotations",
+                '/api/v2/admin/quality-control'):
+        assert client.get(url, headers=headers, query_string={'cursor': 'no-es-un-cursor'}).status_code == 400
+        assert client.get(url, headers=headers, query_string={'limit': 'muchos'}).status_code == 400
+    assert client.get('/api/v2/admin/images', headers=headers, query_string={'sort': 'nombre'}).status_code == 400
+    response = client.get('/api/v2/admin/quality-control', headers=headers, query_string={'user_ids': '1,abc'})
+    assert response.status_code == 400
+
+def test_routes_page_with_cursor(client, make_user, make_images, api_db_service):
+    headers = auth_headers(make_user('admin'))
+    user = make_user()
+    images = make_images(3)
+    api_db_service.assign_tasks([user.id], [image.id for image in images])
+
+    url = f"/api/v2/admin/users/{user.id}/annotations"
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 2, 'sort': 'updated_at'}
+        if cursor:
+            params['cursor'] = cursor
+        data = client.get(url, headers=headers, query_string=params).get_json()
+        assert data['page_size'] == 2
+        seen += [annotation['image_id'] for annotation in data['annotations']]
+        cursor = data['next_cursor']
+        if not data['has_more']:
+            break
+    assert sorted(seen) == sorted(image.id for image in images)
+    assert len(seen) == 3
@@ -0,0 +1,109 @@
+"""
+Tests de assign_random_tasks: muestreo por Image.random_key sin ORDER BY random()
+"""
+import pytest
+from sqlalchemy import event, text
+from conftest import auth_headers
+from models.database import DatabaseManager
+from services import database_service
+
+ADMIN_ID = 1
+
+def _create_images(db_service, keys):
+    """Imágenes con random_key fijo, para que el muestreo sea determinista"""
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(len(keys))]
+    with db_service.db_manager.engine.begin() as conn:
+        for image, key in zip(images, keys):
+            conn.execute(text("UPDATE images SET random_key = :key WHERE id = :id"), {'key': key, 'id': image.id})
+    return [image.id for image in images]
+
+def _assigned_image_ids(db_service, user_id):
+    session = db_service.get_session()
+    try:
+        rows = session.execute(text("SELECT image_id FROM annotations WHERE user_id = :user"), {'user': user_id})
+        return sorted(row.image_id for row in rows)
+    finally:
+        db_service.close_session(session)
+
+def test_samples_from_pivot_and_wraps_around(db_service, monkeypatch):
+    image_ids = _create_images(db_service, [0.1, 0.2, 0.3, 0.4, 0.5])
+    user = db_service.create_user('user', 'password123')
+    monkeypatch.setattr(database_service.random, 'random', lambda: 0.35)
+
+    assert db_service.assign_random_tasks(user.id, 4) == 4
+    # Desde el pivote 0.35: 0.4 y 0.5; luego se da la vuelta: 0.1 y 0.2
+    assert _assigned_image_ids(db_service, user.id) == sorted([image_ids[3], image_ids[4], image_ids[0], image_ids[1]])
+
+def test_does_not_sort_by_random(db_service):
+    _create_images(db_service, [0.1, 0.2, 0.3])
+    user = db_service.create_user('user', 'password123')
+    statements = []
+    event.listen(db_service.db_manager.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement.lower()))
+
+    assert db_service.assign_random_tasks(user.id, 2) == 2
+    assert not [statement for statement in statements if 'order by random()' in statement]
+
+def test_count_larger_than_available(db_service):
+    image_ids = _create_images(db_service, [0.1, 0.2, 0.3])
+    user = db_service.create_user('user', 'password123')
+
+    assert db_service.assign_random_tasks(user.id, 10) == 3
+    assert _assigned_image_ids(db_service, user.id) == sorted(image_ids)
+
+def test_priority_unannotated_skips_images_annotated_by_others(db_service):
+    image_ids = _create_images(db_service, [0.1, 0.2, 0.3])
+    other = db_service.create_user('other', 'password123')
+    user = db_service.create_user('user', 'password123')
+    db_service.assign_tasks([other.id], image_ids[:2])
+
+    assert db_service.assign_random_tasks(user.id, 3, priority_unannotated=True) == 1
+    assert _assigned_image_ids(db_service, user.id) == [image_ids[2]]
+
+def test_reviewed_by_admin_samples_only_missing_images(db_service):
+    image_ids = _create_images(db_service, [0.1, 0.2, 0.3])
+    user = db_service.create_user('user', 'password123')
+    db_service.assign_tasks([ADMIN_ID], image_ids)
+    admin_tasks = db_service.claim_pending_tasks(ADMIN_ID, 3)
+    for task in admin_tasks[:2]:
+        assert db_service.update_annotation(task.annotation_id, ADMIN_ID, 'approved')
+    reviewed = sorted(task.image_id for task in admin_tasks[:2])
+    db_service.assign_tasks([user.id], reviewed[:1])
+
+    assert db_service.assign_random_tasks(user.id, 3, priority_unannotated=False) == 1
+    assert _assigned_image_ids(db_service, user.id) == reviewed
+
+def test_unknown_user(db_service):
+    with pytest.raises(ValueError):
+        db_service.assign_random_tasks(9999, 1)
+
+def test_auto_assignments_route(client, make_user, make_images):
+    admin_headers = auth_headers(make_user('admin'))
+    user = make_user()
+    make_images(2)
+
+    response = client.post('/api/v2/admin/assignments/auto', headers=admin_headers,
+                           json={'count': 2, 'priority_unannotated': True, 'user_id': user.id})
+    assert response.status_code == 200
+    assert response.get_json()['assignments_created'] == 2
+
+    response = client.post('/api/v2/admin/assignments/auto', headers=admin_headers,
+                           json={'count': 0, 'priority_unannotated': True, 'user_id': user.id})
+    assert response.status_code == 400
+
+def test_images_without_random_key_are_sampled(db_service, monkeypatch):
+    """Filas insertadas fuera del ORM (random_key NULL) entran en la vuelta del muestreo"""
+    image_ids = _create_images(db_service, [0.1, None, None])
+    user = db_service.create_user('user', 'password123')
+    monkeypatch.setattr(database_service.random, 'random', lambda: 0.5)
+
+    assert db_service.assign_random_tasks(user.id, 3) == 3
+    assert _assigned_image_ids(db_service, user.id) == sorted(image_ids)
+
+def test_startup_fills_missing_random_keys(db_service):
+    _create_images(db_service, [0.1, None])
+    DatabaseManager(str(db_service.db_manager.engine.url)).create_tables()
+    with db_service.db_manager.engine.connect() as conn:
+        keys = [row.random_key for row in conn.execute(text("SELECT random_key FROM images ORDER BY id"))]
+    assert keys[0] == 0.1
+    assert 0 <= keys[1] < 1
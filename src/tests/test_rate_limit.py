@@ -0,0 +1,74 @@
+"""
+Tests del rate limiter de ventana deslizante (contadores en el almacén de estado)
+"""
+import uuid
+import pytest
+from services import security_utils
+from services.security_utils import sliding_window_hit
+from services.state_store import MemoryStateStore
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryStateStore()
+    monkeypatch.setattr(security_utils, 'state_store', store)
+    return store
+
+def test_allows_up_to_the_limit(store):
+    results = [sliding_window_hit('key', 5, 60, now=1200.0) for _ in range(6)]
+    assert [allowed for allowed, _, _ in results] == [True] * 5 + [False]
+    assert [remaining for _, remaining, _ in results] == [4, 3, 2, 1, 0, 0]
+
+def test_rejected_requests_do_not_consume_quota(store):
+    for _ in range(5):
+        sliding_window_hit('key', 5, 60, now=1200.0)
+    for _ in range(10):
+        assert not sliding_window_hit('key', 5, 60, now=1210.0)[0]
+    # La ventana anterior pesa la mitad: 5 * 0.5 + 1 <= 5
+    allowed, remaining, _ = sliding_window_hit('key', 5, 60, now=1290.0)
+    assert allowed
+    assert remaining == 1
+
+def test_retry_after_is_when_quota_frees_up(store):
+    for _ in range(5):
+        sliding_window_hit('key', 5, 60, now=1200.0)
+    allowed, _, reset = sliding_window_hit('key', 5, 60, now=1200.0)
+    assert not allowed
+    # En la ventana siguiente entra un request cuando 5 * (1 - t/60) + 1 <= 5, es decir t = 12
+    assert reset == 72
+    assert not sliding_window_hit('key', 5, 60, now=1200.0 + reset - 1)[0]
+    assert sliding_window_hit('key', 5, 60, now=1200.0 + reset)[0]
+
+def test_keys_are_independent(store):
+    for _ in range(5):
+        sliding_window_hit('a', 5, 60, now=1200.0)
+    assert not sliding_window_hit('a', 5, 60, now=1200.0)[0]
+    assert sliding_window_hit('b', 5, 60, now=1200.0)[0]
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryStateStore(max_keys=3)
+    for i in range(5):
+        store.incr(f"key{i}")
+    assert len(store._data) == 3
+    assert store.get('key0') is None
+    assert store.get('key4') == '1'
+
+def test_login_rate_limit_headers(client):
+    """/login: 5 intentos por minuto por IP, con headers RateLimit-* y Retry-After al bloquear"""
+    environ = {'REMOTE_ADDR': f"10.{uuid.uuid4().int % 256}.{uuid.uuid4().int % 256}.{uuid.uuid4().int % 256}"}
+    credentials = {'username': f"nobody-{uuid.uuid4().hex[:8]}", 'password': 'wrong'}
+
+    for attempt in range(5):
+        response = client.post('/api/v2/login', json=credentials, environ_base=environ)
+        assert response.status_code == 401
+        assert response.headers['RateLimit-Limit'] == '5'
+        assert int(response.headers['RateLimit-Remaining']) == 4 - attempt
+        assert int(response.headers['RateLimit-Reset']) > 0
+
+    response = client.post('/api/v2/login', json=credentials, environ_base=environ)
+    assert response.status_code == 429
+    assert response.headers['RateLimit-Remaining'] == '0'
+    assert int(response.headers['Retry-After']) > 0
+
+    # Otra IP tiene su propio cupo
+    response = client.post('/api/v2/login', json=credentials, environ_base={'REMOTE_ADDR': '192.0.2.1'})
+    assert response.status_code == 401
@@ -0,0 +1,102 @@
+"""
+Tests de la sesión compartida por petición: cada operación confirma su trabajo en un solo
+commit y los errores se propagan en lugar de convertirse en False
+"""
+import pytest
+from sqlalchemy import event, text
+
+@pytest.fixture
+def request_scope(app, db_service):
+    """Contexto de app (sesión compartida en g) y registro de los commits de db_service"""
+    commits = []
+    def record(session):
+        commits.append(session)
+    event.listen(db_service.db_manager.SessionLocal, 'after_commit', record)
+    with app.app_context():
+        yield commits
+    event.remove(db_service.db_manager.SessionLocal, 'after_commit', record)
+
+def _admin_id(db_service):
+    return next(user.id for user in db_service.get_all_users() if user.role == 'admin')
+
+@pytest.fixture
+def discrepancy(db_service):
+    """El admin y un usuario corrigen la misma imagen con textos distintos; retorna (user, admin_ann, user_ann)"""
+    admin_id = _admin_id(db_service)
+    user = db_service.create_user('user', 'password123')
+    image = db_service.create_image('img.png', 'texto')
+    db_service.assign_tasks([admin_id, user.id], [image.id])
+    annotations = {}
+    for user_id, corrected_text in ((admin_id, 'admin'), (user.id, 'usuario')):
+        task = db_service.claim_pending_tasks(user_id, 1)[0]
+        assert db_service.update_annotation(task.annotation_id, user_id, 'corrected', corrected_text)
+        annotations[user_id] = task.annotation_id
+    return user, annotations[admin_id], annotations[user.id]
+
+def test_consolidate_commits_once(db_service, discrepancy, request_scope):
+    user, admin_annotation_id, user_annotation_id = discrepancy
+    assert db_service.get_quality_control_annotations()['total_estimate'] == 1
+
+    assert db_service.consolidate_annotation(user_annotation_id, admin_annotation_id)
+    assert len(request_scope) == 1
+    admin = db_service.get_annotation_by_id(admin_annotation_id)
+    assert (admin.status, admin.corrected_text) == ('corrected', 'usuario')
+    assert db_service.get_quality_control_annotations()['total_estimate'] == 0
+    assert db_service.calculate_user_admin_agreement(user.id) == 100.0
+
+def test_consolidate_rejects_mismatched_annotations(db_service, discrepancy, request_scope):
+    _, admin_annotation_id, user_annotation_id = discrepancy
+    assert not db_service.consolidate_annotation(user_annotation_id, 9999)
+    assert request_scope == []
+
+def test_consolidate_failure_rolls_back_and_raises(db_service, discrepancy, request_scope, monkeypatch):
+    _, admin_annotation_id, user_annotation_id = discrepancy
+    def fail(session, image_ids):
+        raise RuntimeError('fallo de agreements')
+    monkeypatch.setattr(db_service, '_refresh_agreements', fail)
+
+    with pytest.raises(RuntimeError):
+        db_service.consolidate_annotation(user_annotation_id, admin_annotation_id)
+    assert request_scope == []
+    assert db_service.get_annotation_by_id(admin_annotation_id).corrected_text == 'admin'
+
+def test_update_annotation_raises_instead_of_returning_false(db_service, discrepancy, monkeypatch):
+    user, _, user_annotation_id = discrepancy
+    monkeypatch.setattr(db_service, '_refresh_agreements', lambda session, image_ids: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        db_service.update_annotation(user_annotation_id, user.id, 'approved')
+    with pytest.raises(ZeroDivisionError):
+        db_service.admin_update_annotation(user_annotation_id, 'approved')
+    # Sin anotación sigue siendo False (la ruta responde 404)
+    assert not db_service.update_annotation(9999, user.id, 'approved')
+    assert db_service.get_annotation_by_id(user_annotation_id).status == 'corrected'
+
+def test_new_reference_admin_rebuilds_agreements_in_the_same_commit(db_service, discrepancy, request_scope):
+    user, _, _ = discrepancy
+    assert db_service.calculate_user_admin_agreement(user.id) == 0.0
+
+    # El usuario pasa a ser admin pero no el de referencia (el de menor id): sin recálculo
+    assert db_service.update_user_role(user.id, 'admin')
+    assert len(request_scope) == 1
+    assert user.id in db_service.get_all_users_agreement_stats()
+    # Al eliminar el admin de referencia, el usuario pasa a serlo y se recalcula todo
+    assert db_service.delete_user_completely(_admin_id(db_service))
+    assert len(request_scope) == 2
+    assert db_service.get_all_users_agreement_stats() == {}
+
+def test_swallowed_read_errors_roll_back_the_shared_session(db_service, request_scope):
+    """Una lectura que falla y retorna un valor por defecto no deja abortada la transacción de la petición"""
+    rollbacks = []
+    def record(session):
+        rollbacks.append(session)
+    event.listen(db_service.db_manager.SessionLocal, 'after_rollback', record)
+    with db_service.db_manager.engine.begin() as conn:
+        conn.execute(text("DROP TABLE user_agreement_stats"))
+
+    assert db_service.get_all_users_agreement_stats() == {}
+    assert db_service.calculate_user_admin_agreement(_admin_id(db_service)) == 0.0
+    assert len(rollbacks) == 2
+    # La misma sesión sigue sirviendo para escribir y confirmar
+    assert db_service.create_image('img.png', 'texto')
+    assert len(request_scope) == 1
+    event.remove(db_service.db_manager.SessionLocal, 'after_rollback', record)
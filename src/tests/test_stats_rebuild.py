@@ -0,0 +1,70 @@
+"""
+Tests de la inicialización de los agregados materializados al arrancar: se reintenta hasta
+que una reconstrucción completa deja su marca
+"""
+import pytest
+from sqlalchemy import event, text
+from models.database import AGREEMENTS_BUILT, USER_COUNTERS_BUILT
+from services.database_service import DatabaseService
+
+def _fail_once(engine, table):
+    """Hace fallar el primer INSERT sobre `table` (p. ej. un statement_timeout)"""
+    def fail(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(f"INSERT INTO {table.upper()}"):
+            event.remove(engine, 'before_cursor_execute', fail)
+            raise RuntimeError('canceling statement due to statement timeout')
+    event.listen(engine, 'before_cursor_execute', fail)
+
+def _restart(db_service):
+    """Nuevo proceso sobre la misma BD"""
+    service = DatabaseService(str(db_service.db_manager.engine.url))
+    service.db_manager.create_tables()
+    return service
+
+@pytest.fixture
+def upgraded_db(db_service):
+    """BD con anotaciones pero sin contadores ni marcas, como una anterior a los agregados"""
+    user = db_service.create_user('user', 'password123')
+    images = [db_service.create_image(f"img{i}.png", f"texto {i}") for i in range(3)]
+    db_service.assign_tasks([user.id], [image.id for image in images])
+    admin_id = next(user.id for user in db_service.get_all_users() if user.role == 'admin')
+    db_service.assign_tasks([admin_id], [images[0].id])
+    for user_id, corrected_text in ((admin_id, 'admin'), (user.id, 'admin')):
+        task = db_service.claim_pending_tasks(user_id, 1)[0]
+        assert db_service.update_annotation(task.annotation_id, user_id, 'corrected', corrected_text)
+    with db_service.db_manager.engine.begin() as conn:
+        for table in ('user_annotation_counters', 'annotation_agreements', 'user_agreement_stats'):
+            conn.execute(text(f"DELETE FROM {table}"))
+    return user
+
+def test_failed_counter_rebuild_is_retried_on_restart(db_service, upgraded_db):
+    _fail_once(db_service.db_manager.engine, 'user_annotation_counters')
+    db_service.ensure_materialized_stats()
+    assert not db_service.is_built(USER_COUNTERS_BUILT)
+    assert db_service.get_user_stats(upgraded_db.id)['pending'] == 0
+
+    restarted = _restart(db_service)
+    restarted.ensure_materialized_stats()
+    assert restarted.is_built(USER_COUNTERS_BUILT)
+    assert restarted.get_user_stats(upgraded_db.id)['pending'] == 2
+
+def test_failed_agreement_rebuild_is_retried_on_restart(db_service, upgraded_db):
+    _fail_once(db_service.db_manager.engine, 'annotation_agreements')
+    db_service.ensure_materialized_stats()
+    assert db_service.is_built(USER_COUNTERS_BUILT)
+    assert not db_service.is_built(AGREEMENTS_BUILT)
+    assert db_service.get_all_users_agreement_stats() == {}
+
+    restarted = _restart(db_service)
+    restarted.ensure_materialized_stats()
+    assert restarted.is_built(AGREEMENTS_BUILT)
+    assert restarted.calculate_user_admin_agreement(upgraded_db.id) == 100.0
+
+def test_built_aggregates_are_not_rebuilt(db_service, upgraded_db):
+    db_service.ensure_materialized_stats()
+    statements = []
+    event.listen(db_service.db_manager.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    _restart(db_service).ensure_materialized_stats()
+    assert not [statement for statement in statements
+                if 'INSERT INTO user_annotation_counters' in statement or 'INSERT INTO annotation_agreements' in statement]
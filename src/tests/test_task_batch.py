@@ -0,0 +1,71 @@
+"""
+Tests de /api/v2/task/batch: reserva de lotes de tareas con metadatos para precarga
+"""
+from conftest import auth_headers
+
+def _user_with_tasks(make_user, make_images, api_db_service, count):
+    user = make_user()
+    images = make_images(count)
+    api_db_service.assign_tasks([user.id], [image.id for image in images])
+    return user, images
+
+def test_batch_leases_distinct_tasks(client, make_user, make_images, api_db_service):
+    """Dos lotes seguidos no repiten tareas mientras dure la reserva"""
+    user, images = _user_with_tasks(make_user, make_images, api_db_service, 3)
+    headers = auth_headers(user)
+
+    first = client.get('/api/v2/task/batch?n=2', headers=headers)
+    assert first.status_code == 200
+    data = first.get_json()
+    assert data['count'] == 2
+    assert data['lease_seconds'] > 0
+    for task in data['tasks']:
+        assert task['image_url'] == f"/images/{task['image_path']}"
+        assert task['image_size'] == 256
+        assert task['image_etag']
+
+    second = client.get('/api/v2/task/batch?n=2', headers=headers).get_json()
+    assert second['count'] == 1
+    leased = {task['annotation_id'] for task in data['tasks'] + second['tasks']}
+    assert len(leased) == 3
+    assert {task['image_id'] for task in data['tasks'] + second['tasks']} == {image.id for image in images}
+
+def test_batch_redelivers_when_all_tasks_are_leased(client, make_user, make_images, api_db_service):
+    """Con todas las tareas reservadas se vuelven a entregar las más antiguas"""
+    user, _ = _user_with_tasks(make_user, make_images, api_db_service, 2)
+    headers = auth_headers(user)
+
+    first = client.get('/api/v2/task/batch?n=2', headers=headers).get_json()
+    again = client.get('/api/v2/task/batch?n=2', headers=headers).get_json()
+    assert {task['annotation_id'] for task in again['tasks']} == {task['annotation_id'] for task in first['tasks']}
+
+def test_batch_skips_submitted_tasks(client, make_user, make_images, api_db_service):
+    user, _ = _user_with_tasks(make_user, make_images, api_db_service, 2)
+    headers = auth_headers(user)
+
+    tasks = client.get('/api/v2/task/batch?n=2', headers=headers).get_json()['tasks']
+    for task in tasks:
+        response = client.put(f"/api/v2/annotations/{task['annotation_id']}", headers=headers,
+                              json={'status': 'approved'})
+        assert response.status_code == 200
+
+    assert client.get('/api/v2/task/batch?n=2', headers=headers).status_code == 204
+
+def test_batch_with_pack(client, make_user, make_images, api_db_service):
+    """Con pack=true cada tarea indica su posición dentro del paquete de imágenes"""
+    user, _ = _user_with_tasks(make_user, make_images, api_db_service, 2)
+    data = client.get('/api/v2/task/batch?n=2&pack=true', headers=auth_headers(user)).get_json()
+
+    pack = data['pack']
+    pack_bytes = client.get(pack['url']).data
+    assert len(pack_bytes) == pack['size']
+    for task in data['tasks']:
+        image_bytes = client.get(task['image_url']).data
+        assert pack_bytes[task['pack_offset']:task['pack_offset'] + task['pack_length']] == image_bytes
+
+def test_batch_rejects_invalid_n(client, make_user):
+    response = client.get('/api/v2/task/batch?n=abc', headers=auth_headers(make_user()))
+    assert response.status_code == 400
+
+def test_batch_requires_auth(client):
+    assert client.get('/api/v2/task/batch').status_code == 401
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Benchmark del costo de autenticación por request: jwt_required y admin_required con y sin
+el caché de tokens verificados de JWTService, más verify_access_token por separado.
+
+Uso: python utils/bench_auth.py [iteraciones] [repeticiones]
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from services.jwt_service import jwt_service, jwt_required, admin_required
+
+def _timeit(fn, iterations: int, repeat: int) -> float:
+    """Mejor tiempo por llamada (microsegundos) entre `repeat` corridas de `iterations` llamadas"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / iterations * 1e6
+
+def run_benchmark(iterations: int = 20000, repeat: int = 5):
+    app = Flask(__name__)
+    token = jwt_service.create_access_token(1, 'admin', 'admin')
+    view = lambda: None
+    cases = {
+        'verify_access_token': lambda: jwt_service.verify_access_token(token),
+        'jwt_required': jwt_required(view),
+        'admin_required': admin_required(view),
+    }
+    cache_size = jwt_service.verify_cache_size
+
+    print(f"{iterations} llamadas por corrida | mejor de {repeat} corridas | caché de {cache_size} tokens\n")
+    print(f"{'caso':<22}{'sin caché (µs)':>16}{'con caché (µs)':>16}{'speedup':>10}")
+    with app.test_request_context('/', headers={'Authorization': f'Bearer {token}'}):
+        for name, fn in cases.items():
+            jwt_service.verify_cache_size = 0
+            slow = _timeit(fn, iterations, repeat)
+            jwt_service.verify_cache_size = cache_size
+            jwt_service.clear_verify_cache()
+            fast = _timeit(fn, iterations, repeat)
+            print(f"{name:<22}{slow:>16.2f}{fast:>16.2f}{slow / fast:>9.1f}x")
+
+    print(f"\nCaché: {jwt_service.verify_cache_hits} aciertos, {jwt_service.verify_cache_misses} fallos")
+
+if __name__ == '__main__':
+    run_benchmark(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización JSON: proveedor por defecto de Flask (json estándar) frente a
+FastJSONProvider (orjson si está instalado) con las formas reales de las respuestas:
+páginas de /admin/images y /admin/quality-control, historial de tareas y exportación jsonl.
+
+Uso: python utils/bench_json.py [filas_por_payload] [repeticiones]
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from models.dto import TaskRow, QualityControlRow
+from services.export_service import export_record
+from services.json_provider import FastJSONProvider, JSON_BACKEND, dumps_bytes
+
+def build_payloads(rows: int) -> dict:
+    """Payloads sintéticos con las mismas claves y tipos que las respuestas de la API"""
+    now = datetime.now(timezone.utc)
+    images_page = {
+        'images': [{
+            'id': i,
+            'image_path': f'img_{i:011d}.png',
+            'initial_ocr_text': f'texto ocr {i} ' * 3,
+            'total_annotations': 3, 'pending': 1, 'corrected': 1, 'approved': 1, 'discarded': 0
+        } for i in range(rows)],
+        'page_size': rows, 'has_more': True, 'next_cursor': 'WyJpZCIsMTAwXQ', 'total_estimate': 200000
+    }
+    quality_page = {
+        'quality_control_data': [QualityControlRow(
+            i, i, f'img_{i:011d}.png', f'texto ocr {i}', 7, 'anotador', f'texto usuario {i}',
+            'corrected', now - timedelta(seconds=i), i + 1, f'texto admin {i}', 'approved', now
+        ).to_dict() for i in range(rows)],
+        'page_size': rows, 'has_more': False, 'next_cursor': None, 'total_estimate': rows
+    }
+    history = {
+        'history': [TaskRow(
+            i, i, f'img_{i:011d}.png', f'texto ocr {i}', 'corrected', f'corregido {i}', now - timedelta(seconds=i)
+        ).to_dict() for i in range(rows)]
+    }
+    export_rows = [_ExportRow(i, f'img_{i:011d}.png', 'approved', f'corregido ñ {i}', now) for i in range(rows)]
+    return {'admin_images': images_page, 'quality_control': quality_page, 'task_history': history,
+            '_export_rows': export_rows}
+
+class _ExportRow:
+    """Fila con los atributos que consume export_record"""
+    __slots__ = ('image_id', 'image_path', 'user_id', 'username', 'status', 'corrected_text', 'updated_at')
+
+    def __init__(self, image_id, image_path, status, corrected_text, updated_at):
+        self.image_id = image_id
+        self.image_path = image_path
+        self.user_id = 7
+        self.username = 'anotador'
+        self.status = status
+        self.corrected_text = corrected_text
+        self.updated_at = updated_at
+
+def _stdlib_iso(payload):
+    """El proveedor por defecto emite datetimes como HTTP date; se convierten antes para comparar lo mismo"""
+    if isinstance(payload, dict):
+        return {key: _stdlib_iso(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [_stdlib_iso(value) for value in payload]
+    if isinstance(payload, datetime):
+        return payload.isoformat()
+    return payload
+
+def _timeit(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(rows: int = 1000, repeat: int = 20):
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = FastJSONProvider(app)
+    payloads = build_payloads(rows)
+    export_rows = payloads.pop('_export_rows')
+
+    print(f"Backend rápido: {JSON_BACKEND} | {rows} filas por payload | mejor de {repeat} repeticiones\n")
+    print(f"{'payload':<18}{'default (ms)':>14}{'rápido (ms)':>14}{'speedup':>10}{'MB/s rápido':>14}")
+    with app.app_context():
+        for name, payload in payloads.items():
+            iso_payload = _stdlib_iso(payload)
+            size = len(fast_provider.dumps(payload).encode('utf-8'))
+            slow = _timeit(lambda: default_provider.response(iso_payload), repeat)
+            fast = _timeit(lambda: fast_provider.response(payload), repeat)
+            print(f"{name:<18}{slow * 1000:>14.2f}{fast * 1000:>14.2f}{slow / fast:>9.1f}x{size / fast / 1e6:>14.1f}")
+
+        slow = _timeit(lambda: [json.dumps(export_record(row), ensure_ascii=False) for row in export_rows], repeat)
+        fast = _timeit(lambda: [dumps_bytes(export_record(row)) for row in export_rows], repeat)
+        print(f"{'export_jsonl':<18}{slow * 1000:>14.2f}{fast * 1000:>14.2f}{slow / fast:>9.1f}x{'':>14}")
+
+if __name__ == '__main__':
+    run_benchmark(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    )
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Script para precalcular images.content_hash (SHA-256 de cada archivo), que la app usa como
+ETag de /images/<filename> y para detectar imágenes duplicadas.
+Sin --rehash solo procesa las imágenes que aún no tienen hash.
+
+Uso: python utils/build_image_hashes.py [--rehash] [database_url]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database_service import DatabaseService
+from services.image_service import image_service
+
+BATCH_SIZE = 1000
+
+def build_image_hashes(database_url=None, rehash: bool = False):
+    """Calcula y guarda el hash de contenido de las imágenes presentes en disco"""
+    db_service = DatabaseService(database_url)
+    db_service.db_manager.create_tables()
+    hashed = missing = 0
+    last_id = 0
+    while True:
+        batch = db_service.get_images_for_hashing(last_id, BATCH_SIZE, include_hashed=rehash)
+        if not batch:
+            break
+        last_id = batch[-1].id
+        hashes = []
+        for image_id, image_path in batch:
+            path = image_service.resolve_path(image_service.filename_for(image_path))
+            try:
+                hashes.append((image_id, image_service.compute_content_hash(path)))
+            except (OSError, TypeError):
+                missing += 1
+        hashed += db_service.set_image_hashes(hashes)
+        print(f"Procesadas hasta imagen {last_id}: {hashed} hashes guardados, {missing} archivos faltantes")
+    print(f"Listo: {hashed} hashes guardados, {missing} archivos faltantes")
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--rehash']
+    build_image_hashes(args[0] if args else None, rehash='--rehash' in sys.argv[1:])
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Script para armar el almacén de imágenes mapeable (IMAGE_STORE=mmap): concatena todas las
+imágenes de IMAGES_FOLDER en un único archivo con un índice ordenado filename -> offset.
+El archivo se reemplaza de forma atómica; los workers lo vuelven a mapear solos al detectar
+el cambio. Las imágenes agregadas después se sirven desde disco hasta el próximo armado.
+
+Uso: python utils/build_image_store.py [ruta_destino]
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from services.image_service import image_service, APP_ROOT
+from services.image_store import write_image_store
+
+def build_image_store(path=None):
+    """Escribe el almacén con las imágenes presentes en disco"""
+    config = Config.from_env()
+    path = path or config.IMAGE_STORE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(APP_ROOT, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    started = time.time()
+    with os.scandir(image_service.images_folder) as entries:
+        files = [(entry.name, entry.path) for entry in entries if entry.is_file()]
+    print(f"Armando {path} con {len(files)} imágenes de {image_service.images_folder}...")
+    count = write_image_store(path, files)
+    print(f"Listo: {count} imágenes, {os.path.getsize(path)} bytes en {time.time() - started:.1f}s")
+
+if __name__ == '__main__':
+    build_image_store(sys.argv[1] if len(sys.argv) > 1 else None)
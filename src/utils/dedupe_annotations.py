@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Script para eliminar anotaciones repetidas por (usuario, imagen) y crear el índice único
+uq_annotation_user_image, que la aplicación no crea mientras haya duplicados.
+
+De cada grupo se conserva la anotación revisada (no pending) más reciente; a igualdad, la de
+mayor id. Antes de borrar, las filas eliminadas se respaldan en un archivo JSONL. Luego se
+recalculan los contadores y los agreements. Las eliminadas se informan en el feed de cambios.
+
+Uso: python utils/dedupe_annotations.py [--dry-run] [--backup archivo.jsonl] [--database-url URL]
+"""
+import os
+import sys
+import time
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, text
+from models.database import Annotation, record_annotation_deletions
+from services.database_service import DatabaseService
+from services.json_provider import dumps_bytes
+
+# Anotaciones sobrantes de cada grupo (user_id, image_id)
+DUPLICATES_QUERY = (
+    "SELECT id, user_id, image_id, status, corrected_text, updated_at FROM ("
+    "SELECT annotations.*, ROW_NUMBER() OVER ("
+    "PARTITION BY user_id, image_id "
+    "ORDER BY CASE WHEN status = 'pending' THEN 1 ELSE 0 END, updated_at DESC, id DESC"
+    ") AS position FROM annotations) ranked WHERE position > 1 ORDER BY id"
+)
+
+def dedupe_annotations(database_url=None, backup_path=None, dry_run=False):
+    """Respalda y elimina las anotaciones duplicadas; retorna cuántas se eliminaron"""
+    db_service = DatabaseService(database_url)
+    db_manager = db_service.db_manager
+    db_manager.create_tables()
+
+    with db_manager.engine.connect() as conn:
+        duplicates = conn.execute(text(DUPLICATES_QUERY)).mappings().all()
+    print(f"Anotaciones repetidas por (usuario, imagen): {len(duplicates)}")
+    if not duplicates or dry_run:
+        return 0
+
+    backup_path = backup_path or f"annotations_duplicates_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+    with open(backup_path, 'wb') as f:
+        for row in duplicates:
+            f.write(dumps_bytes(dict(row)) + b'\n')
+    print(f"Respaldo escrito en {backup_path}")
+
+    ids = [row['id'] for row in duplicates]
+    # Por sesión, para que las lápidas del feed de cambios se numeren al confirmar
+    session = db_manager.get_session()
+    try:
+        for start in range(0, len(ids), 1000):
+            batch = Annotation.id.in_(ids[start:start + 1000])
+            record_annotation_deletions(session, batch)
+            session.execute(delete(Annotation).where(batch))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    print(f"Eliminadas {len(ids)} anotaciones")
+
+    # Con la tabla ya sin duplicados, upgrade_schema crea el índice único
+    db_manager.create_tables()
+    print(f"Contadores recalculados: {db_service.rebuild_user_counters()} filas")
+    print(f"Agreements recalculados: {db_service.rebuild_agreements()} comparaciones")
+    return len(ids)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Eliminar anotaciones repetidas por (usuario, imagen)')
+    parser.add_argument('--dry-run', action='store_true', help='Solo contar los duplicados')
+    parser.add_argument('--backup', help='Archivo JSONL para las filas eliminadas (por defecto con fecha)')
+    parser.add_argument('--database-url', help='URL de la base de datos (por defecto DATABASE_URL)')
+    args = parser.parse_args()
+    dedupe_annotations(args.database_url, args.backup, args.dry_run)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Script de importación masiva de imágenes: recorre un directorio, toma el texto OCR inicial de
+un JSON {nombre_de_imagen: texto}, hashea en paralelo, descarta duplicados por hash de contenido
+(o por nombre) e inserta por lotes. Se puede relanzar: lo ya importado se omite.
+Si el directorio no es IMAGES_FOLDER, las imágenes nuevas se copian ahí.
+
+Uso: python utils/ingest_images.py <directorio> <ocr.json> [--workers N] [--batch-size N] [--database-url URL]
+"""
+import os
+import sys
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database_service import DatabaseService
+from services.image_ingest_service import ImageIngestService
+
+def ingest_images(directory, ocr_path, workers=None, batch_size=None, database_url=None):
+    """Importa las imágenes del directorio mostrando el progreso por lote"""
+    db_service = DatabaseService(database_url)
+    db_service.db_manager.create_tables()
+    ingest_service = ImageIngestService(db_service)
+    if workers:
+        ingest_service.workers = workers
+    if batch_size:
+        ingest_service.batch_size = batch_size
+
+    ocr = ingest_service.load_ocr_dictionary(ocr_path)
+    print(f"Diccionario OCR: {len(ocr)} entradas. Importando {directory} con {ingest_service.workers} procesos...")
+
+    def progress(report):
+        rate = report.scanned / report.elapsed_seconds if report.elapsed_seconds else 0
+        print(f"  {report.scanned} encontradas ({rate:.0f}/s): {report.inserted} nuevas, "
+              f"{report.duplicate_content + report.duplicate_name} duplicadas, "
+              f"{report.missing_ocr} sin OCR, {report.unreadable} ilegibles")
+
+    report = ingest_service.ingest(directory, ocr, progress)
+    print(f"Listo en {report.elapsed_seconds}s: {report.inserted} imágenes importadas de {report.scanned} "
+          f"({report.duplicate_content} con contenido repetido, {report.duplicate_name} con nombre repetido, "
+          f"{report.missing_ocr} sin OCR, {report.unreadable} ilegibles)")
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Importación masiva de imágenes')
+    parser.add_argument('directory', help='Directorio con las imágenes (se recorre recursivamente)')
+    parser.add_argument('ocr_file', help='JSON {nombre_de_imagen: texto OCR inicial}')
+    parser.add_argument('--workers', type=int, help='Procesos para hashear (por defecto IMAGE_INGEST_WORKERS)')
+    parser.add_argument('--batch-size', type=int, help='Imágenes por lote (por defecto IMAGE_INGEST_BATCH_SIZE)')
+    parser.add_argument('--database-url', help='URL de la base de datos (por defecto DATABASE_URL)')
+    args = parser.parse_args()
+    ingest_images(args.directory, args.ocr_file, args.workers, args.batch_size, args.database_url)
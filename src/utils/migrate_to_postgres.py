@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 from models.database import DatabaseManager, User, Image, Annotation
+from services.database_service import DatabaseService
 
 def migrate_data(sqlite_url, postgres_url):
     # Conectarse a SQLite y PostgreSQL
@@ -49,6 +50,11 @@ def migrate_data(sqlite_url, postgres_url):
             postgres_session.add(new_annotation)
 
         postgres_session.commit()
+
+        print("→ Recalculando contadores de estadísticas...")
+        postgres_service = DatabaseService(postgres_url)
+        postgres_service.rebuild_user_counters()
+        postgres_service.rebuild_agreements()
         print("✅ Migración completada exitosamente.")
     except Exception as e:
         postgres_session.rollback()
@@ -13,6 +13,7 @@ from sqlalchemy import func
 sys.path.append(str(Path(__file__).parent))
 
 from models.database import DatabaseManager, User, Image, Annotation
+from services.database_service import DatabaseService
 
 class DataMigrator:
     """Clase para migrar datos de JSON a SQLite"""
@@ -20,6 +21,7 @@ class DataMigrator:
     def __init__(self, json_path, corrected_json_path=None, database_url='sqlite:///labeling_app.db'):
         self.json_path = json_path
         self.corrected_json_path = corrected_json_path or json_path.replace('.json', '_corrected.json')
+        self.database_url = database_url
         self.db_manager = DatabaseManager(database_url)
         
     def load_json_data(self):
@@ -253,6 +255,12 @@ class DataMigrator:
         # 5. Asignar algunas tareas de ejemplo
         self.assign_sample_tasks()
         
+        # 6. Recalcular contadores y agreements (las anotaciones se insertaron directamente)
+        db_service = DatabaseService(self.database_url)
+        rows = db_service.rebuild_user_counters()
+        comparisons = db_service.rebuild_agreements()
+        print(f"Contadores de estadísticas recalculados: {rows} (agreements: {comparisons})")
+        
         print("=== Migración completada exitosamente ===")
         print("\nCredenciales por defecto:")
         print("  Admin: admin / admin123")
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Script para recalcular las estadísticas materializadas (contadores por usuario y estado,
+agreement con el admin)
+Útil tras importar anotaciones directamente en la base de datos o para corregir desvíos
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database_service import DatabaseService
+
+def rebuild_stats(database_url=None):
+    """Recalcula contadores y agreements desde la tabla annotations"""
+    db_service = DatabaseService(database_url)
+    db_service.db_manager.create_tables()
+    print("Recalculando contadores de anotaciones...")
+    rows = db_service.rebuild_user_counters()
+    print(f"Contadores recalculados: {rows} filas")
+    print("Recalculando agreements con el admin...")
+    comparisons = db_service.rebuild_agreements()
+    print(f"Agreements recalculados: {comparisons} comparaciones")
+
+if __name__ == '__main__':
+    rebuild_stats(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -10,16 +10,15 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', "123456789:ABCdefGhIjKlMnOpQrStUvWxYz")
 ADMIN_CHAT_ID = os.getenv('TELEGRAM_ADMIN_CHAT_ID', "123456789")
 
-def send_telegram_message(text: str, chat_id: Optional[str] = None) -> bool:
+def is_configured(chat_id: Optional[str] = None) -> bool:
     """
-    Envía un mensaje por Telegram
+    Indica si hay token y chat configurados (no los valores de ejemplo)
     
     Args:
-        text: Texto del mensaje
         chat_id: ID del chat (por defecto usa ADMIN_CHAT_ID)
     
     Returns:
-        bool: True si el mensaje se envió correctamente
+        bool: True si se pueden enviar mensajes
     """
     if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "123456789:ABCdefGhIjKlMnOpQrStUvWxYz":
         logger.warning("Token de Telegram no configurado correctamente")
@@ -29,6 +28,23 @@ def send_telegram_message(text: str, chat_id: Optional[str] = None) -> bool:
     if not target_chat_id or target_chat_id == "123456789":
         logger.warning("Chat ID de Telegram no configurado correctamente")
         return False
+    return True
+
+def send_telegram_message(text: str, chat_id: Optional[str] = None) -> bool:
+    """
+    Envía un mensaje por Telegram
+    
+    Args:
+        text: Texto del mensaje
+        chat_id: ID del chat (por defecto usa ADMIN_CHAT_ID)
+    
+    Returns:
+        bool: True si el mensaje se envió correctamente
+    """
+    if not is_configured(chat_id):
+        return False
+    
+    target_chat_id = chat_id or ADMIN_CHAT_ID
     
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {